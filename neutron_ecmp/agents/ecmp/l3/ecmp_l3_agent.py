@@ -13,18 +13,60 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import time
+
+import netaddr
 from neutron.common import rpc as n_rpc
-from neutron.agent.linux import ip_lib
+from neutron.agent.l3 import namespaces
+from neutron_ecmp._i18n import _
+from neutron_ecmp.api.definitions import ecmp as ecmp_ext
+from neutron_ecmp.agents.ecmp.l3 import route_cache
+from neutron_ecmp.agents.ecmp.l3 import route_compiler
+from neutron_ecmp.agents.ecmp.l3 import route_programmer
+from neutron_ecmp.agents.ecmp.l3 import snapshot
+from neutron_ecmp.common import ecmp_digest
+from neutron_ecmp.common import ecmp_metrics
 from neutron_lib.agent import l3_extension
+from neutron_lib import context as n_context
 from oslo_config import cfg
 from oslo_log import log as logging
 import oslo_messaging
+from oslo_service import loopingcall
+from osprofiler import profiler
 
 LOG = logging.getLogger(__name__)
 
+ECMPReportOpts = [
+    cfg.IntOpt('realization_report_interval', default=30, min=0,
+               help=_('Seconds between two reports of the ecmp realization '
+                      'latencies to the plugin, 0 disables the reports.')),
+    cfg.IntOpt('realization_report_max_routes', default=1000, min=0,
+               help=_('Maximum number of realized ecmp routes kept for the '
+                      'next report, older ones are only counted in the '
+                      'histograms.')),
+    cfg.IntOpt('status_report_interval', default=2, min=1,
+               help=_('Seconds between two reports of the ecmp route '
+                      'revisions realized by the agent to the plugin.')),
+    cfg.IntOpt('status_report_max_routes', default=1000, min=1,
+               help=_('Maximum number of ecmp route statuses sent in one '
+                      'report, the others wait for the next ones.')),
+]
+cfg.CONF.register_opts(ECMPReportOpts, 'ecmp')
+
+REALIZATION_STAGES = ('rpc_lag', 'queue_wait', 'programming', 'realization')
+
 
 class EcmpL3PluginApi(object):
-    """ Agent side of the ecmp agent to ecmp Plugin RPC API."""
+    """ Agent side of the ecmp agent to ecmp Plugin RPC API.
+
+    API version history:
+        1.0 - Initial version.
+        1.1 - Add report_ecmp_realization.
+        1.2 - Add report_ecmp_route_status.
+        1.3 - Add get_changed_routes_of_routers.
+        1.4 - Add get_route_of_router_if_changed.
+    """
     def __init__(self, topic, host):
 
         self.host = host
@@ -36,9 +78,43 @@ class EcmpL3PluginApi(object):
         cctxt = self.client.prepare()
         return cctxt.call(context, 'get_route_of_router', router_id=router_id, host=self.host)
 
+    def get_route_of_router_if_changed(self, context, router_id, revision=None):
+        """ Get ecmp route of router, unless still at revision"""
+        cctxt = self.client.prepare(version='1.4')
+        return cctxt.call(context, 'get_route_of_router_if_changed', router_id=router_id,
+                          host=self.host, revision=revision)
+
+    def report_ecmp_realization(self, context, histograms, routes):
+        """ Report the realization latencies of the ecmp routes"""
+        cctxt = self.client.prepare(version='1.1')
+        cctxt.cast(context, 'report_ecmp_realization', host=self.host,
+                   histograms=histograms, routes=routes)
+
+    def report_ecmp_route_status(self, context, statuses):
+        """ Report the revisions of the ecmp routes realized by the agent"""
+        cctxt = self.client.prepare(version='1.2')
+        cctxt.cast(context, 'report_ecmp_route_status', host=self.host,
+                   statuses=statuses)
+
+    def get_changed_routes_of_routers(self, context, digests):
+        """ Get the ecmp routes of the routers whose digest changed"""
+        cctxt = self.client.prepare(version='1.3')
+        return cctxt.call(context, 'get_changed_routes_of_routers', host=self.host,
+                          digests=digests)
+
 
 class ECMPL3AgentExtension(l3_extension.L3AgentExtension):
-    """ECMP Agent support to be used by Neutron L3 agent."""
+    """ECMP Agent support to be used by Neutron L3 agent.
+
+    API version history:
+        1.0 - Initial version.
+        1.1 - Add update_ecmp_routes.
+        1.2 - Add dump_ecmp_routes.
+        1.3 - Add resync_ecmp_routers.
+        1.4 - Add purge_ecmp_routers.
+    """
+    target = oslo_messaging.Target(version='1.4')
+
     def initialize(self, connection, driver_type):
         self._register_rpc_consumers(connection)
 
@@ -60,9 +136,48 @@ class ECMPL3AgentExtension(l3_extension.L3AgentExtension):
         LOG.info("Initializing ECMP agent")
         self.agent_api = None
         self.conf = conf
+        self._route_programmers = {}
+        self._histograms = ecmp_metrics.Histograms(REALIZATION_STAGES)
+        self._realized_routes = collections.deque(
+            maxlen=self.conf.ecmp.realization_report_max_routes)
+        self._route_statuses = collections.OrderedDict()
+        self._route_compilers = {}
+        self._route_cache = route_cache.RouteCache()
+        # router id -> route_cache.RouteTable
+        self._router_routes = {}
+        # router id -> revision of the routes last fetched from the plugin
+        self._router_revisions = {}
+        self._snapshot_dirty = False
+        self._routers_to_verify = set()
+        self._snapshot_routes = {}
+        if self.conf.ecmp.snapshot_interval:
+            self._snapshot_path = snapshot.get_snapshot_path(self.conf)
+            self._snapshot_routes = dict(
+                (router_id, self._route_cache.new_table(routes))
+                for router_id, routes in snapshot.load_snapshot(self._snapshot_path).items())
+            LOG.info('ecmp: loaded the routes of %d routers from snapshot %s',
+                     len(self._snapshot_routes), self._snapshot_path)
 
         self.start_rpc_listeners(conf)
         self.ecmpplugin_rpc = EcmpL3PluginApi('q-ecmp-plugin', host)
+        if self.conf.ecmp.realization_report_interval:
+            self._report_loop = loopingcall.FixedIntervalLoopingCall(
+                self._report_realization)
+            self._report_loop.start(
+                interval=self.conf.ecmp.realization_report_interval)
+        self._status_loop = loopingcall.FixedIntervalLoopingCall(
+            self._report_route_statuses)
+        self._status_loop.start(
+            interval=self.conf.ecmp.status_report_interval)
+        if self.conf.ecmp.snapshot_interval:
+            self._snapshot_loop = loopingcall.FixedIntervalLoopingCall(
+                self._write_snapshot)
+            self._snapshot_loop.start(
+                interval=self.conf.ecmp.snapshot_interval)
+            self._verify_loop = loopingcall.FixedIntervalLoopingCall(
+                self._verify_restored_routers)
+            self._verify_loop.start(
+                interval=self.conf.ecmp.status_report_interval)
 
     def _get_router_info_for_router_id(self, router_id):
         """Returns the  router info object on which to apply the ecmp."""
@@ -70,74 +185,431 @@ class ECMPL3AgentExtension(l3_extension.L3AgentExtension):
             LOG.exception("ECMP RPC call failed; L3 agent_api failure")
         return self.agent_api.get_router_info(router_id)
 
+    def _get_route_programmer(self, namespace):
+        programmer = self._route_programmers.get(namespace)
+        if programmer is None:
+            programmer = route_programmer.get_route_programmer(namespace)
+            self._route_programmers[namespace] = programmer
+        return programmer
+
+    def _forget_route_programmer(self, router_id):
+        # qr devices may have been (re)created with kernel defaults, so the
+        # cached proxy state of the namespace can not be trusted anymore.
+        self._route_programmers.pop(namespaces.build_ns_name(
+            namespaces.NS_PREFIX, router_id), None)
+
+    def _get_route_compiler(self, router_id):
+        compiler = self._route_compilers.get(router_id)
+        if compiler is None:
+            compiler = route_compiler.RouteCompiler()
+            self._route_compilers[router_id] = compiler
+        return compiler
+
+    def _program_compiled_routes(self, programmer, compiler, vips=()):
+        """Program the prefixes of the router changed since the last time."""
+        compiled = compiler.compile()
+        replaced, deleted = compiler.get_changes(compiled, vips)
+        LOG.debug('ecmp: %d vips compiled into %d prefixes, replace %d, delete %d',
+                  len(compiler), len(compiled), len(replaced), len(deleted))
+        try:
+            # the prefixes taking over the traffic of the deleted ones are
+            # in place before these are deleted
+            for prefix, next_hops in sorted(replaced.items()):
+                programmer.replace_route(prefix, next_hops)
+            for prefix in deleted:
+                programmer.delete_route(prefix)
+            programmer.flush()
+        except Exception:
+            compiler.set_programmed(compiled, succeeded=False)
+            raise
+        compiler.set_programmed(compiled)
+
+    def _program_ecmp_route(self, programmer, compiler, ecmproute):
+        """Queue the proxy changes of a route, and its routing to compiler."""
+        vip = ecmproute['vip']
+        ip_version = route_programmer.get_ip_version(vip)
+        operation = ecmproute['operation']
+        if operation == 'delete' or not ecmproute['next_hops']:
+            # a pool route without member is not routed either
+            compiler.set_route(vip, None)
+        else:
+            compiler.set_route(vip, ecmproute['next_hops'])
+
+        set_proxy_parameter_qrs = ecmproute.get('set_arp_proxy_qrs')
+        if set_proxy_parameter_qrs:
+            programmer.set_proxy(set_proxy_parameter_qrs, True, ip_version)
+
+        unset_proxy_parameter_qrs = ecmproute.get('unset_arp_proxy_qrs')
+        if unset_proxy_parameter_qrs:
+            programmer.set_proxy(unset_proxy_parameter_qrs, False, ip_version)
+
+        # a vip prefix can not be answered for address by address
+        if ip_version == 6 and netaddr.IPNetwork(vip).size == 1:
+            if operation == 'delete' or not ecmproute['next_hops']:
+                qr_interfaces = []
+            else:
+                qr_interfaces = ecmproute.get('qr_interfaces',
+                                              set_proxy_parameter_qrs or [])
+            programmer.set_proxy_neighbors({vip: qr_interfaces})
+
     def update_ecmp_route(self, context, ecmproute, host):
         LOG.info('Get notify from plugin to update ecmp route : %s', ecmproute)
-        router_info = self._get_router_info_for_router_id(ecmproute['router_id'])
-        if router_info:
+        self.update_ecmp_routes(context, [ecmproute], host)
 
-            operation = ecmproute['operation']
-            if operation == 'delete':
-                cmd = ['ip', 'route', 'delete', 'to', ecmproute['vip']]
-            else:
-                cmd = ['ip', 'route', 'replace', 'to', ecmproute['vip']]
-                for nexthop in ecmproute['next_hops']:
-                    cmd.append('nexthop')
-                    cmd.append('via')
-                    cmd.append(nexthop)
-            LOG.debug('ecmp route cmd : %s', cmd)
+    def update_ecmp_routes(self, context, ecmproutes, host):
+        LOG.debug('Get notify from plugin to update ecmp routes : %s', ecmproutes)
+        received_at = time.time()
+        routes_of_router = collections.OrderedDict()
+        for ecmproute in ecmproutes:
+            if not self._accept_route_revision(ecmproute):
+                LOG.debug('ecmp: drop outdated revision %s of route %s',
+                          ecmproute.get('revision'), ecmproute.get('id'))
+                continue
+            routes_of_router.setdefault(ecmproute['router_id'], []).append(ecmproute)
+            if ecmproute.get('dispatched_at'):
+                self._histograms.add('rpc_lag', received_at - ecmproute['dispatched_at'])
+        for router_id, routes in routes_of_router.items():
+            router_info = self._get_router_info_for_router_id(router_id)
+            if not router_info:
+                continue
+            self._record_router_routes(router_id, routes)
             router_ns = router_info.ns_name
             LOG.debug('the router namespace is %s', router_ns)
-            ip_wrapper = ip_lib.IPWrapper(namespace=router_ns)
-            ip_wrapper.netns.execute(cmd, check_exit_code=False)
-            set_proxy_parameter_qrs = ecmproute.get('set_arp_proxy_qrs')
-            if set_proxy_parameter_qrs:
-                LOG.debug('set proxy parameter to 1 for %s', set_proxy_parameter_qrs)
-                for qr in set_proxy_parameter_qrs:
-                    cmd = ['sysctl', '-w', 'net.ipv4.conf.%s.proxy_arp=1' % qr]
-                    ip_wrapper.netns.execute(cmd, check_exit_code=False)
-                    cmd = ['sysctl', '-w', 'net.ipv4.conf.%s.proxy_arp_pvlan=1' % qr]
-                    ip_wrapper.netns.execute(cmd, check_exit_code=False)
-
-            unset_proxy_parameter_qrs = ecmproute.get('unset_arp_proxy_qrs')
-            if unset_proxy_parameter_qrs:
-                LOG.debug('set proxy parameter to 0 for %s', unset_proxy_parameter_qrs)
-                for qr in unset_proxy_parameter_qrs:
-                    cmd = ['sysctl', '-w', 'net.ipv4.conf.%s.proxy_arp=0' % qr]
-                    ip_wrapper.netns.execute(cmd, check_exit_code=False)
-                    cmd = ['sysctl', '-w', 'net.ipv4.conf.%s.proxy_arp_pvlan=0' % qr]
-                    ip_wrapper.netns.execute(cmd, check_exit_code=False)
+            started_at = time.time()
+            self._histograms.add('queue_wait', started_at - received_at)
+            status = ecmp_ext.STATUS_ACTIVE
+            try:
+                with profiler.Trace('ecmp_program_routes',
+                                    info={'router_id': router_id,
+                                          'routes': len(routes)}):
+                    programmer = self._get_route_programmer(router_ns)
+                    compiler = self._get_route_compiler(router_id)
+                    for ecmproute in routes:
+                        self._program_ecmp_route(programmer, compiler, ecmproute)
+                    self._set_hash_policies(programmer, self._router_routes[router_id])
+                    self._program_compiled_routes(
+                        programmer, compiler, [ecmproute['vip'] for ecmproute in routes])
+            except Exception:
+                LOG.exception('ecmp: failed to program %d routes of router %s',
+                              len(routes), router_id)
+                self._forget_route_programmer(router_id)
+                status = ecmp_ext.STATUS_ERROR
+            programmed_at = time.time()
+            self._histograms.add('programming', programmed_at - started_at)
+            for ecmproute in routes:
+                if ecmproute['operation'] != 'delete':
+                    self._record_route_status(ecmproute, status)
+                if status == ecmp_ext.STATUS_ACTIVE:
+                    self._record_realization(ecmproute, programmed_at)
+
+    def dump_ecmp_routes(self, context, router_ids=None):
+        """Read-only RPC dumping the ecmp state of the hosted routers.
+
+        :param router_ids: routers to dump, the ones which are not hosted by
+               the agent are skipped; all the known routers by default.
+        :returns: dict of router id to the routes via next hops read from
+                  its namespace, the prefixes the agent programmed and
+                  whether it aggregates vips.
+        """
+        if router_ids is None:
+            router_ids = list(self._router_routes)
+        dump = {}
+        for router_id in router_ids:
+            router_info = self.agent_api.get_router_info(router_id)
+            if not router_info:
+                continue
+            compiler = self._route_compilers.get(router_id)
+            data = {'programmed': sorted(compiler.programmed) if compiler else [],
+                    'aggregate_vips': self.conf.ecmp.aggregate_vips}
+            try:
+                data['routes'] = route_programmer.RouteProgrammer(
+                    router_info.ns_name).get_routes()
+            except Exception as e:
+                LOG.warning('ecmp: failed to dump the routes of router %s: %s', router_id, e)
+                data['error'] = str(e)
+            dump[router_id] = data
+        return dump
+
+    def resync_ecmp_routers(self, context, router_ids):
+        """Fetch and program again all the routes of routers.
+
+        Sent once per router instead of the notifications of its routes,
+        e.g. after they were bulk loaded; the routers which are not hosted
+        by the agent are skipped.
+        """
+        LOG.debug('ecmp: resync the routes of routers %s', router_ids)
+        for router_id in router_ids:
+            if not self._get_router_info_for_router_id(router_id):
+                continue
+            # e.g. a qr device of the router was removed
+            self._forget_route_programmer(router_id)
+            try:
+                self._set_router_routes(router_id, self._fetch_router_routes(context, router_id))
+            except Exception:
+                LOG.exception('ecmp: failed to resync the routes of router %s', router_id)
+
+    def purge_ecmp_routers(self, context, router_ids):
+        """Forget all the ecmp state of deleted routers.
+
+        Sent to every agent once per deleted router, whose routes were
+        removed with it; the prefixes still programmed in a namespace which
+        outlives its router are deleted.
+        """
+        LOG.debug('ecmp: purge the routes of routers %s', router_ids)
+        for router_id in router_ids:
+            compiler = self._route_compilers.get(router_id)
+            router_info = self.agent_api.get_router_info(router_id)
+            if compiler is not None and compiler.programmed and router_info:
+                try:
+                    programmer = self._get_route_programmer(router_info.ns_name)
+                    for prefix in sorted(compiler.programmed):
+                        programmer.delete_route(prefix)
+                    programmer.flush()
+                except Exception:
+                    LOG.exception('ecmp: failed to purge the routes of router %s', router_id)
+            self._forget_router(router_id)
+
+    def _accept_route_revision(self, ecmproute):
+        """Return whether a notified route is newer than what was applied.
+
+        Casts sent by different plugin workers may be received out of
+        order; the revision_number of a route, kept after its deletion
+        until its router is removed, tells which one is the latest.
+        """
+        route_id = ecmproute.get('id')
+        revision = ecmproute.get('revision')
+        routes = self._router_routes.get(ecmproute['router_id'])
+        if not route_id or revision is None or routes is None:
+            return True
+        current = routes.get_revision(route_id)
+        if current is not None and current > revision:
+            return False
+        routes.set_revision(route_id, revision)
+        return True
+
+    def _record_route_status(self, ecmproute, status):
+        if not ecmproute.get('id'):
+            return
+        revision = ecmproute.get('revision', 0)
+        previous = self._route_statuses.pop(ecmproute['id'], None)
+        if previous and previous['revision'] > revision:
+            status, revision = previous['status'], previous['revision']
+        self._route_statuses[ecmproute['id']] = {'id': ecmproute['id'],
+                                                 'revision': revision,
+                                                 'status': status}
+
+    def _report_route_statuses(self):
+        """Send the pending route statuses, at most max_routes at a time.
+
+        Only the last status of a route is kept until it is sent, the ones
+        of a failed report are sent again with the next one.
+        """
+        statuses = []
+        while self._route_statuses and len(statuses) < self.conf.ecmp.status_report_max_routes:
+            statuses.append(self._route_statuses.popitem(last=False)[1])
+        if not statuses:
+            return
+        try:
+            self.ecmpplugin_rpc.report_ecmp_route_status(
+                n_context.get_admin_context_without_session(), statuses)
+        except Exception:
+            LOG.exception('ecmp: failed to report the status of %d routes', len(statuses))
+            for status in statuses:
+                # a status recorded meanwhile is at least as recent
+                self._route_statuses.setdefault(status['id'], status)
+
+    def _record_realization(self, ecmproute, programmed_at):
+        if not ecmproute.get('timestamp'):
+            return
+        realization = programmed_at - ecmproute['timestamp']
+        self._histograms.add('realization', realization)
+        LOG.debug('ecmp route %s of router %s realized in %.3fs, trace %s',
+                  ecmproute['vip'], ecmproute['router_id'], realization,
+                  ecmproute.get('trace_id'))
+        self._realized_routes.append({'router_id': ecmproute['router_id'],
+                                      'vip': ecmproute['vip'],
+                                      'operation': ecmproute['operation'],
+                                      'trace_id': ecmproute.get('trace_id'),
+                                      'realization': realization})
+
+    def _report_realization(self):
+        histograms = self._histograms.to_dict()
+        routes = list(self._realized_routes)
+        if not routes and not any(sum(counts) for counts in histograms.values()):
+            return
+        self._histograms.reset()
+        self._realized_routes.clear()
+        try:
+            self.ecmpplugin_rpc.report_ecmp_realization(
+                n_context.get_admin_context_without_session(), histograms, routes)
+        except Exception:
+            LOG.exception('ecmp: failed to report the realization of %d routes', len(routes))
+
+    def _record_router_routes(self, router_id, ecmproutes):
+        """Keep the notified routes of a router for the snapshot."""
+        routes = self._router_routes.get(router_id)
+        if routes is None:
+            routes = self._router_routes[router_id] = self._route_cache.new_table()
+        for ecmproute in ecmproutes:
+            routes.set_route(ecmproute)
+        self._snapshot_dirty = True
+
+    def _write_snapshot(self):
+        if not self._snapshot_dirty:
+            return
+        self._snapshot_dirty = False
+        routes_of_router = dict((router_id, list(routes.get_routes()))
+                                for router_id, routes in self._router_routes.items())
+        try:
+            snapshot.write_snapshot(self._snapshot_path, routes_of_router)
+        except Exception:
+            LOG.exception('ecmp: failed to write snapshot %s', self._snapshot_path)
+            self._snapshot_dirty = True
+
+    def _verify_restored_routers(self):
+        """Fetch again the routers restored from the snapshot which changed.
+
+        The plugin compares a digest of the routes of each router with its
+        own, only the routes of the routers which differ are returned.
+        """
+        if not self._routers_to_verify:
+            return
+        router_ids = sorted(self._routers_to_verify)[:self.conf.ecmp.snapshot_verify_batch_size]
+        digests = dict((router_id, ecmp_digest.get_routes_digest(
+            self._router_routes[router_id].get_routes() if router_id in self._router_routes else []))
+            for router_id in router_ids)
+        try:
+            changed = self.ecmpplugin_rpc.get_changed_routes_of_routers(
+                n_context.get_admin_context_without_session(), digests)
+        except Exception:
+            LOG.exception('ecmp: failed to check %d routers restored from the snapshot',
+                          len(router_ids))
+            return
+        self._routers_to_verify.difference_update(router_ids)
+        LOG.debug('ecmp: %d of %d restored routers changed meanwhile', len(changed), len(router_ids))
+        for router_id, ecmp_routes in changed.items():
+            if router_id not in self._router_routes:
+                # deleted meanwhile
+                continue
+            try:
+                self._set_router_routes(router_id, ecmp_routes)
+            except Exception:
+                LOG.exception('ecmp: failed to update the routes of router %s', router_id)
 
     def add_router(self, context, data):
         router_id = data['id']
-        ecmp_routes = self.ecmpplugin_rpc.get_route_of_router(context, router_id)
+        self._forget_route_programmer(router_id)
+        restored = self._snapshot_routes.pop(router_id, None)
+        if restored is not None:
+            LOG.debug('ecmp: restore the routes of router %s from the snapshot', router_id)
+            self._routers_to_verify.add(router_id)
+            ecmp_routes = list(restored.get_routes())
+            restored.clear()
+        else:
+            ecmp_routes = self._fetch_router_routes(context, router_id)
+        self._set_router_routes(router_id, ecmp_routes)
+
+    def _fetch_router_routes(self, context, router_id):
+        """Return the routes of a router from the plugin.
+
+        The plugin only sends them when they changed since they were last
+        fetched, the cached routes are used otherwise: they are the fetched
+        ones, with the notifications of the changes they already included.
+        """
+        routes = self._router_routes.get(router_id)
+        revision = self._router_revisions.get(router_id) if routes is not None else None
+        response = self.ecmpplugin_rpc.get_route_of_router_if_changed(context, router_id, revision)
+        self._router_revisions[router_id] = response['revision']
+        if response['routes'] is None:
+            LOG.debug('ecmp: the routes of router %s are still at revision %s', router_id, revision)
+            return list(routes.get_routes())
+        return response['routes']
+
+    def _set_router_routes(self, router_id, ecmp_routes):
+        """Program all the routes of a router, replacing what it had."""
         LOG.debug("this router's ecmp_route : %s", ecmp_routes)
-        if ecmp_routes:
+        routes = self._router_routes.get(router_id)
+        if routes is None:
+            routes = self._router_routes[router_id] = self._route_cache.new_table()
+        routes.load(ecmp_routes)
+        self._snapshot_dirty = True
+        compiler = route_compiler.RouteCompiler()
+        previous = self._route_compilers.get(router_id)
+        if previous is not None:
+            # deleted if the new routes no longer have them
+            compiler.programmed = dict.fromkeys(previous.programmed)
+        self._route_compilers[router_id] = compiler
+        if ecmp_routes or compiler.programmed:
             router_info = self._get_router_info_for_router_id(router_id)
-            router_ns = router_info.ns_name
-            ip_wrapper = ip_lib.IPWrapper(namespace=router_ns)
-            qr_interfaces = []
+            if router_info is None:
+                return
+            try:
+                self._program_router(router_info.ns_name, compiler, ecmp_routes, routes,
+                                     read_programmed=previous is None)
+            except Exception:
+                self._forget_route_programmer(router_id)
+                for route in ecmp_routes:
+                    self._record_route_status(route, ecmp_ext.STATUS_ERROR)
+                raise
             for route in ecmp_routes:
-                cmd = ['ip', 'route', 'replace', 'to', route['vip']]
-                for nexthop in route['next_hops']:
-                    cmd.append('nexthop')
-                    cmd.append('via')
-                    cmd.append(nexthop)
-                ip_wrapper.netns.execute(cmd, check_exit_code=False)
-                qr_interfaces.extend(route['qr_interfaces'])
-            LOG.debug("add_router in ecmp to set qr interfaces %s", qr_interfaces)
-            for qr in set(qr_interfaces):
-                cmd = ['sysctl', '-w', 'net.ipv4.conf.%s.proxy_arp=1' % qr]
-                ip_wrapper.netns.execute(cmd, check_exit_code=False)
-                cmd = ['sysctl', '-w', 'net.ipv4.conf.%s.proxy_arp_pvlan=1' % qr]
-                ip_wrapper.netns.execute(cmd, check_exit_code=False)
+                self._record_route_status(route, ecmp_ext.STATUS_ACTIVE)
+
+    @staticmethod
+    def _set_hash_policies(programmer, routes):
+        """Set the hash policy of the routes of a router to its namespace.
+
+        The policy is the one of the namespace, rather than of a route: it
+        is the one set by the routes of the router, and the default one
+        once none sets one any more.
+        """
+        for ip_version in (4, 6):
+            programmer.set_hash_policy(routes.get_hash_policy(ip_version), ip_version)
+
+    def _program_router(self, namespace, compiler, ecmp_routes, routes, read_programmed=False):
+        """Program all the routes of a router, routes being their RouteTable."""
+        programmer = self._get_route_programmer(namespace)
+        if read_programmed:
+            # the routes may already be in the namespace, e.g. programmed
+            # by a previous run of the agent, before aggregating them
+            compiler.assume_programmed(programmer.get_routes(),
+                                       [route['vip'] for route in ecmp_routes])
+        qr_interfaces = {4: [], 6: []}
+        proxy_neighbors = {}
+        for route in ecmp_routes:
+            if not route['next_hops']:
+                continue
+            ip_version = route_programmer.get_ip_version(route['vip'])
+            compiler.set_route(route['vip'], route['next_hops'])
+            qr_interfaces[ip_version].extend(route['qr_interfaces'])
+            if ip_version == 6 and netaddr.IPNetwork(route['vip']).size == 1:
+                proxy_neighbors[route['vip']] = route['qr_interfaces']
+        LOG.debug("add_router in ecmp to set qr interfaces %s", qr_interfaces)
+        for ip_version, interfaces in qr_interfaces.items():
+            if interfaces:
+                programmer.set_proxy(interfaces, True, ip_version)
+        if proxy_neighbors:
+            programmer.set_proxy_neighbors(proxy_neighbors)
+        self._set_hash_policies(programmer, routes)
+        self._program_compiled_routes(programmer, compiler)
 
     def update_router(self, context, updated_router):
         """The update_router method is just a synonym for add_router"""
-        pass
-
+        self._forget_route_programmer(updated_router['id'])
 
     def delete_router(self, context, new_router):
-        pass
+        self._forget_router(new_router['id'])
+
+    def _forget_router(self, router_id):
+        self._forget_route_programmer(router_id)
+        self._route_compilers.pop(router_id, None)
+        self._router_revisions.pop(router_id, None)
+        self._routers_to_verify.discard(router_id)
+        for routes in (self._router_routes.pop(router_id, None),
+                       self._snapshot_routes.pop(router_id, None)):
+            if routes is not None:
+                # release the next hops and interfaces the routes share
+                routes.clear()
+                self._snapshot_dirty = True
 
     def ha_state_change(self, context, data):
         pass
@@ -150,6 +622,3 @@ class L3withECMP(ECMPL3AgentExtension):
         else:
             self.conf = cfg.CONF
         super(L3withECMP, self).__init__(host=self.conf.host, conf=self.conf)
-
-
-
@@ -0,0 +1,298 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Compact cache of the ecmp routes of the routers of an agent.
+
+An agent may hold the routes of hundreds of thousands of vips: rather than
+a dict of strings and lists per route, the routes of a router are fixed
+size records of one bytearray, sorted by route id. Ids and addresses are
+packed, the next hops and the qr interfaces of a route are groups interned
+in tables shared by all the routers, as routes behind the same load
+balancer share them, and referenced by their index. A route takes
+RECORD.size bytes, plus its share of its groups.
+"""
+
+import array
+import collections
+import socket
+import struct
+import uuid
+
+from six.moves import intern
+
+from neutron_ecmp.api.definitions import ecmp as ecmp_ext
+
+# id, revision (-1 when unknown), vip version (0 when the route is deleted
+# and only its revision is kept), vip address, vip prefix length, next
+# hop group, qr interface group, flags and hash policy
+RECORD = struct.Struct('!16sqB16sBIIB')
+ID_SIZE = 16
+REVISION = struct.Struct('!q')
+REVISION_OFFSET = ID_SIZE
+# the vip was notified with its prefix length, e.g. 10.0.0.1/32
+FLAG_PREFIXED = 0x80
+HASH_POLICIES = (None,) + ecmp_ext.HASH_POLICIES
+FAMILIES = {4: socket.AF_INET, 16: socket.AF_INET6}
+
+
+def pack_address(address):
+    return socket.inet_pton(socket.AF_INET6 if ':' in address else socket.AF_INET, address)
+
+
+def pack_addresses(addresses):
+    """Pack addresses into a sorted group, each prefixed by its size."""
+    packed = sorted(pack_address(address) for address in addresses)
+    return b''.join(struct.pack('B', len(address)) + address for address in packed)
+
+
+def unpack_addresses(data):
+    addresses = []
+    offset = 0
+    while offset < len(data):
+        size = struct.unpack_from('B', data, offset)[0]
+        addresses.append(socket.inet_ntop(FAMILIES[size], data[offset + 1:offset + 1 + size]))
+        offset += 1 + size
+    return addresses
+
+
+class GroupTable(object):
+    """Interned groups of values, shared by the routes referencing them.
+
+    A group is referenced by its index, 0 being the empty group, and is
+    dropped when the last route referencing it releases it.
+    """
+    __slots__ = ('_indexes', '_groups', '_references', '_free')
+
+    def __init__(self):
+        self._indexes = {}
+        self._groups = [None]
+        self._references = array.array('l', [0])
+        self._free = []
+
+    def __len__(self):
+        return len(self._indexes)
+
+    def acquire(self, group):
+        if not group:
+            return 0
+        index = self._indexes.get(group)
+        if index is None:
+            if self._free:
+                index = self._free.pop()
+                self._groups[index] = group
+            else:
+                index = len(self._groups)
+                self._groups.append(group)
+                self._references.append(0)
+            self._indexes[group] = index
+        self._references[index] += 1
+        return index
+
+    def release(self, index):
+        if not index:
+            return
+        self._references[index] -= 1
+        if not self._references[index]:
+            del self._indexes[self._groups[index]]
+            self._groups[index] = None
+            self._free.append(index)
+
+    def get(self, index):
+        return self._groups[index]
+
+
+class RouteCache(object):
+    """The group tables shared by the route tables of an agent."""
+    __slots__ = ('next_hops', 'interfaces')
+
+    def __init__(self):
+        self.next_hops = GroupTable()
+        self.interfaces = GroupTable()
+
+    def new_table(self, routes=()):
+        table = RouteTable(self)
+        if routes:
+            table.load(routes)
+        return table
+
+
+class RouteTable(object):
+    """The routes of a router, and the revisions of its deleted routes.
+
+    The routes are the ones notified to the agent, keyed by id: the ones
+    without id are not kept. The revision of a deleted route is kept until
+    the table is cleared, to drop its outdated notifications. The routes
+    setting each hash policy are counted per address family.
+    """
+    __slots__ = ('_cache', '_records', '_routes', '_hash_policies')
+
+    def __init__(self, cache):
+        self._cache = cache
+        self._records = bytearray()
+        self._routes = 0
+        self._hash_policies = collections.Counter()
+
+    def __len__(self):
+        """Return the number of routes, deleted ones excluded."""
+        return self._routes
+
+    def _find(self, key):
+        """Return the offset of the record of an id, and whether it exists."""
+        records = self._records
+        low, high = 0, len(records) // RECORD.size
+        while low < high:
+            middle = (low + high) // 2
+            offset = middle * RECORD.size
+            current = records[offset:offset + ID_SIZE]
+            if current < key:
+                low = middle + 1
+            elif current > key:
+                high = middle
+            else:
+                return offset, True
+        return low * RECORD.size, False
+
+    def _pack(self, route, revision=None):
+        if revision is None:
+            revision = -1 if route.get('revision') is None else route['revision']
+        address, prefixed, prefixlen = route['vip'].partition('/')
+        address = pack_address(address)
+        flags = HASH_POLICIES.index(route.get('hash_policy'))
+        if prefixed:
+            flags |= FLAG_PREFIXED
+        return RECORD.pack(
+            uuid.UUID(route['id']).bytes, revision, 4 if len(address) == 4 else 6, address,
+            int(prefixlen) if prefixed else len(address) * 8,
+            self._cache.next_hops.acquire(pack_addresses(route.get('next_hops') or ())),
+            self._cache.interfaces.acquire(tuple(sorted(
+                intern(str(name)) for name in route.get('qr_interfaces') or ()))),
+            flags)
+
+    def _count_hash_policy(self, record, count):
+        fields = RECORD.unpack_from(record)
+        hash_policy = fields[7] & ~FLAG_PREFIXED
+        if fields[2] and hash_policy:
+            key = (fields[2], hash_policy)
+            self._hash_policies[key] += count
+            if not self._hash_policies[key]:
+                del self._hash_policies[key]
+
+    def _release(self, offset):
+        fields = RECORD.unpack_from(self._records, offset)
+        if fields[2]:
+            self._cache.next_hops.release(fields[5])
+            self._cache.interfaces.release(fields[6])
+            self._count_hash_policy(self._records[offset:offset + RECORD.size], -1)
+            self._routes -= 1
+
+    def _unpack(self, fields):
+        route_id, revision, version, address, prefixlen, next_hops, interfaces, flags = fields
+        address = socket.inet_ntop(FAMILIES[4 if version == 4 else 16],
+                                   address[:4] if version == 4 else address)
+        if flags & FLAG_PREFIXED:
+            address = '%s/%d' % (address, prefixlen)
+        return {'id': str(uuid.UUID(bytes=route_id)),
+                'revision': None if revision < 0 else revision,
+                'vip': address,
+                'next_hops': unpack_addresses(self._cache.next_hops.get(next_hops) or b''),
+                'qr_interfaces': list(self._cache.interfaces.get(interfaces) or ()),
+                'hash_policy': HASH_POLICIES[flags & ~FLAG_PREFIXED]}
+
+    def get_revision(self, route_id):
+        offset, found = self._find(uuid.UUID(route_id).bytes)
+        if not found:
+            return None
+        revision = REVISION.unpack_from(self._records, offset + REVISION_OFFSET)[0]
+        return None if revision < 0 else revision
+
+    def set_revision(self, route_id, revision):
+        """Record the revision of a route, before or without its route."""
+        key = uuid.UUID(route_id).bytes
+        offset, found = self._find(key)
+        if found:
+            REVISION.pack_into(self._records, offset + REVISION_OFFSET, revision)
+        else:
+            self._records[offset:offset] = RECORD.pack(key, revision, 0, b'', 0, 0, 0, 0)
+
+    def set_route(self, route):
+        """Add or replace a notified route, or delete it."""
+        if not route.get('id'):
+            return
+        if route.get('operation') == 'delete':
+            self.delete_route(route['id'])
+            return
+        record = self._pack(route)
+        offset, found = self._find(record[:ID_SIZE])
+        if found:
+            self._release(offset)
+            self._records[offset:offset + RECORD.size] = record
+        else:
+            self._records[offset:offset] = record
+        self._count_hash_policy(record, 1)
+        self._routes += 1
+
+    def delete_route(self, route_id):
+        offset, found = self._find(uuid.UUID(route_id).bytes)
+        if found:
+            self._release(offset)
+            # keep the id and the revision
+            self._records[offset + REVISION_OFFSET + REVISION.size:offset + RECORD.size] = (
+                RECORD.pack(b'', 0, 0, b'', 0, 0, 0, 0)[REVISION_OFFSET + REVISION.size:])
+
+    def load(self, routes):
+        """Replace the routes and the revisions with the ones of routes."""
+        self.clear()
+        records = {}
+        for route in routes:
+            if not route.get('id'):
+                continue
+            record = self._pack(route)
+            previous = records.get(record[:ID_SIZE])
+            if previous is not None:
+                fields = RECORD.unpack(previous)
+                self._cache.next_hops.release(fields[5])
+                self._cache.interfaces.release(fields[6])
+            records[record[:ID_SIZE]] = record
+        self._records = bytearray(b''.join(record for key, record in sorted(records.items())))
+        self._routes = len(records)
+        for record in records.values():
+            self._count_hash_policy(record, 1)
+
+    def clear(self):
+        """Release the groups of the routes, then forget everything."""
+        for offset in range(0, len(self._records), RECORD.size):
+            self._release(offset)
+        self._records = bytearray()
+        self._routes = 0
+        self._hash_policies.clear()
+
+    def get_hash_policy(self, ip_version):
+        """Return the hash policy of the routes of an address family.
+
+        The plugin rejects routes of a router with different policies; if
+        some still differ, the policy of most of them wins.
+        """
+        counts = [(count, -index) for (version, index), count in self._hash_policies.items()
+                  if version == ip_version]
+        if not counts:
+            return None
+        return HASH_POLICIES[-max(counts)[1]]
+
+    def get_routes(self):
+        """Yield the routes, as dicts of snapshot.ROUTE_KEYS."""
+        for offset in range(0, len(self._records), RECORD.size):
+            fields = RECORD.unpack_from(self._records, offset)
+            if fields[2]:
+                yield self._unpack(fields)
@@ -0,0 +1,234 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import bisect
+
+import netaddr
+from oslo_config import cfg
+
+
+def get_overlapping_vips(networks):
+    """Return the vips whose network overlaps the one of another vip.
+
+    :param networks: dict of vip to its IPNetwork.
+    """
+    overlapping = set()
+    current = None
+    for vip, network in sorted(networks.items(),
+                               key=lambda item: (item[1].version, item[1].first, -item[1].last)):
+        if (current is not None and current[1].version == network.version and
+                network.first <= current[1].last):
+            overlapping.add(vip)
+            overlapping.add(current[0])
+            if network.last > current[1].last:
+                current = (vip, network)
+        else:
+            current = (vip, network)
+    return overlapping
+
+
+class RouteCompiler(object):
+    """Compile the ecmp routes of one router into the prefixes to program.
+
+    The vips of the router which share the same next hops are aggregated
+    into the fewest prefixes covering exactly them, with cidr_merge, so a
+    router with thousands of vips behind the same next hops programs a
+    handful of routes. A vip overlapping another vip, which is only
+    possible when vips are prefixes, is programmed as it is: merging it
+    could change which route the longest prefix match selects. For the same
+    reason, the vips in a more specific prefix of another route of the
+    namespace, e.g. an extra route found in the kernel, are not merged
+    into a prefix covering it.
+
+    Only the next hop groups changed since the last compilation are merged
+    again. The compiled prefixes are diffed against the programmed ones,
+    so that a change only programs the prefixes it affects.
+
+    The vips of a group share its next hops tuple, and only the networks
+    of the vips which are prefixes are kept: the other ones are parsed
+    again when their group is merged.
+    """
+
+    def __init__(self, aggregate=None):
+        if aggregate is None:
+            aggregate = cfg.CONF.ecmp.aggregate_vips
+        self.aggregate = aggregate
+        # vip -> next hops
+        self._routes = {}
+        # next hops -> vips, and next hops -> the tuple shared by the vips
+        self._groups = {}
+        self._next_hops = {}
+        # next hops -> merged IPNetworks, sorted
+        self._merged = {}
+        self._dirty = set()
+        # vip -> IPNetwork, of the vips which are prefixes
+        self._prefix_networks = {}
+        self._overlapping = set()
+        # IPNetworks of the kernel routes which are not ecmp routes
+        self._foreign = []
+        # prefix -> next hops programmed, None when unknown
+        self.programmed = {}
+
+    def __len__(self):
+        return len(self._routes)
+
+    def set_route(self, vip, next_hops):
+        """Set the next hops of a vip, none removes it."""
+        next_hops = tuple(sorted(next_hops or ()))
+        previous = self._routes.get(vip)
+        if previous == next_hops:
+            return
+        if previous is not None:
+            self._groups[previous].discard(vip)
+            self._dirty.add(previous)
+            del self._routes[vip]
+        if not next_hops:
+            self._prefix_networks.pop(vip, None)
+            return
+        next_hops = self._next_hops.setdefault(next_hops, next_hops)
+        self._groups.setdefault(next_hops, set()).add(vip)
+        self._routes[vip] = next_hops
+        self._dirty.add(next_hops)
+        if previous is None and '/' in vip:
+            network = netaddr.IPNetwork(vip)
+            if network.size > 1:
+                self._prefix_networks[vip] = network
+
+    def _get_network(self, vip):
+        network = self._prefix_networks.get(vip)
+        return network if network is not None else netaddr.IPNetwork(vip)
+
+    def assume_programmed(self, routes, vips):
+        """Assume the routes of vips found in the kernel are programmed.
+
+        They were programmed by a previous run, maybe before aggregating
+        the vips: the ones the compiled prefixes do not have are deleted by
+        the next changes, the others are only replaced if their next hops
+        differ. The routes to addresses which are not all vips are not
+        ecmp routes, they are left alone and never covered by a merged
+        prefix.
+
+        :param routes: dict of prefix to next hops of the kernel routes,
+               see RouteProgrammer.get_routes().
+        :param vips: the vips of the router, with or without next hops.
+        """
+        covered = netaddr.cidr_merge([netaddr.IPNetwork(vip) for vip in vips])
+        foreign = []
+        for prefix, next_hops in routes.items():
+            network = netaddr.IPNetwork(prefix)
+            index = bisect.bisect_right(covered, network) - 1
+            if any(network in candidate for candidate in covered[max(index, 0):index + 2]):
+                self.programmed.setdefault(prefix, tuple(next_hops))
+            else:
+                foreign.append(network)
+        if foreign != self._foreign:
+            self._foreign = sorted(foreign)
+            self._dirty.update(self._groups)
+
+    def _merge(self, networks):
+        """Merge networks, without covering a more specific foreign route.
+
+        The networks in a foreign prefix which a merged prefix would cover
+        are left as they are, and the other ones merged again.
+        """
+        merged = netaddr.cidr_merge(networks)
+        unmerged = []
+        while self._foreign:
+            covered = [foreign for foreign in self._foreign
+                       if any(foreign in network and foreign.prefixlen > network.prefixlen
+                              for network in merged)]
+            if not covered:
+                break
+            kept = []
+            for network in networks:
+                if any(network in foreign for foreign in covered):
+                    unmerged.append(network.cidr)
+                else:
+                    kept.append(network)
+            networks = kept
+            merged = netaddr.cidr_merge(networks)
+        return sorted(merged + unmerged) if unmerged else merged
+
+    def _compile_group(self, next_hops):
+        networks = [self._get_network(vip) for vip in self._groups.get(next_hops, ())
+                    if vip not in self._overlapping]
+        if not self._groups.get(next_hops):
+            self._groups.pop(next_hops, None)
+            self._next_hops.pop(next_hops, None)
+        if not networks:
+            self._merged.pop(next_hops, None)
+        elif self.aggregate:
+            self._merged[next_hops] = self._merge(networks)
+        else:
+            self._merged[next_hops] = sorted(network.cidr for network in networks)
+
+    def compile(self):
+        """Return the prefixes to program, as a dict of prefix to next hops."""
+        overlapping = set()
+        if self._prefix_networks and self.aggregate:
+            overlapping = get_overlapping_vips(
+                dict((vip, self._get_network(vip)) for vip in self._routes))
+        if overlapping != self._overlapping:
+            self._dirty.update(self._groups)
+            self._overlapping = overlapping
+        for next_hops in self._dirty:
+            self._compile_group(next_hops)
+        self._dirty.clear()
+        compiled = {}
+        for next_hops, networks in self._merged.items():
+            for network in networks:
+                compiled[str(network)] = next_hops
+        for vip in self._overlapping:
+            compiled[str(self._get_network(vip).cidr)] = self._routes[vip]
+        return compiled
+
+    def get_prefix(self, vip):
+        """Return the compiled prefix holding a vip, None if not routed."""
+        next_hops = self._routes.get(vip)
+        if next_hops is None:
+            return None
+        network = self._get_network(vip)
+        if vip in self._overlapping:
+            return str(network.cidr)
+        merged = self._merged.get(next_hops, [])
+        index = bisect.bisect_right(merged, network) - 1
+        for candidate in merged[max(index, 0):index + 2]:
+            if network in candidate:
+                return str(candidate)
+        return None
+
+    def get_changes(self, compiled, vips=()):
+        """Diff compiled prefixes against the programmed ones.
+
+        :param vips: vips whose prefixes are replaced even when unchanged,
+               e.g. the ones just notified.
+        :returns: dict of the prefixes to replace to their next hops, and
+                  the list of the prefixes to delete.
+        """
+        replaced = dict((prefix, next_hops) for prefix, next_hops in compiled.items()
+                        if self.programmed.get(prefix) != next_hops)
+        for vip in vips:
+            prefix = self.get_prefix(vip)
+            if prefix is not None:
+                replaced[prefix] = compiled[prefix]
+        deleted = sorted(prefix for prefix in self.programmed if prefix not in compiled)
+        return replaced, deleted
+
+    def set_programmed(self, compiled, succeeded=True):
+        """Record the prefixes programmed, or maybe programmed on failure."""
+        if succeeded:
+            self.programmed = dict(compiled)
+        else:
+            self.programmed = dict.fromkeys(set(self.programmed) | set(compiled))
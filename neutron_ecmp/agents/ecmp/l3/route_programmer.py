@@ -0,0 +1,308 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import netaddr
+from neutron.agent.linux import ip_lib
+from oslo_config import cfg
+from oslo_log import log as logging
+
+from neutron_ecmp._i18n import _
+from neutron_ecmp.api.definitions import ecmp as ecmp_ext
+
+LOG = logging.getLogger(__name__)
+
+ECMPAgentOpts = [
+    cfg.StrOpt('route_programmer', default='batch',
+               choices=['cli', 'batch'],
+               help=_('How the ecmp routes are programmed into the router '
+                      'namespaces: "cli" runs one ip command per route, '
+                      '"batch" runs one "ip -batch" command per namespace '
+                      'and notification.')),
+    cfg.StrOpt('default_hash_policy',
+               choices=list(ecmp_ext.HASH_POLICIES),
+               help=_('Multipath hash policy of the router namespaces whose '
+                      'ecmp routes do not set one: "L3" hashes the source '
+                      'and destination addresses, "L4" the 5-tuple, '
+                      '"L3-inner" the inner addresses of encapsulated '
+                      'packets. Unset, these namespaces are kept at the '
+                      'kernel default, L3.')),
+    cfg.BoolOpt('aggregate_vips', default=True,
+                help=_('Aggregate the vips of a router which share the same '
+                       'next hops into the fewest covering prefixes before '
+                       'programming them. The prefixes do not cover the '
+                       'more specific routes via next hops found in the '
+                       'namespace when the router is first programmed, '
+                       'e.g. extra routes. Routes added to the namespace '
+                       'afterwards and the subnets of the router interfaces '
+                       'are not checked: a vip in one of them may be routed '
+                       'by it rather than by its ecmp route once '
+                       'aggregated.')),
+]
+cfg.CONF.register_opts(ECMPAgentOpts, 'ecmp')
+
+PROXY_SYSCTL_KEYS = {
+    4: ('net.ipv4.conf.%s.proxy_arp', 'net.ipv4.conf.%s.proxy_arp_pvlan'),
+    6: ('net.ipv6.conf.%s.proxy_ndp',),
+}
+HASH_POLICY_SYSCTL_KEY = 'net.ipv%d.fib_multipath_hash_policy'
+HASH_POLICY_VALUES = {'L3': '0', 'L4': '1', 'L3-inner': '2'}
+# the policy of a new namespace
+KERNEL_HASH_POLICY = 'L3'
+SYSCTL_PATTERN = (r'^net\.ipv(4\.conf\..*\.proxy_arp|6\.conf\..*\.proxy_ndp|'
+                  r'[46]\.fib_multipath_hash_policy)')
+
+# the sysctl keys found missing, each is logged once
+_missing_sysctl_keys = set()
+
+
+def get_ip_version(address):
+    return netaddr.IPNetwork(address).version
+
+
+class RouteProgrammer(object):
+    """Programs ecmp routes and proxy parameters into one router namespace.
+
+    Each route change runs its own ip command. The proxy sysctl values and
+    the IPv6 proxy neighbours of the namespace are read once, each with a
+    single command, and cached; afterwards only the values which actually
+    change are written, batched into one command. The multipath hash
+    policy of the namespace is cached the same way.
+
+    Adding routes, proxy values or neighbours raises ProcessExecutionError
+    when the kernel refuses them, deleting ones which are already gone does
+    not. Callers call flush() once they are done with a notification.
+    """
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.ip_wrapper = ip_lib.IPWrapper(namespace=namespace)
+        self._sysctl_values = None
+        self._proxy_neighbors = None
+
+    def _execute(self, cmd, process_input=None, check_exit_code=False,
+                 log_fail_as_error=True):
+        return self.ip_wrapper.netns.execute(
+            cmd, process_input=process_input, check_exit_code=check_exit_code,
+            log_fail_as_error=log_fail_as_error)
+
+    def _ip(self, args, ip_version=4, check_exit_code=True):
+        cmd = ['ip']
+        if ip_version == 6:
+            cmd.append('-6')
+        cmd.extend(args)
+        LOG.debug('ecmp route cmd : %s', cmd)
+        self._execute(cmd, check_exit_code=check_exit_code)
+
+    def _ip_batch(self, lines, check_exit_code=True):
+        LOG.debug('ecmp ip batch in %s : %s', self.namespace, lines)
+        self._execute(['ip', '-force', '-batch', '-'],
+                      process_input='\n'.join(lines) + '\n',
+                      check_exit_code=check_exit_code)
+
+    def replace_route(self, vip, next_hops):
+        args = ['route', 'replace', 'to', vip]
+        for nexthop in next_hops:
+            args.extend(['nexthop', 'via', nexthop])
+        self._ip(args, get_ip_version(vip))
+
+    def delete_route(self, vip):
+        # The route may already be gone, e.g. after a restart of the node.
+        self._ip(['route', 'delete', 'to', vip], get_ip_version(vip),
+                 check_exit_code=False)
+
+    def flush(self):
+        """Execute what has been queued, nothing to do when not batching."""
+
+    def get_routes(self):
+        """Read the routes via next hops of the namespace from the kernel.
+
+        :returns: dict of prefix, in CIDR form, to its sorted next hops.
+        """
+        routes = {}
+        for ip_version in (4, 6):
+            cmd = ['ip', '-6', 'route', 'show'] if ip_version == 6 else ['ip', 'route', 'show']
+            output = self._execute(cmd, log_fail_as_error=False)
+            prefix = None
+            for line in (output or '').splitlines():
+                fields = line.split()
+                if not fields:
+                    continue
+                if not line[0].isspace():
+                    try:
+                        prefix = str(netaddr.IPNetwork(fields[0]).cidr)
+                    except (netaddr.AddrFormatError, ValueError):
+                        # default, unreachable, ... routes
+                        prefix = None
+                        continue
+                elif prefix is None or fields[0] != 'nexthop':
+                    continue
+                if 'via' in fields[:-1]:
+                    via = fields[fields.index('via') + 1:]
+                    if via[0] in ('inet', 'inet6') and len(via) > 1:
+                        via = via[1:]
+                    routes.setdefault(prefix, []).append(via[0])
+        return dict((prefix, sorted(next_hops)) for prefix, next_hops in routes.items())
+
+    def _load_sysctl_values(self):
+        self._sysctl_values = {}
+        output = self._execute(['sysctl', '-a', '-r', SYSCTL_PATTERN],
+                               log_fail_as_error=False)
+        for line in (output or '').splitlines():
+            key, sep, value = line.partition('=')
+            if sep:
+                self._sysctl_values[key.strip()] = value.strip()
+        LOG.debug('loaded %d sysctl values of namespace %s',
+                  len(self._sysctl_values), self.namespace)
+
+    def _set_sysctl_values(self, values):
+        """Write the sysctl values which differ from the cached ones."""
+        if self._sysctl_values is None:
+            self._load_sysctl_values()
+        changes = [(key, value) for key, value in values
+                   if self._sysctl_values.get(key) != value]
+        if not changes:
+            return
+        LOG.debug('set sysctl values in %s: %s', self.namespace, changes)
+        cmd = ['sysctl', '-w'] + ['%s=%s' % change for change in changes]
+        try:
+            self._execute(cmd, check_exit_code=True)
+        except Exception:
+            # sysctl goes on after a key it fails to write, e.g. of a qr
+            # device which does not exist yet: which ones were written is
+            # unknown, they are read again by the next call.
+            self._sysctl_values = None
+            raise
+        for key, value in changes:
+            self._sysctl_values[key] = value
+
+    def set_proxy(self, interfaces, enabled, ip_version=4):
+        """Set proxy_arp/proxy_arp_pvlan or proxy_ndp of interfaces."""
+        value = '1' if enabled else '0'
+        self._set_sysctl_values([(key % interface, value)
+                                 for interface in sorted(set(interfaces))
+                                 for key in PROXY_SYSCTL_KEYS[ip_version]])
+
+    def set_hash_policy(self, hash_policy, ip_version=4):
+        """Set the multipath hash policy of the namespace, once.
+
+        Without a policy the default one is set back, e.g. once the last
+        route setting one is deleted. Nothing is done when the kernel does
+        not have the sysctl, e.g. net.ipv6.fib_multipath_hash_policy before
+        4.18.
+        """
+        hash_policy = (hash_policy or cfg.CONF.ecmp.default_hash_policy or
+                       KERNEL_HASH_POLICY)
+        key = HASH_POLICY_SYSCTL_KEY % ip_version
+        if self._sysctl_values is None:
+            self._load_sysctl_values()
+        if key not in self._sysctl_values:
+            if hash_policy != KERNEL_HASH_POLICY and key not in _missing_sysctl_keys:
+                _missing_sysctl_keys.add(key)
+                LOG.warning('sysctl %s is not supported by the kernel, the '
+                            'hash policy %s of the ecmp routes is not set',
+                            key, hash_policy)
+            return
+        self._set_sysctl_values([(key, HASH_POLICY_VALUES[hash_policy])])
+
+    def _load_proxy_neighbors(self):
+        self._proxy_neighbors = {}
+        output = self._execute(['ip', '-6', 'neigh', 'show', 'proxy'],
+                               log_fail_as_error=False)
+        for line in (output or '').splitlines():
+            fields = line.split()
+            if 'dev' not in fields[:-1]:
+                continue
+            device = fields[fields.index('dev') + 1]
+            self._proxy_neighbors.setdefault(fields[0], set()).add(device)
+
+    def set_proxy_neighbors(self, vip_interfaces):
+        """Make the IPv6 proxy neighbours of each vip match its interfaces.
+
+        :param vip_interfaces: dict of vip to the interfaces it has to be
+               answered on; an empty list removes every entry of the vip.
+        """
+        if self._proxy_neighbors is None:
+            self._load_proxy_neighbors()
+        add_lines = []
+        del_lines = []
+        for vip, interfaces in sorted(vip_interfaces.items()):
+            vip = str(netaddr.IPNetwork(vip).ip)
+            current = self._proxy_neighbors.get(vip, set())
+            wanted = set(interfaces)
+            for interface in sorted(wanted - current):
+                add_lines.append('neigh add proxy %s dev %s' % (vip, interface))
+            for interface in sorted(current - wanted):
+                del_lines.append('neigh del proxy %s dev %s' % (vip, interface))
+            if wanted:
+                self._proxy_neighbors[vip] = wanted
+            else:
+                self._proxy_neighbors.pop(vip, None)
+        if del_lines:
+            self._ip_batch(del_lines, check_exit_code=False)
+        if add_lines:
+            try:
+                self._ip_batch(add_lines)
+            except Exception:
+                # read again by the next call, like the sysctl values
+                self._proxy_neighbors = None
+                raise
+
+
+class BatchRouteProgrammer(RouteProgrammer):
+    """Queue the ip commands and run them in one ip -batch on flush.
+
+    The address family of a batched route is derived by ip from the vip.
+    Deletions whose failure is ignored are run in a batch of their own,
+    after the other commands and only if they succeeded, so that a prefix
+    is deleted once the ones replacing it are installed; a vip is not both
+    deleted and added in the same notification.
+    """
+    def __init__(self, namespace):
+        super(BatchRouteProgrammer, self).__init__(namespace)
+        self._pending = []
+        self._pending_unchecked = []
+
+    def _ip(self, args, ip_version=4, check_exit_code=True):
+        self._ip_batch([' '.join(args)], check_exit_code)
+
+    def _ip_batch(self, lines, check_exit_code=True):
+        if check_exit_code:
+            self._pending.extend(lines)
+        else:
+            self._pending_unchecked.extend(lines)
+
+    def flush(self):
+        run_batch = super(BatchRouteProgrammer, self)._ip_batch
+        lines, self._pending = self._pending, []
+        unchecked_lines, self._pending_unchecked = self._pending_unchecked, []
+        if lines:
+            try:
+                run_batch(lines)
+            except Exception:
+                # the proxy neighbours were cached when queued
+                self._proxy_neighbors = None
+                raise
+        if unchecked_lines:
+            run_batch(unchecked_lines, check_exit_code=False)
+
+
+ROUTE_PROGRAMMERS = {
+    'cli': RouteProgrammer,
+    'batch': BatchRouteProgrammer,
+}
+
+
+def get_route_programmer(namespace, name=None):
+    name = name or cfg.CONF.ecmp.route_programmer
+    return ROUTE_PROGRAMMERS[name](namespace)
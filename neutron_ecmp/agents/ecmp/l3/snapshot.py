@@ -0,0 +1,92 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import errno
+import os
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_serialization import jsonutils
+
+from neutron_ecmp._i18n import _
+
+LOG = logging.getLogger(__name__)
+
+ECMPSnapshotOpts = [
+    cfg.IntOpt('snapshot_interval', default=5, min=0,
+               help=_('Seconds between two writes of the snapshot of the '
+                      'ecmp routes of the agent, when they changed. On '
+                      'restart, the routes of the snapshot are programmed '
+                      'right away and only the routers whose routes changed '
+                      'meanwhile are fetched again. 0 disables the '
+                      'snapshot.')),
+    cfg.StrOpt('snapshot_path',
+               help=_('File of the snapshot, ecmp/routes.json in the '
+                      'state_path of the agent by default.')),
+    cfg.IntOpt('snapshot_verify_batch_size', default=200, min=1,
+               help=_('Maximum number of routers restored from the snapshot '
+                      'whose routes are checked with the plugin in one '
+                      'call.')),
+]
+cfg.CONF.register_opts(ECMPSnapshotOpts, 'ecmp')
+
+# Bumped on incompatible changes of the format, an agent ignores the
+# snapshots of other versions and fetches every router instead.
+SNAPSHOT_VERSION = 1
+# What is kept of a route notified to the agent.
+ROUTE_KEYS = ('id', 'revision', 'vip', 'next_hops', 'qr_interfaces', 'hash_policy')
+
+
+def get_snapshot_path(conf):
+    return conf.ecmp.snapshot_path or os.path.join(conf.state_path, 'ecmp', 'routes.json')
+
+
+def load_snapshot(path):
+    """Return the routes of each router of a snapshot, {} if unusable."""
+    try:
+        # jsonutils.load decodes the bytes it reads
+        with open(path, 'rb') as f:
+            snapshot = jsonutils.load(f)
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            LOG.warning('ecmp: can not read snapshot %s: %s', path, e)
+        return {}
+    except ValueError as e:
+        LOG.warning('ecmp: ignore corrupted snapshot %s: %s', path, e)
+        return {}
+    if not isinstance(snapshot, dict) or snapshot.get('version') != SNAPSHOT_VERSION:
+        LOG.warning('ecmp: ignore snapshot %s of another version', path)
+        return {}
+    return snapshot.get('routers') or {}
+
+
+def write_snapshot(path, routes_of_router):
+    """Atomically replace the snapshot with the routes of each router.
+
+    The snapshot is written to a temporary file of the same directory,
+    synced, then renamed over the previous one, so that a crash leaves
+    either the previous or the new snapshot.
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory, 0o755)
+    tmp_path = '%s.tmp' % path
+    data = jsonutils.dump_as_bytes({'version': SNAPSHOT_VERSION,
+                                    'routers': routes_of_router})
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp_path, path)
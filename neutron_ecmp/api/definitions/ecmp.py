@@ -24,6 +24,19 @@ DESCRIPTION = "Provides support of ecmp for Inspur public cloud network."
 # A timestamp of when the extension was introduced.
 UPDATED_TIMESTAMP = "2020-03-01T10:00:00-00:00"
 ECMPROUTES = 'ecmp_routes'
+
+# Realization status of an ecmp route: PENDING until every hosting l3 agent
+# has programmed its current revision, ERROR if one of them failed to.
+STATUS_PENDING = 'PENDING'
+STATUS_ACTIVE = 'ACTIVE'
+STATUS_ERROR = 'ERROR'
+
+# What the port_selector of an ecmp pool route can match ports on.
+PORT_SELECTOR_TYPES = ('tag', 'device_owner', 'allowed_address_pair')
+
+# Multipath hash policies, the kernel applies one to a whole router
+# namespace: all the ecmp routes of a router share it.
+HASH_POLICIES = ('L3', 'L4', 'L3-inner')
 RESOURCE_ATTRIBUTE_MAP = {
     ECMPROUTES: {
         'id': {'allow_post': False, 'allow_put': False,
@@ -38,15 +51,35 @@ RESOURCE_ATTRIBUTE_MAP = {
                           'type:string': constants.PROJECT_ID_FIELD_SIZE},
                       'is_filter': True, 'is_sort_key': True,
                       'is_visible': True},
+        # an address, or a prefix routed as a whole to the next hops
         'vip': {'allow_post': True, 'allow_put': False,
-                      'validate': {'type:ip_address_or_none': None},
+                      'validate': {'type:ip_or_subnet_or_none': None},
                       'is_visible': True},
         'router_id': {'allow_post': True, 'allow_put': False,
                       'validate': {'type:uuid_or_none': None},
                       'is_filter': True, 'is_sort_key': True,
                       'is_visible': True},
         'next_hops': {'allow_post': True, 'allow_put': True,
-                      'is_visible': True}
+                      'default': [],
+                      'is_visible': True},
+        # next_hops without the ones withdrawn while unhealthy
+        'effective_next_hops': {'allow_post': False, 'allow_put': False,
+                                'is_visible': True},
+        # None leaves the policy of the router to the agent configuration
+        'hash_policy': {'allow_post': True, 'allow_put': False,
+                        'default': None,
+                        'validate': {'type:values': (None,) + HASH_POLICIES},
+                        'is_visible': True},
+        # {<selector type>: <value>}, the next hops of the route are then
+        # the addresses of the matching ports in the router subnets.
+        'port_selector': {'allow_post': True, 'allow_put': False,
+                          'default': None,
+                          'validate': {'type:dict_or_none': None},
+                          'is_visible': True},
+        'status': {'allow_post': False, 'allow_put': False,
+                   'is_visible': True},
+        'realized_revisions': {'allow_post': False, 'allow_put': False,
+                               'is_visible': True},
     }
 }
 
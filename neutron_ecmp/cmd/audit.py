@@ -0,0 +1,237 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Audit the ecmp routes of the database against the router namespaces.
+
+The routers are read from the database in pages, in router id order, with
+the routes of each page in one query. Each page is sent to every alive l3
+agent, at most --concurrency at a time, with the read-only
+dump_ecmp_routes RPC; the agents answer for the routers they host with the
+routes of their namespaces. The expected prefixes of a router are
+compiled from its routes as its agent does, then diffed against the
+kernel:
+
+    neutron-ecmp-audit --config-file /etc/neutron/neutron.conf \\
+        --output audit.json --repair-plan
+
+The report lists, per host and router, the missing, mismatched and stale
+prefixes; with --repair-plan, the ip commands fixing them. The exit code
+is 1 when there is a difference.
+"""
+
+import collections
+import sys
+
+import eventlet
+from neutron.agent.l3 import namespaces
+from neutron.common import config as common_config
+from neutron.db import agents_db
+from neutron.db.models import agent as agent_models
+from neutron.db.models import l3 as l3_models
+from neutron_lib import constants as n_const
+from neutron_lib import context as n_context
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_serialization import jsonutils
+
+from neutron_ecmp._i18n import _
+from neutron_ecmp.agents.ecmp.l3 import route_compiler
+from neutron_ecmp.db.ecmp import ecmp_db
+from neutron_ecmp.services.ecmp.drivers import agent as agent_driver
+
+LOG = logging.getLogger(__name__)
+
+AuditOpts = [
+    cfg.ListOpt('hosts',
+                help=_('Hosts of the l3 agents to audit, all the alive ones '
+                       'by default.')),
+    cfg.ListOpt('routers',
+                help=_('Routers to audit, all of them by default.')),
+    cfg.IntOpt('page-size', default=500, min=1,
+               help=_('Routers read from the database and dumped by an '
+                      'agent at a time.')),
+    cfg.IntOpt('concurrency', default=16, min=1,
+               help=_('Agents dumping their routers at the same time.')),
+    cfg.IntOpt('rpc-timeout', default=60, min=1,
+               help=_('Seconds to wait for an agent to dump a page.')),
+    cfg.BoolOpt('repair-plan', default=False,
+                help=_('Add to the report the ip commands fixing the '
+                       'differences.')),
+    cfg.StrOpt('output',
+               help=_('File of the JSON report, stdout by default.')),
+]
+
+
+def diff_router(expected, dump):
+    """Diff the expected routes of a router against the dump of an agent.
+
+    :param expected: dict of vip to its effective next hops.
+    :param dump: what dump_ecmp_routes returned for the router.
+    :returns: dict of the missing and mismatched prefixes to the expected
+              next hops, and the list of the stale prefixes.
+    """
+    compiler = route_compiler.RouteCompiler(aggregate=dump.get('aggregate_vips', True))
+    for vip, next_hops in expected.items():
+        compiler.set_route(vip, next_hops)
+    compiled = compiler.compile()
+    kernel = dump.get('routes') or {}
+    missing = {}
+    mismatched = {}
+    for prefix, next_hops in compiled.items():
+        if prefix not in kernel:
+            missing[prefix] = list(next_hops)
+        elif list(next_hops) != kernel[prefix]:
+            mismatched[prefix] = {'expected': list(next_hops), 'actual': kernel[prefix]}
+    # Extra routes of the router are not ecmp routes: only the multipath
+    # routes and the ones programmed by the agent can be stale.
+    candidates = set(prefix for prefix, next_hops in kernel.items() if len(next_hops) > 1)
+    candidates.update(prefix for prefix in dump.get('programmed') or [] if prefix in kernel)
+    stale = sorted(prefix for prefix in candidates if prefix not in compiled)
+    return missing, mismatched, stale
+
+
+def get_repair_commands(router_id, missing, mismatched, stale):
+    ns_name = namespaces.build_ns_name(namespaces.NS_PREFIX, router_id)
+    commands = []
+    for prefix in stale:
+        commands.append('ip netns exec %s ip route delete to %s' % (ns_name, prefix))
+    replaced = dict(missing)
+    replaced.update((prefix, diff['expected']) for prefix, diff in mismatched.items())
+    for prefix, next_hops in sorted(replaced.items()):
+        commands.append('ip netns exec %s ip route replace to %s %s' % (
+            ns_name, prefix, ' '.join('nexthop via %s' % next_hop for next_hop in next_hops)))
+    return commands
+
+
+class Auditor(object):
+
+    def __init__(self, conf, agent_rpc=None):
+        self.conf = conf
+        self.context = n_context.get_admin_context()
+        self.db = ecmp_db.Ecmp_db_mixin()
+        self.agent_rpc = agent_rpc or agent_driver.EcmpAgentApi(
+            agent_driver.ECMP_AGENT, conf.host)
+        self.pool = eventlet.GreenPool(conf.concurrency)
+        self.summary = collections.Counter()
+        self.diffs = []
+        self.repair_plan = collections.defaultdict(list)
+        self.unreachable_hosts = set()
+
+    def get_hosts(self):
+        if self.conf.hosts:
+            return sorted(self.conf.hosts)
+        query = self.context.session.query(agent_models.Agent)
+        query = query.filter(agent_models.Agent.agent_type == n_const.AGENT_TYPE_L3,
+                             agent_models.Agent.admin_state_up.is_(True))
+        return sorted(agent.host for agent in query
+                      if not agents_db.AgentDbMixin.is_agent_down(agent.heartbeat_timestamp))
+
+    def iter_router_pages(self):
+        """Yield the ids of the routers, one page at a time."""
+        if self.conf.routers:
+            router_ids = sorted(self.conf.routers)
+            for i in range(0, len(router_ids), self.conf.page_size):
+                yield router_ids[i:i + self.conf.page_size]
+            return
+        last = None
+        while True:
+            query = self.context.session.query(l3_models.Router.id)
+            if last is not None:
+                query = query.filter(l3_models.Router.id > last)
+            page = [router_id for router_id, in
+                    query.order_by(l3_models.Router.id).limit(self.conf.page_size)]
+            if not page:
+                return
+            yield page
+            last = page[-1]
+
+    def get_expected_routes(self, router_ids):
+        """Return the effective next hops of each vip of the routers."""
+        expected = dict((router_id, {}) for router_id in router_ids)
+        with self.context.session.begin(subtransactions=True):
+            for ecmpr in self.db._get_ecmproutes_of_routers(self.context, router_ids):
+                next_hops = ecmp_db.split_next_hops(ecmpr['next_hops'])
+                expected[ecmpr['router_id']][ecmpr['vip']] = self.db._get_effective_next_hops(
+                    ecmpr, next_hops)
+            # the next page reads fresh data
+            self.context.session.expunge_all()
+        return expected
+
+    def _dump(self, host, router_ids):
+        try:
+            return host, self.agent_rpc.dump_ecmp_routes(
+                self.context, router_ids, host, timeout=self.conf.rpc_timeout)
+        except Exception as e:
+            LOG.warning('ecmp: failed to dump the routers of host %s: %s', host, e)
+            self.unreachable_hosts.add(host)
+            return host, None
+
+    def audit_page(self, router_ids, hosts):
+        expected = self.get_expected_routes(router_ids)
+        hosted = set()
+        hosts = [host for host in hosts if host not in self.unreachable_hosts]
+        for host, dump in self.pool.imap(self._dump, hosts, [router_ids] * len(hosts)):
+            for router_id, data in (dump or {}).items():
+                if router_id not in expected:
+                    continue
+                hosted.add(router_id)
+                self.summary['audited'] += 1
+                if data.get('error'):
+                    self.summary['errors'] += 1
+                    self.diffs.append({'host': host, 'router_id': router_id, 'error': data['error']})
+                    continue
+                missing, mismatched, stale = diff_router(expected[router_id], data)
+                if not (missing or mismatched or stale):
+                    continue
+                self.summary['missing'] += len(missing)
+                self.summary['mismatched'] += len(mismatched)
+                self.summary['stale'] += len(stale)
+                self.diffs.append({'host': host, 'router_id': router_id, 'missing': missing,
+                                   'mismatched': mismatched, 'stale': stale})
+                if self.conf.repair_plan:
+                    self.repair_plan[host].extend(
+                        get_repair_commands(router_id, missing, mismatched, stale))
+        self.summary['routers'] += len(router_ids)
+        # routers with ecmp routes no alive agent answered for
+        self.summary['not_hosted'] += len([router_id for router_id, routes in expected.items()
+                                           if routes and router_id not in hosted])
+
+    def run(self):
+        hosts = self.get_hosts()
+        LOG.info('ecmp: audit the routers of %d hosts', len(hosts))
+        for router_ids in self.iter_router_pages():
+            self.audit_page(router_ids, hosts)
+            LOG.info('ecmp: audited %d routers', self.summary['routers'])
+        report = {'summary': dict(self.summary, hosts=len(hosts),
+                                  routers_with_differences=len(self.diffs),
+                                  unreachable_hosts=sorted(self.unreachable_hosts)),
+                  'differences': self.diffs}
+        if self.conf.repair_plan:
+            report['repair_plan'] = dict(self.repair_plan)
+        return report
+
+
+def main():
+    cfg.CONF.register_cli_opts(AuditOpts)
+    common_config.init(sys.argv[1:])
+    common_config.setup_logging()
+    report = Auditor(cfg.CONF).run()
+    data = jsonutils.dumps(report, indent=2, sort_keys=True)
+    if cfg.CONF.output:
+        with open(cfg.CONF.output, 'w') as f:
+            f.write(data)
+    else:
+        sys.stdout.write(data + '\n')
+    return 1 if report['differences'] or report['summary']['unreachable_hosts'] else 0
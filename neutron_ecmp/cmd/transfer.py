@@ -0,0 +1,272 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Export the ecmp routes as newline-delimited JSON and import them back.
+
+The export reads the routes in pages, in route id order, and writes one
+JSON object per line and route, with its configured next hops:
+
+    neutron-ecmp-transfer --config-file /etc/neutron/neutron.conf \\
+        export --output routes.json
+
+The import reads them in chunks, each written in one transaction without
+reading the routers of its routes; the routes whose router does not exist
+or which already exist are skipped. Once all are written, the routes of
+each router are validated in one transaction, the invalid ones are
+deleted, and each router is resynced with one message to its agents
+instead of a notification per route:
+
+    neutron-ecmp-transfer --config-file /etc/neutron/neutron.conf \\
+        --config-file /etc/neutron/plugins/ml2/ml2_conf.ini \\
+        import --input routes.json --router-map routers.json
+
+The router map is a JSON object of exported router id to router id, for
+routes moved to other routers, e.g. of another region. The import report
+is written to stdout; the exit code is 1 when a route is invalid or a
+router failed to be validated or resynced.
+"""
+
+import collections
+import itertools
+import sys
+
+from neutron.common import config as common_config
+from neutron.db.models import l3 as l3_models
+from neutron import manager
+from neutron_lib import context as n_context
+from neutron_lib import exceptions as n_exc
+from neutron_lib.plugins import directory
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_serialization import jsonutils
+from oslo_utils import uuidutils
+from sqlalchemy import orm
+
+from neutron_ecmp._i18n import _
+from neutron_ecmp.db.ecmp import ecmp_db
+
+LOG = logging.getLogger(__name__)
+
+
+def add_command_parsers(subparsers):
+    parser = subparsers.add_parser('export', help=_('Export the ecmp routes.'))
+    parser.add_argument('--routers', nargs='+',
+                        help=_('Routers whose routes are exported, all of them by default.'))
+    parser.add_argument('--page-size', type=int, default=1000,
+                        help=_('Routes read from the database at a time.'))
+    parser.add_argument('--output', help=_('File of the routes, stdout by default.'))
+    parser.set_defaults(func=export_routes)
+
+    parser = subparsers.add_parser('import', help=_('Import exported ecmp routes.'))
+    parser.add_argument('--input', help=_('File of the routes, stdin by default.'))
+    parser.add_argument('--chunk-size', type=int, default=1000,
+                        help=_('Routes written, and routers resynced, in one transaction.'))
+    parser.add_argument('--router-map',
+                        help=_('JSON file of the ids of the exported routers to the ids '
+                               'of the routers to import their routes into.'))
+    parser.set_defaults(func=import_routes)
+
+
+TransferOpts = [
+    cfg.SubCommandOpt('command', title=_('Commands'),
+                      handler=add_command_parsers),
+]
+
+
+def get_route_line(ecmpr):
+    return {'id': ecmpr['id'],
+            'project_id': ecmpr['project_id'],
+            'router_id': ecmpr['router_id'],
+            'vip': ecmpr['vip'],
+            'next_hops': ecmp_db.split_next_hops(ecmpr['next_hops']),
+            'hash_policy': ecmpr['hash_policy'],
+            'port_selector': ecmp_db.Ecmp_db_mixin._make_port_selector(ecmpr.pool)}
+
+
+class Exporter(object):
+
+    def __init__(self, conf):
+        self.conf = conf
+        self.context = n_context.get_admin_context()
+
+    def iter_route_pages(self):
+        """Yield the routes, one page at a time, in route id order."""
+        last = None
+        while True:
+            query = self.context.session.query(ecmp_db.EcmpRoute)
+            # the hosts and withdrawn next hops are not exported
+            query = query.options(orm.noload(ecmp_db.EcmpRoute.hosts),
+                                  orm.noload(ecmp_db.EcmpRoute.withdrawn))
+            if self.conf.command.routers:
+                query = query.filter(ecmp_db.EcmpRoute.router_id.in_(self.conf.command.routers))
+            if last is not None:
+                query = query.filter(ecmp_db.EcmpRoute.id > last)
+            page = [get_route_line(ecmpr) for ecmpr in
+                    query.order_by(ecmp_db.EcmpRoute.id).limit(self.conf.command.page_size)]
+            # the next page reads fresh data
+            self.context.session.expunge_all()
+            if not page:
+                return
+            yield page
+            last = page[-1]['id']
+
+    def run(self, stream):
+        count = 0
+        for page in self.iter_route_pages():
+            stream.write(''.join(jsonutils.dumps(line, sort_keys=True) + '\n' for line in page))
+            count += len(page)
+            LOG.info('ecmp: exported %d routes', count)
+        return count
+
+
+class Importer(object):
+
+    def __init__(self, conf, plugin, router_map=None):
+        self.conf = conf
+        self.plugin = plugin
+        self.router_map = router_map or {}
+        self.context = n_context.get_admin_context()
+        self.summary = collections.Counter()
+        self.route_ids_of_router = collections.defaultdict(list)
+        self.invalid = []
+        self.failed_routers = set()
+
+    def _parse_line(self, number, line):
+        try:
+            route = jsonutils.loads(line)
+            router_id = route['router_id']
+            route = {'id': route.get('id') or uuidutils.generate_uuid(),
+                     'project_id': route['project_id'],
+                     'router_id': self.router_map.get(router_id, router_id),
+                     'vip': self.plugin._normalize_vip(route['vip']),
+                     'next_hops': route.get('next_hops') or [],
+                     'hash_policy': route.get('hash_policy'),
+                     'port_selector': route.get('port_selector')}
+            if route['port_selector']:
+                self.plugin._validate_port_selector(route['port_selector'])
+            return route
+        except (ValueError, KeyError, TypeError, n_exc.NeutronException) as e:
+            self.invalid.append({'line': number, 'error': str(e)})
+            return None
+
+    def load_chunk(self, lines):
+        """Write the routes of a chunk of lines, in one transaction."""
+        routes = [route for route in itertools.starmap(self._parse_line, lines) if route]
+        router_ids = set(route['router_id'] for route in routes)
+        session = self.context.session
+        with session.begin(subtransactions=True):
+            existing_routers = set(router_id for router_id, in session.query(
+                l3_models.Router.id).filter(l3_models.Router.id.in_(router_ids)))
+            query = session.query(ecmp_db.EcmpRoute.router_id, ecmp_db.EcmpRoute.vip)
+            existing_vips = set(query.filter(ecmp_db.EcmpRoute.router_id.in_(existing_routers)))
+            query = session.query(ecmp_db.EcmpRoute.id)
+            existing_ids = set(route_id for route_id, in query.filter(
+                ecmp_db.EcmpRoute.id.in_([route['id'] for route in routes])))
+            for route in routes:
+                if route['router_id'] not in existing_routers:
+                    self.summary['missing_router'] += 1
+                    continue
+                if (route['router_id'], route['vip']) in existing_vips or route['id'] in existing_ids:
+                    self.summary['existing'] += 1
+                    continue
+                existing_vips.add((route['router_id'], route['vip']))
+                existing_ids.add(route['id'])
+                ecmpr = ecmp_db.EcmpRoute(id=route['id'],
+                                          project_id=route['project_id'],
+                                          router_id=route['router_id'],
+                                          vip=route['vip'],
+                                          next_hops=','.join(route['next_hops']),
+                                          hash_policy=route['hash_policy'])
+                for selector_type, value in (route['port_selector'] or {}).items():
+                    ecmpr.pool = ecmp_db.EcmpRoutePool(selector_type=selector_type,
+                                                       selector_value=value)
+                session.add(ecmpr)
+                self.route_ids_of_router[route['router_id']].append(route['id'])
+                self.summary['written'] += 1
+        session.expunge_all()
+
+    def finish_routers(self):
+        """Validate the written routes, one router at a time."""
+        for router_id, route_ids in sorted(self.route_ids_of_router.items()):
+            try:
+                invalid = self.plugin.finish_ecmp_route_import(self.context, router_id, route_ids)
+            except Exception as e:
+                LOG.exception('ecmp: failed to validate the routes imported into router %s', router_id)
+                self.invalid.extend({'id': route_id, 'router_id': router_id, 'error': str(e)}
+                                    for route_id in route_ids)
+                self.failed_routers.add(router_id)
+                continue
+            self.invalid.extend(dict(route, router_id=router_id) for route in invalid)
+            self.summary['imported'] += len(route_ids) - len(invalid)
+            self.context.session.expunge_all()
+
+    def resync_routers(self):
+        router_ids = sorted(set(self.route_ids_of_router) - self.failed_routers)
+        for i in range(0, len(router_ids), self.conf.command.chunk_size):
+            self.failed_routers |= self.plugin.resync_ecmp_routers(
+                self.context, router_ids[i:i + self.conf.command.chunk_size])
+        self.summary['resynced_routers'] = len(router_ids)
+
+    def run(self, stream):
+        lines = enumerate(stream, 1)
+        while True:
+            chunk = [(number, line) for number, line in
+                     itertools.islice(lines, self.conf.command.chunk_size) if line.strip()]
+            if not chunk:
+                break
+            self.load_chunk(chunk)
+            LOG.info('ecmp: wrote %d routes', self.summary['written'])
+        self.finish_routers()
+        self.resync_routers()
+        return {'summary': dict(self.summary, routers=len(self.route_ids_of_router),
+                                invalid=len(self.invalid),
+                                failed_routers=sorted(self.failed_routers)),
+                'invalid': self.invalid}
+
+
+def export_routes(conf):
+    if conf.command.output:
+        with open(conf.command.output, 'w') as stream:
+            Exporter(conf).run(stream)
+    else:
+        Exporter(conf).run(sys.stdout)
+    return 0
+
+
+def import_routes(conf):
+    router_map = None
+    if conf.command.router_map:
+        with open(conf.command.router_map) as f:
+            router_map = jsonutils.loads(f.read())
+    # the routes are validated with the core plugin
+    manager.init()
+    plugin = directory.get_plugin('ECMP')
+    if plugin is None:
+        sys.exit(_('The ecmp service plugin is not enabled.'))
+    importer = Importer(conf, plugin, router_map)
+    if conf.command.input:
+        with open(conf.command.input) as stream:
+            report = importer.run(stream)
+    else:
+        report = importer.run(sys.stdin)
+    sys.stdout.write(jsonutils.dumps(report, indent=2, sort_keys=True) + '\n')
+    return 1 if report['invalid'] or report['summary']['failed_routers'] else 0
+
+
+def main():
+    cfg.CONF.register_cli_opts(TransferOpts)
+    common_config.init(sys.argv[1:])
+    common_config.setup_logging()
+    return cfg.CONF.command.func(cfg.CONF)
@@ -0,0 +1,57 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+
+
+class GenerationCache(object):
+    """LRU cache of values computed per router, validated by generation.
+
+    An entry is used while its router is at the generation it was computed
+    at, which the caller reads from the database, so that the changes made
+    by the other neutron-server workers invalidate it. The generation has
+    to be read before computing the value: a change racing with it then
+    leaves a value newer than its generation, which is only computed again.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, generation):
+        """Return the value of key at generation, None if it is not cached."""
+        entry = self._entries.pop(key, None)
+        if entry is None or entry[0] != generation:
+            self.misses += 1
+            return None
+        self._entries[key] = entry
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, generation, value):
+        if not self.size:
+            return
+        self._entries.pop(key, None)
+        self._entries[key] = (generation, value)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
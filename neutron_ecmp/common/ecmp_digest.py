@@ -0,0 +1,31 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import hashlib
+
+from oslo_serialization import jsonutils
+
+
+def get_routes_digest(routes):
+    """Return a digest of the ecmp routes of a router, as an agent has them.
+
+    Covers the id, revision and effective next hops of each route, the
+    latter change without a new revision when next hops are withdrawn.
+    """
+    items = sorted([route.get('id') or '',
+                    -1 if route.get('revision') is None else route['revision'],
+                    sorted(route.get('next_hops') or [])]
+                   for route in routes)
+    return hashlib.sha1(jsonutils.dump_as_bytes(items)).hexdigest()
@@ -10,6 +10,21 @@ class EcmprouteConflict(exceptions.Conflict):
 class EcmpInvalidRoutes(exceptions.InvalidInput):
     message = _("Invalid format for routes: the nexthop ip %(next_hop)s is not connected with router %(router_id)s")
 
+class EcmpNextHopVersionMismatch(exceptions.InvalidInput):
+    message = _("Invalid format for routes: the nexthop ip %(next_hop)s is not of the same ip version as vip %(vip)s")
+
+class EcmpInvalidVip(exceptions.InvalidInput):
+    message = _("Invalid vip %(vip)s: it must be an address, or a prefix without host bits set")
+
+class EcmpInvalidPortSelector(exceptions.InvalidInput):
+    message = _("Invalid port selector %(selector)s: it must map one of %(types)s to a string")
+
+class EcmpPoolNextHops(exceptions.InvalidInput):
+    message = _("The next hops of an ecmp route are either given or selected by its port_selector")
+
+class EcmpHashPolicyConflict(exceptions.Conflict):
+    message = _("The ecmp routes of router %(router_id)s use hash policy %(current)s, not %(hash_policy)s.")
+
 class RouterInterfaceInUseBySlbEcmp(exceptions.InUse):
     message = _("Router interface for subnet %(subnet_id)s on router "
                 "%(router_id)s cannot be deleted, as it is required "
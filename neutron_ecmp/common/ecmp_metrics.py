@@ -0,0 +1,87 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import bisect
+
+# Upper bounds, in seconds, of the latency histogram buckets; the last
+# bucket holds everything above the last bound.
+BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5,
+           1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram(object):
+    """Latency histogram with fixed buckets, cheap to merge and to send."""
+
+    def __init__(self, counts=None):
+        self.counts = list(counts or [0] * (len(BUCKETS) + 1))
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, max(seconds, 0))] += 1
+
+    def merge(self, other):
+        counts = other.counts if isinstance(other, Histogram) else other
+        for i, count in enumerate(counts):
+            self.counts[i] += count
+
+    @property
+    def total(self):
+        return sum(self.counts)
+
+    def percentile(self, pct):
+        """Return the upper bound of the bucket holding the percentile."""
+        total = self.total
+        if not total:
+            return None
+        rank = pct / 100.0 * total
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return BUCKETS[i] if i < len(BUCKETS) else float('inf')
+        return float('inf')
+
+    def to_list(self):
+        return list(self.counts)
+
+    def reset(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+
+
+class Histograms(object):
+    """Named histograms, e.g. one per measured stage."""
+
+    def __init__(self, names):
+        self.histograms = dict((name, Histogram()) for name in names)
+
+    def add(self, name, seconds):
+        self.histograms[name].add(seconds)
+
+    def merge(self, histograms):
+        for name, counts in histograms.items():
+            self.histograms.setdefault(name, Histogram()).merge(counts)
+
+    def to_dict(self):
+        return dict((name, histogram.to_list())
+                    for name, histogram in self.histograms.items())
+
+    def summary(self):
+        return dict((name, {'count': histogram.total,
+                            'p50': histogram.percentile(50),
+                            'p99': histogram.percentile(99)})
+                    for name, histogram in self.histograms.items())
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
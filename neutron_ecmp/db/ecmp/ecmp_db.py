@@ -14,23 +14,92 @@
 #    under the License.
 
 
+import collections
+import datetime
+
+from oslo_db import exception as db_exc
 from oslo_log import log as logging
+from oslo_serialization import jsonutils
+from oslo_utils import timeutils
 from oslo_utils import uuidutils
 
 import sqlalchemy as sa
+from sqlalchemy import orm
 from sqlalchemy.orm import exc
 from neutron.db import common_db_mixin as base_db
+from neutron.db.models import l3 as l3_models
+from neutron.db import standard_attr
+from neutron_ecmp.api.definitions import ecmp as ecmp_ext
 from neutron_ecmp.common import ecmp_exceptions as exception
 from neutron_ecmp.extensions.ecmp import EcmpPluginBase
+from neutron_lib import constants as n_const
 from neutron_lib.plugins import directory
 from neutron_lib.db import model_base
+from neutron_lib.db import resource_extend
 from neutron_lib.callbacks import events
 from neutron_lib.callbacks import registry
 from neutron_lib.callbacks import resources
 
 LOG = logging.getLogger(__name__)
 
-class EcmpRoute(model_base.BASEV2, model_base.HasId, model_base.HasProject):
+RouterGeneration = collections.namedtuple('RouterGeneration', ['routes', 'interfaces'])
+
+
+def split_next_hops(next_hops):
+    """Return the next hop list stored in the next_hops column."""
+    return next_hops.split(',') if next_hops else []
+
+
+class EcmpRoutePool(model_base.BASEV2):
+    """Port selector of an ecmproute whose next hops follow its ports."""
+
+    __tablename__ = 'ecmp_route_pools'
+    __table_args__ = (sa.Index('ix_ecmp_route_pools_selector',
+                               'selector_type', 'selector_value'),)
+
+    route_id = sa.Column(sa.String(36),
+                         sa.ForeignKey('ecmproutes.id', ondelete="CASCADE"),
+                         primary_key=True)
+    selector_type = sa.Column(sa.String(36), nullable=False)
+    selector_value = sa.Column(sa.String(255), nullable=False)
+
+
+class EcmpRouteHost(model_base.BASEV2):
+    """Revision of an ecmproute last realized by the l3 agent of a host."""
+
+    __tablename__ = 'ecmp_route_hosts'
+
+    route_id = sa.Column(sa.String(36),
+                         sa.ForeignKey('ecmproutes.id', ondelete="CASCADE"),
+                         primary_key=True)
+    host = sa.Column(sa.String(255), primary_key=True)
+    # -1 until the host reports a realized revision_number
+    revision = sa.Column(sa.Integer, nullable=False, default=-1)
+    status = sa.Column(sa.String(16), nullable=False,
+                       default=ecmp_ext.STATUS_PENDING)
+
+
+class EcmpWithdrawnNextHop(model_base.BASEV2):
+    """Next hop of the ecmproutes of a router withdrawn while unhealthy.
+
+    A next hop may be withdrawn for several reasons, e.g. its port is down
+    and the l2 agent of its host is dead; it is used again once none is
+    left.
+    """
+
+    __tablename__ = 'ecmp_withdrawn_next_hops'
+
+    router_id = sa.Column(sa.String(36),
+                          sa.ForeignKey('routers.id', ondelete="CASCADE"),
+                          primary_key=True)
+    ip_address = sa.Column(sa.String(64), primary_key=True)
+    reason = sa.Column(sa.String(16), primary_key=True)
+    port_id = sa.Column(sa.String(36), nullable=False)
+    host = sa.Column(sa.String(255), index=True)
+
+
+class EcmpRoute(standard_attr.HasStandardAttributes, model_base.BASEV2,
+                model_base.HasId, model_base.HasProject):
     """Represents a  ecmproute."""
 
     # metadata for db
@@ -38,10 +107,114 @@ class EcmpRoute(model_base.BASEV2, model_base.HasId, model_base.HasProject):
     __table_args__ = ({'mysql_collate': 'utf8_bin'})
 
     vip = sa.Column(sa.String(46))
-    next_hops = sa.Column(sa.String(255))
+    next_hops = sa.Column(sa.Text)
+    hash_policy = sa.Column(sa.String(16), nullable=True)
     router_id = sa.Column(sa.String(36),
                           sa.ForeignKey('routers.id', ondelete="CASCADE"),
                           nullable=False)
+    # Agents report the revision_number they realized in EcmpRouteHost.
+    hosts = orm.relationship(EcmpRouteHost, lazy='subquery',
+                             cascade='all, delete-orphan',
+                             passive_deletes=True)
+    pool = orm.relationship(EcmpRoutePool, lazy='subquery', uselist=False,
+                            cascade='all, delete-orphan',
+                            passive_deletes=True)
+    # The withdrawn next hops of the router of the route. The tables have
+    # no foreign key in common: router_id is marked as the foreign side, so
+    # that the neutron db api neither adds a backref to the relationship
+    # nor expires anything but this collection when router_id changes.
+    withdrawn = orm.relationship(
+        EcmpWithdrawnNextHop, lazy='subquery', viewonly=True, uselist=True,
+        primaryjoin='foreign(EcmpRoute.router_id) == EcmpWithdrawnNextHop.router_id')
+    api_collections = [ecmp_ext.ECMPROUTES]
+    collection_resource_map = {ecmp_ext.ECMPROUTES: 'ecmp_route'}
+
+
+class EcmpNotification(model_base.BASEV2):
+    """Represents a pending ecmp notification to the l3 agents.
+
+    It is written in the same transaction as the ecmproute change and
+    removed once it has been dispatched to the agents. One whose dispatch
+    failed is kept and tried again from next_attempt_at.
+    """
+
+    __tablename__ = 'ecmp_notifications'
+
+    id = sa.Column(sa.BigInteger().with_variant(sa.Integer(), 'sqlite'),
+                   primary_key=True, autoincrement=True)
+    router_id = sa.Column(sa.String(36), nullable=False, index=True)
+    payload = sa.Column(sa.Text, nullable=False)
+    attempts = sa.Column(sa.Integer, nullable=False, default=0)
+    created_at = sa.Column(sa.DateTime, nullable=False)
+    next_attempt_at = sa.Column(sa.DateTime, nullable=True)
+
+
+class EcmpNotificationLease(model_base.BASEV2):
+    """Claim of a dispatcher on the pending notifications of a router.
+
+    Only the dispatcher holding the unexpired lease of a router sends its
+    notifications, so that concurrent dispatchers, e.g. of several
+    neutron-servers, never send them twice nor out of order. The row of a
+    router is kept once released, with no expiry, for the next claim.
+    """
+
+    __tablename__ = 'ecmp_notification_leases'
+
+    router_id = sa.Column(sa.String(36),
+                          sa.ForeignKey('routers.id', ondelete="CASCADE"),
+                          primary_key=True)
+    owner = sa.Column(sa.String(255), nullable=True)
+    expires_at = sa.Column(sa.DateTime, nullable=True)
+
+
+class EcmpQrPortRefcount(model_base.BASEV2):
+    """Number of next hops of a router charged to one of its qr ports."""
+
+    __tablename__ = 'ecmp_qr_port_refcounts'
+
+    router_id = sa.Column(sa.String(36),
+                          sa.ForeignKey('routers.id', ondelete="CASCADE"),
+                          primary_key=True)
+    port_id = sa.Column(sa.String(36), primary_key=True)
+    refcount = sa.Column(sa.Integer, nullable=False)
+
+
+class EcmpNextHopRefcount(model_base.BASEV2):
+    """Number of ecmproutes of a router using a next hop.
+
+    A next hop is charged to the qr port it is reached through when a first
+    route uses it, and the port is recorded, so that it is discharged from
+    that same port once no route uses it any more, whatever the interfaces
+    of the router are by then.
+    """
+
+    __tablename__ = 'ecmp_next_hop_refcounts'
+
+    router_id = sa.Column(sa.String(36),
+                          sa.ForeignKey('routers.id', ondelete="CASCADE"),
+                          primary_key=True)
+    next_hop = sa.Column(sa.String(64), primary_key=True)
+    port_id = sa.Column(sa.String(36), nullable=False)
+    refcount = sa.Column(sa.Integer, nullable=False)
+
+
+class EcmpRouterGeneration(model_base.BASEV2):
+    """Generations of the ecmproutes and of the interfaces of a router.
+
+    Bumped in the transactions changing them, so that the neutron-server
+    workers can tell whether what they cached of a router is still valid.
+    """
+
+    __tablename__ = 'ecmp_router_generations'
+
+    router_id = sa.Column(sa.String(36),
+                          sa.ForeignKey('routers.id', ondelete="CASCADE"),
+                          primary_key=True)
+    route_generation = sa.Column(sa.BigInteger, nullable=False, default=0)
+    interface_generation = sa.Column(sa.BigInteger, nullable=False, default=0)
+    # whether the next hop and qr port refcounts of the router were built
+    refcounts_built = sa.Column(sa.Boolean, nullable=False, default=False,
+                                server_default=sa.sql.false())
 
 
 class Ecmp_db_mixin(EcmpPluginBase, base_db.CommonDbMixin):
@@ -51,24 +224,136 @@ class Ecmp_db_mixin(EcmpPluginBase, base_db.CommonDbMixin):
     def _core_plugin(self):
         return directory.get_plugin()
 
-    def _make_ecmp_route_dict(self, ecmp_route, fields=None):
-        next_hops_str = ecmp_route['next_hops']
-
-        next_hops_list = next_hops_str.split(',')
-        LOG.debug('ecmp: the next_hop string is %s, list is %s', next_hops_str, next_hops_list)
+    def _make_ecmp_route_dict(self, ecmp_route, fields=None, next_hops=None):
+        if next_hops is not None:
+            next_hops_list = list(next_hops)
+        else:
+            next_hops_str = ecmp_route['next_hops']
+            next_hops_list = split_next_hops(next_hops_str)
+            LOG.debug('ecmp: the next_hop string is %s, list is %s', next_hops_str, next_hops_list)
         res = {'id': ecmp_route['id'],
                'tenant_id': ecmp_route['tenant_id'],
                'vip': ecmp_route['vip'],
                'next_hops': next_hops_list,
-               'router_id': ecmp_route['router_id']}
+               'effective_next_hops': self._get_effective_next_hops(
+                   ecmp_route, next_hops_list),
+               'router_id': ecmp_route['router_id'],
+               'hash_policy': ecmp_route['hash_policy'],
+               'port_selector': self._make_port_selector(ecmp_route.pool),
+               'status': self._get_ecmp_route_status(ecmp_route),
+               'realized_revisions': dict((h.host, h.revision)
+                                          for h in ecmp_route.hosts
+                                          if h.revision >= 0),
+               'revision_number': ecmp_route.revision_number}
+        resource_extend.apply_funcs(ecmp_ext.ECMPROUTES, res, ecmp_route)
         return self._fields(res, fields)
 
+    @staticmethod
+    def _get_effective_next_hops(ecmp_route, next_hops):
+        """Return the next hops of a route which are not withdrawn.
+
+        When all of them are, traffic keeps being spread over all of them
+        rather than being dropped.
+        """
+        withdrawn = set(w.ip_address for w in ecmp_route.withdrawn)
+        effective = [next_hop for next_hop in next_hops if next_hop not in withdrawn]
+        return effective or list(next_hops)
+
+    @staticmethod
+    def _make_port_selector(pool):
+        return pool and {pool.selector_type: pool.selector_value}
+
+    @staticmethod
+    def _get_ecmp_route_status(ecmp_route):
+        """Derive the status of a route from its hosts.
+
+        ACTIVE once every host notified of the route realized its current
+        revision, ERROR when one of them failed to realize it, else PENDING.
+        """
+        hosts = ecmp_route.hosts
+        if not hosts:
+            return ecmp_ext.STATUS_PENDING
+        revision = ecmp_route.revision_number
+        if any(h.status == ecmp_ext.STATUS_ERROR and h.revision >= revision
+               for h in hosts):
+            return ecmp_ext.STATUS_ERROR
+        if all(h.revision >= revision for h in hosts):
+            return ecmp_ext.STATUS_ACTIVE
+        return ecmp_ext.STATUS_PENDING
+
     def _get_ecmproute(self, context, id):
         try:
             return self._get_by_id(context, EcmpRoute, id)
         except exc.NoResultFound:
             raise exception.EcmprouteNotFound(id=id)
 
+    def _lock_ecmproute(self, context, id):
+        # SELECT ... FOR UPDATE, to be called in the updating transaction.
+        query = context.session.query(EcmpRoute).filter_by(id=id)
+        try:
+            return query.with_for_update().one()
+        except exc.NoResultFound:
+            raise exception.EcmprouteNotFound(id=id)
+
+    def _get_next_hops_of_router(self, context, router_id):
+        """Yield the next hop list of every ecmproute of the router.
+
+        Only the next_hops column is loaded, no ecmproute object is built.
+        """
+        query = context.session.query(EcmpRoute.next_hops)
+        for next_hops, in query.filter(EcmpRoute.router_id == router_id):
+            yield split_next_hops(next_hops)
+
+    def _lock_ecmproutes_of_routers(self, context, router_ids):
+        if not router_ids:
+            return []
+        query = context.session.query(EcmpRoute)
+        query = query.filter(EcmpRoute.router_id.in_(router_ids))
+        return query.with_for_update().all()
+
+    def _get_ecmproutes_of_routers(self, context, router_ids):
+        if not router_ids:
+            return []
+        query = context.session.query(EcmpRoute)
+        return query.filter(EcmpRoute.router_id.in_(router_ids)).all()
+
+    def _get_route_ids_of_routers(self, context, router_ids):
+        """Return the ids of the ecmproutes of each router, in one query."""
+        route_ids_of_router = collections.defaultdict(list)
+        if not router_ids:
+            return route_ids_of_router
+        query = context.session.query(EcmpRoute.router_id, EcmpRoute.id)
+        for router_id, route_id in query.filter(EcmpRoute.router_id.in_(router_ids)):
+            route_ids_of_router[router_id].append(route_id)
+        return route_ids_of_router
+
+    def _get_next_hop_sets_of_routers(self, context, router_ids):
+        """Return the set of all the next hops of each router."""
+        next_hops_of_router = collections.defaultdict(set)
+        if not router_ids:
+            return next_hops_of_router
+        query = context.session.query(EcmpRoute.router_id, EcmpRoute.next_hops)
+        for router_id, next_hops in query.filter(EcmpRoute.router_id.in_(router_ids)):
+            next_hops_of_router[router_id].update(split_next_hops(next_hops))
+        return next_hops_of_router
+
+    def _lock_router(self, context, router_id):
+        # SELECT ... FOR UPDATE of the router, to be called in the
+        # transaction adding an ecmproute to it.
+        query = context.session.query(l3_models.Router.id)
+        query.filter(l3_models.Router.id == router_id).with_for_update().first()
+
+    def _get_router_hash_policy(self, context, router_id):
+        """Return the hash policy set by the ecmproutes of a router, if any.
+
+        The read locks the routes, so that it sees the committed ones.
+        """
+        query = context.session.query(EcmpRoute.hash_policy)
+        query = query.filter(EcmpRoute.router_id == router_id,
+                             EcmpRoute.hash_policy.isnot(None))
+        hash_policy = query.with_for_update().first()
+        return hash_policy and hash_policy[0]
+
     def _get_ecmproute_by_router_id(self, context, router_id):
         query = context.session.query(EcmpRoute)
         query1 = query.filter(EcmpRoute.router_id == router_id).all()
@@ -84,7 +369,7 @@ class Ecmp_db_mixin(EcmpPluginBase, base_db.CommonDbMixin):
         query = context.session.query(EcmpRoute)
         query1 = query.filter(EcmpRoute.router_id == router_id).all()
         for q in query1:
-            all_next_hops.extend(q['next_hops'].split(','))
+            all_next_hops.extend(split_next_hops(q['next_hops']))
         return all_next_hops
 
     def _validate_vip_exist(self, context, ecmproute):
@@ -110,19 +395,29 @@ class Ecmp_db_mixin(EcmpPluginBase, base_db.CommonDbMixin):
                                      tenant_id=ecmproute['tenant_id'],
                                      vip=ecmproute['vip'],
                                      next_hops=next_hops_string,
-                                     router_id=ecmproute['router_id'])
+                                     router_id=ecmproute['router_id'],
+                                     hash_policy=ecmproute.get('hash_policy'))
+            for selector_type, value in (ecmproute.get('port_selector') or {}).items():
+                ecmproute_db.pool = EcmpRoutePool(selector_type=selector_type,
+                                                  selector_value=value)
             context.session.add(ecmproute_db)
+            # revision_number is only set once flushed
+            context.session.flush()
         return self._make_ecmp_route_dict(ecmproute_db)
 
+    def _update_ecmp_route_next_hops(self, context, ecmproute_db, next_hops):
+        with context.session.begin(subtransactions=True):
+            ecmproute_db.next_hops = ','.join(next_hops)
+            # bumps revision_number, and fails if another transaction
+            # changed the route meanwhile or an If-Match does not match
+            context.session.flush()
+        return self._make_ecmp_route_dict(ecmproute_db, next_hops=next_hops)
+
     def update_ecmp_route(self, context, id, ecmp_route):
-        ecmproute = ecmp_route['ecmp_route']
-        next_hops = ecmproute['next_hops']
-        next_hops_string = ','.join(next_hops)
-        ecmproute['next_hops'] = next_hops_string
+        next_hops = ecmp_route['ecmp_route']['next_hops']
         with context.session.begin(subtransactions=True):
-            ecmproute_db = self._get_ecmproute(context, id)
-            ecmproute_db.update(ecmproute)
-        return self._make_ecmp_route_dict(ecmproute_db)
+            ecmproute_db = self._lock_ecmproute(context, id)
+            return self._update_ecmp_route_next_hops(context, ecmproute_db, next_hops)
 
     def get_ecmp_route(self, context, id, fields=None):
         ecmproute_db = self._get_ecmproute(context, id)
@@ -137,7 +432,436 @@ class Ecmp_db_mixin(EcmpPluginBase, base_db.CommonDbMixin):
 
     def delete_ecmp_route(self, context, id):
         with context.session.begin(subtransactions=True):
-            context.session.query(EcmpRoute).filter_by(id=id).delete()
+            # through the session, so that its standard attributes go too
+            context.session.delete(self._lock_ecmproute(context, id))
+
+    def _get_ecmp_pool_route_ids(self, context, selectors):
+        """Return the ids of the ecmproutes whose port selector is one of selectors.
+
+        :param selectors: iterable of (selector type, value).
+        """
+        selectors = set(selectors)
+        if not selectors:
+            return []
+        query = context.session.query(EcmpRoutePool.route_id)
+        query = query.filter(sa.or_(*[
+            sa.and_(EcmpRoutePool.selector_type == selector_type,
+                    EcmpRoutePool.selector_value == value)
+            for selector_type, value in selectors]))
+        return [route_id for route_id, in query]
+
+    def _add_withdrawn_next_hops(self, context, next_hops_of_router, reason, host=None):
+        """Withdraw next hops for a reason.
+
+        :param next_hops_of_router: dict of router id to a dict of next hop
+               to the id of its port.
+        :returns: dict of router id to its next hops newly withdrawn for
+                  this reason.
+        """
+        added = collections.defaultdict(set)
+        if not next_hops_of_router:
+            return added
+        with context.session.begin(subtransactions=True):
+            query = context.session.query(EcmpWithdrawnNextHop.router_id,
+                                          EcmpWithdrawnNextHop.ip_address)
+            query = query.filter(
+                EcmpWithdrawnNextHop.reason == reason,
+                EcmpWithdrawnNextHop.router_id.in_(list(next_hops_of_router)))
+            existing = set(query)
+            for router_id, next_hops in next_hops_of_router.items():
+                for ip_address, port_id in next_hops.items():
+                    if (router_id, ip_address) in existing:
+                        continue
+                    context.session.add(EcmpWithdrawnNextHop(
+                        router_id=router_id, ip_address=ip_address,
+                        reason=reason, port_id=port_id, host=host))
+                    added[router_id].add(ip_address)
+        return added
+
+    def _delete_withdrawn_next_hops(self, context, reason, next_hops_of_router=None, hosts=None):
+        """Restore the next hops withdrawn for a reason.
+
+        Either the given next hops of routers, or all those withdrawn on
+        hosts, are restored.
+
+        :returns: dict of router id to its restored next hops.
+        """
+        deleted = collections.defaultdict(set)
+        if not next_hops_of_router and not hosts:
+            return deleted
+        with context.session.begin(subtransactions=True):
+            query = context.session.query(EcmpWithdrawnNextHop)
+            query = query.filter(EcmpWithdrawnNextHop.reason == reason)
+            if hosts:
+                query = query.filter(EcmpWithdrawnNextHop.host.in_(list(hosts)))
+            else:
+                query = query.filter(
+                    EcmpWithdrawnNextHop.router_id.in_(list(next_hops_of_router)))
+            for withdrawn in query:
+                if (next_hops_of_router and withdrawn.ip_address not in
+                        next_hops_of_router.get(withdrawn.router_id, ())):
+                    continue
+                deleted[withdrawn.router_id].add(withdrawn.ip_address)
+                context.session.delete(withdrawn)
+        return deleted
+
+    def _forget_withdrawn_next_hops(self, context, router_id, removed_next_hops):
+        """Forget the withdrawn next hops no ecmproute of the router uses.
+
+        To be called once the routes of the router are written.
+        """
+        if not removed_next_hops:
+            return
+        with context.session.begin(subtransactions=True):
+            query = context.session.query(EcmpWithdrawnNextHop)
+            withdrawn = query.filter(
+                EcmpWithdrawnNextHop.router_id == router_id,
+                EcmpWithdrawnNextHop.ip_address.in_(list(removed_next_hops))).all()
+            if not withdrawn:
+                return
+            used = self._get_next_hop_sets_of_routers(context, [router_id])[router_id]
+            for withdrawn_next_hop in withdrawn:
+                if withdrawn_next_hop.ip_address not in used:
+                    context.session.delete(withdrawn_next_hop)
+
+    def _get_withdrawn_hosts(self, context, reason):
+        query = context.session.query(EcmpWithdrawnNextHop.host).distinct()
+        query = query.filter(EcmpWithdrawnNextHop.reason == reason,
+                             EcmpWithdrawnNextHop.host.isnot(None))
+        return set(host for host, in query)
+
+    def _add_ecmp_notification(self, context, router_id, payload):
+        with context.session.begin(subtransactions=True):
+            context.session.add(EcmpNotification(
+                router_id=router_id,
+                payload=jsonutils.dumps(payload),
+                attempts=0,
+                created_at=timeutils.utcnow()))
+
+    def _claim_ecmp_notifications(self, context, owner, limit, lease_time):
+        """Claim the oldest pending notifications, router by router.
+
+        The routers of the oldest limit notifications are claimed with a
+        lease, taken over from another owner once expired; a router whose
+        lease is held by another owner is left to it, as is a router with a
+        notification to try again later.
+
+        :returns: the pending notifications of the routers claimed by
+                  owner, at most limit of them, in order.
+        """
+        now = timeutils.utcnow()
+        expires_at = now + datetime.timedelta(seconds=lease_time)
+        deferred = context.session.query(EcmpNotification.router_id).filter(
+            EcmpNotification.next_attempt_at > now)
+        query = context.session.query(EcmpNotification.router_id)
+        query = query.filter(~EcmpNotification.router_id.in_(deferred.subquery()))
+        router_ids = set(router_id for router_id, in
+                         query.order_by(EcmpNotification.id).limit(limit))
+        if not router_ids:
+            return []
+        with context.session.begin(subtransactions=True):
+            query = context.session.query(EcmpNotificationLease)
+            query.filter(EcmpNotificationLease.router_id.in_(list(router_ids)),
+                         sa.or_(EcmpNotificationLease.expires_at.is_(None),
+                                EcmpNotificationLease.expires_at < now,
+                                EcmpNotificationLease.owner == owner)).update(
+                {EcmpNotificationLease.owner: owner,
+                 EcmpNotificationLease.expires_at: expires_at},
+                synchronize_session=False)
+            query = context.session.query(EcmpNotificationLease.router_id)
+            new_router_ids = router_ids - set(router_id for router_id, in query.filter(
+                EcmpNotificationLease.router_id.in_(list(router_ids))))
+        for router_id in sorted(new_router_ids):
+            try:
+                with context.session.begin(subtransactions=True):
+                    context.session.add(EcmpNotificationLease(
+                        router_id=router_id, owner=owner, expires_at=expires_at))
+            except db_exc.DBDuplicateEntry:
+                LOG.debug('ecmp: router %s claimed by another dispatcher', router_id)
+            except db_exc.DBReferenceError:
+                # deleted meanwhile, its agents are purged of it anyway
+                self._delete_ecmp_notifications_of_routers(context, [router_id])
+        query = context.session.query(EcmpNotification).join(
+            EcmpNotificationLease,
+            EcmpNotificationLease.router_id == EcmpNotification.router_id)
+        query = query.filter(EcmpNotificationLease.owner == owner,
+                             EcmpNotificationLease.expires_at > now)
+        return query.order_by(EcmpNotification.id).limit(limit).all()
+
+    def _release_ecmp_notification_leases(self, context, owner):
+        with context.session.begin(subtransactions=True):
+            query = context.session.query(EcmpNotificationLease)
+            query.filter(EcmpNotificationLease.owner == owner).update(
+                {EcmpNotificationLease.expires_at: None},
+                synchronize_session=False)
+
+    def _delete_ecmp_notifications(self, context, ids):
+        if not ids:
+            return
+        with context.session.begin(subtransactions=True):
+            query = context.session.query(EcmpNotification)
+            query.filter(EcmpNotification.id.in_(ids)).delete(
+                synchronize_session=False)
+
+    def _delete_ecmp_notifications_of_routers(self, context, router_ids):
+        with context.session.begin(subtransactions=True):
+            query = context.session.query(EcmpNotification)
+            query.filter(EcmpNotification.router_id.in_(router_ids)).delete(
+                synchronize_session=False)
+
+    def _retry_ecmp_notifications(self, context, ids_of_delay):
+        """Count a failed attempt of notifications, to try them again later.
+
+        :param ids_of_delay: dict of the seconds to wait before the next
+               attempt to the ids of the notifications.
+        """
+        if not ids_of_delay:
+            return
+        now = timeutils.utcnow()
+        with context.session.begin(subtransactions=True):
+            for delay, ids in ids_of_delay.items():
+                query = context.session.query(EcmpNotification)
+                query.filter(EcmpNotification.id.in_(ids)).update(
+                    {EcmpNotification.attempts: EcmpNotification.attempts + 1,
+                     EcmpNotification.next_attempt_at: now + datetime.timedelta(seconds=delay)},
+                    synchronize_session=False)
+
+    def _set_ecmp_route_hosts(self, context, hosts_of_route):
+        """Record the hosts an ecmproute revision was sent to.
+
+        Hosts which no longer host the router of a route are forgotten, new
+        ones start with nothing realized.
+
+        :param hosts_of_route: dict of route id to the notified hosts.
+        """
+        if not hosts_of_route:
+            return
+        with context.session.begin(subtransactions=True):
+            query = context.session.query(EcmpRouteHost.route_id,
+                                          EcmpRouteHost.host)
+            query = query.filter(EcmpRouteHost.route_id.in_(list(hosts_of_route)))
+            known = set(query)
+            stale = [(route_id, host) for route_id, host in known
+                     if host not in hosts_of_route[route_id]]
+            for route_id, host in stale:
+                context.session.query(EcmpRouteHost).filter_by(
+                    route_id=route_id, host=host).delete(
+                        synchronize_session=False)
+            existing_routes = set(
+                route_id for route_id, in context.session.query(EcmpRoute.id).filter(
+                    EcmpRoute.id.in_(list(hosts_of_route))))
+            context.session.bulk_insert_mappings(EcmpRouteHost, [
+                {'route_id': route_id, 'host': host, 'revision': -1,
+                 'status': ecmp_ext.STATUS_PENDING}
+                for route_id, hosts in hosts_of_route.items()
+                if route_id in existing_routes
+                for host in hosts if (route_id, host) not in known])
+
+    def _update_ecmp_route_hosts(self, context, host, statuses):
+        """Write the revisions realized by a host with one bulk UPDATE.
+
+        A status only overrides an older revision, so that reports arriving
+        out of order never move a route back.
+
+        :param statuses: list of dicts with the id, revision and status of
+               the realized routes.
+        """
+        if not statuses:
+            return
+        table = EcmpRouteHost.__table__
+        stmt = table.update().where(sa.and_(
+            table.c.route_id == sa.bindparam('b_route_id'),
+            table.c.host == sa.bindparam('b_host'),
+            table.c.revision <= sa.bindparam('b_revision'))).values(
+                revision=sa.bindparam('b_revision'),
+                status=sa.bindparam('b_status'))
+        with context.session.begin(subtransactions=True):
+            context.session.execute(stmt, [
+                {'b_route_id': status['id'],
+                 'b_host': host,
+                 'b_revision': status['revision'],
+                 'b_status': status['status']} for status in statuses])
+
+    def _are_qr_port_refcounts_built(self, context, router_id):
+        query = context.session.query(EcmpRouterGeneration.refcounts_built)
+        built = query.filter(EcmpRouterGeneration.router_id == router_id).first()
+        return bool(built and built[0])
+
+    def _set_qr_port_refcounts(self, context, router_id, next_hop_refcounts, port_of_next_hop):
+        """Replace the refcounts of the router and mark them built.
+
+        :param next_hop_refcounts: dict of next hop to its number of routes.
+        :param port_of_next_hop: dict of next hop to the qr port it is
+               charged to, next hops without one are not counted.
+        """
+        port_refcounts = collections.Counter()
+        with context.session.begin(subtransactions=True):
+            for model in (EcmpNextHopRefcount, EcmpQrPortRefcount):
+                context.session.query(model).filter(
+                    model.router_id == router_id).delete(synchronize_session=False)
+            for next_hop, refcount in next_hop_refcounts.items():
+                port_id = port_of_next_hop.get(next_hop)
+                if refcount > 0 and port_id:
+                    context.session.add(EcmpNextHopRefcount(
+                        router_id=router_id, next_hop=next_hop,
+                        port_id=port_id, refcount=refcount))
+                    port_refcounts[port_id] += 1
+            for port_id, refcount in port_refcounts.items():
+                context.session.add(EcmpQrPortRefcount(
+                    router_id=router_id, port_id=port_id,
+                    refcount=refcount))
+            query = context.session.query(EcmpRouterGeneration)
+            query = query.filter(EcmpRouterGeneration.router_id == router_id)
+            if not query.update({EcmpRouterGeneration.refcounts_built: True},
+                                synchronize_session=False):
+                context.session.add(EcmpRouterGeneration(
+                    router_id=router_id, route_generation=0,
+                    interface_generation=0, refcounts_built=True))
+
+    def _update_qr_port_refcounts(self, context, router_id, deltas, get_port_of_next_hop):
+        """Add deltas to the next hop refcounts of the router.
+
+        A new next hop is charged to the qr port get_port_of_next_hop
+        returns, a next hop no longer used is discharged from the port
+        recorded with it.
+
+        :param deltas: dict of next hop to the change of its number of
+               routes.
+        :returns: the ids of the ports no next hop is charged to any more.
+        """
+        deltas = dict((next_hop, delta) for next_hop, delta in deltas.items() if delta)
+        if not deltas:
+            return []
+        port_deltas = collections.Counter()
+        with context.session.begin(subtransactions=True):
+            query = context.session.query(EcmpNextHopRefcount)
+            query = query.filter(
+                EcmpNextHopRefcount.router_id == router_id,
+                EcmpNextHopRefcount.next_hop.in_(list(deltas)))
+            for refcount_db in query.with_for_update():
+                refcount_db.refcount += deltas.pop(refcount_db.next_hop)
+                if refcount_db.refcount <= 0:
+                    port_deltas[refcount_db.port_id] -= 1
+                    context.session.delete(refcount_db)
+            for next_hop, delta in deltas.items():
+                port_id = get_port_of_next_hop(next_hop) if delta > 0 else None
+                if port_id:
+                    context.session.add(EcmpNextHopRefcount(
+                        router_id=router_id, next_hop=next_hop,
+                        port_id=port_id, refcount=delta))
+                    port_deltas[port_id] += 1
+            return self._update_port_refcounts(context, router_id, port_deltas)
+
+    def _update_port_refcounts(self, context, router_id, deltas):
+        """Add deltas to the refcounts of qr ports of the router.
+
+        :param deltas: dict of qr port id to the change of its refcount.
+        :returns: the ids of the ports whose refcount dropped to zero.
+        """
+        unused_port_ids = []
+        deltas = dict((port_id, delta) for port_id, delta in deltas.items()
+                      if port_id and delta)
+        if not deltas:
+            return unused_port_ids
+        with context.session.begin(subtransactions=True):
+            query = context.session.query(EcmpQrPortRefcount)
+            query = query.filter(
+                EcmpQrPortRefcount.router_id == router_id,
+                EcmpQrPortRefcount.port_id.in_(list(deltas)))
+            for refcount_db in query.with_for_update():
+                refcount_db.refcount += deltas.pop(refcount_db.port_id)
+                if refcount_db.refcount <= 0:
+                    unused_port_ids.append(refcount_db.port_id)
+                    context.session.delete(refcount_db)
+            for port_id, delta in deltas.items():
+                if delta > 0:
+                    context.session.add(EcmpQrPortRefcount(
+                        router_id=router_id, port_id=port_id,
+                        refcount=delta))
+        return unused_port_ids
+
+    def _get_router_generations(self, context, router_ids):
+        """Return the RouterGeneration of each router, in one query.
+
+        The routers without a generation yet are at generation 0.
+        """
+        generations = dict((router_id, RouterGeneration(0, 0)) for router_id in router_ids)
+        if not generations:
+            return generations
+        query = context.session.query(EcmpRouterGeneration.router_id,
+                                      EcmpRouterGeneration.route_generation,
+                                      EcmpRouterGeneration.interface_generation)
+        query = query.filter(EcmpRouterGeneration.router_id.in_(list(generations)))
+        for router_id, route_generation, interface_generation in query:
+            generations[router_id] = RouterGeneration(route_generation, interface_generation)
+        return generations
+
+    def _bump_router_generations(self, context, router_ids, routes=True, interfaces=False):
+        """Bump the generations of routers, in the transaction of the change.
+
+        A router without a generation yet gets one. The routers of ecmproute
+        changes exist, as their ecmproutes reference them; the ones of
+        interface changes are checked, as a port may name a deleted router.
+        """
+        router_ids = set(router_id for router_id in router_ids if router_id)
+        values = {}
+        if routes:
+            values[EcmpRouterGeneration.route_generation] = EcmpRouterGeneration.route_generation + 1
+        if interfaces:
+            values[EcmpRouterGeneration.interface_generation] = (
+                EcmpRouterGeneration.interface_generation + 1)
+        if not router_ids or not values:
+            return
+        with context.session.begin(subtransactions=True):
+            query = context.session.query(EcmpRouterGeneration)
+            query = query.filter(EcmpRouterGeneration.router_id.in_(router_ids))
+            query.update(values, synchronize_session=False)
+            query = context.session.query(EcmpRouterGeneration.router_id)
+            router_ids -= set(router_id for router_id, in query.filter(
+                EcmpRouterGeneration.router_id.in_(router_ids)))
+            if router_ids and not routes:
+                query = context.session.query(l3_models.Router.id)
+                router_ids = set(router_id for router_id, in query.filter(
+                    l3_models.Router.id.in_(router_ids)))
+            for router_id in router_ids:
+                context.session.add(EcmpRouterGeneration(
+                    router_id=router_id, route_generation=int(routes),
+                    interface_generation=int(interfaces)))
+
+
+def _get_interface_router_ids(port):
+    if port and port.get('device_owner') in n_const.ROUTER_INTERFACE_OWNERS:
+        return set([port.get('device_id')])
+    return set()
+
+
+def ecmp_router_port_callback(resource, event, trigger, payload=None, **kwargs):
+    """Bump the interface generation of the routers of a changed qr port.
+
+    ml2 publishes PRECOMMIT_UPDATE with a DBEventPayload, whose states hold
+    the port before the update, and the other events with keyword
+    arguments.
+    """
+    if payload is not None:
+        context = payload.context
+        port = payload.latest_state
+        original_port = payload.states[0] if payload.states else None
+        if original_port is port:
+            original_port = None
+    else:
+        context = kwargs['context']
+        port = kwargs.get('port')
+        original_port = kwargs.get('original_port')
+    router_ids = _get_interface_router_ids(port) | _get_interface_router_ids(original_port)
+    if not router_ids:
+        return
+    if original_port is not None and all(
+            port.get(key) == original_port.get(key)
+            for key in ('device_owner', 'device_id', 'fixed_ips')):
+        return
+    ecmp_plugin = directory.get_plugin('ECMP')
+    ecmp_plugin.bump_router_interface_generations(context, router_ids)
+
 
 def ecmp_callback(resource, event, trigger, **kwargs):
     LOG.debug('ecmp callback is called for resource router_interface before_delete, kwargs: %s',
@@ -146,6 +870,36 @@ def ecmp_callback(resource, event, trigger, **kwargs):
     ecmp_plugin.check_router_interface_not_in_use(**kwargs)
 
 
+def ecmp_router_delete_callback(resource, event, trigger, **kwargs):
+    # the ecmproutes of the router were deleted with it, by their foreign key
+    ecmp_plugin = directory.get_plugin('ECMP')
+    ecmp_plugin.purge_ecmp_routers(kwargs['context'], [kwargs['router_id']])
+
+
+def ecmp_router_interface_delete_callback(resource, event, trigger, **kwargs):
+    ecmp_plugin = directory.get_plugin('ECMP')
+    ecmp_plugin.resync_ecmp_routers_of_interface(kwargs['context'], kwargs['router_id'])
+
+
+def ecmp_port_callback(resource, event, trigger, **kwargs):
+    ecmp_plugin = directory.get_plugin('ECMP')
+    deleted = event == events.AFTER_DELETE
+    ecmp_plugin.update_ecmp_pools(kwargs['context'], kwargs['port'],
+                                  original_port=kwargs.get('original_port'),
+                                  deleted=deleted)
+    ecmp_plugin.update_port_health(kwargs['context'], kwargs['port'],
+                                   original_port=kwargs.get('original_port'),
+                                   deleted=deleted)
+
+
 def subscribe():
     registry.subscribe(
         ecmp_callback, resources.ROUTER_INTERFACE, events.BEFORE_DELETE)
+    for event in (events.AFTER_CREATE, events.AFTER_UPDATE, events.AFTER_DELETE):
+        registry.subscribe(ecmp_port_callback, resources.PORT, event)
+    for event in (events.PRECOMMIT_CREATE, events.PRECOMMIT_UPDATE, events.PRECOMMIT_DELETE):
+        registry.subscribe(ecmp_router_port_callback, resources.PORT, event)
+    registry.subscribe(
+        ecmp_router_delete_callback, resources.ROUTER, events.AFTER_DELETE)
+    registry.subscribe(
+        ecmp_router_interface_delete_callback, resources.ROUTER_INTERFACE, events.AFTER_DELETE)
@@ -0,0 +1,73 @@
+# Copyright 2019 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+"""drop the revision of ecmproutes
+
+Revision ID: 4f2c8e1a7d93
+Revises: start_ecmp
+Create Date: 2020-11-04 10:17:52.830164
+
+"""
+from alembic import op
+from neutron.db.migration import cli
+from oslo_utils import timeutils
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f2c8e1a7d93'
+down_revision = 'start_ecmp'
+branch_labels = (cli.CONTRACT_BRANCH,)
+depends_on = ('c2f64b3ad9e1',)
+
+TABLE = 'ecmproutes'
+
+standardattrs = sa.Table(
+    'standardattributes', sa.MetaData(),
+    sa.Column('id', sa.BigInteger(), primary_key=True, autoincrement=True),
+    sa.Column('resource_type', sa.String(length=255), nullable=False),
+    sa.Column('revision_number', sa.BigInteger(), nullable=False),
+    sa.Column('created_at', sa.DateTime()),
+    sa.Column('updated_at', sa.DateTime()))
+
+ecmproutes = sa.Table(
+    TABLE, sa.MetaData(),
+    sa.Column('id', sa.String(length=36), primary_key=True),
+    sa.Column('revision', sa.Integer()),
+    sa.Column('standard_attr_id', sa.BigInteger()))
+
+
+def upgrade():
+    # The routes created by the servers of the previous release after the
+    # expand migrations have no standard attributes yet.
+    bind = op.get_bind()
+    now = timeutils.utcnow()
+    for route_id, route_revision in bind.execute(
+            sa.select([ecmproutes.c.id, ecmproutes.c.revision]).where(
+                ecmproutes.c.standard_attr_id.is_(None))).fetchall():
+        result = bind.execute(standardattrs.insert().values(
+            resource_type=TABLE, revision_number=route_revision,
+            created_at=now, updated_at=now))
+        bind.execute(ecmproutes.update().values(
+            standard_attr_id=result.inserted_primary_key[0]).where(
+                ecmproutes.c.id == route_id))
+    op.alter_column(TABLE, 'standard_attr_id', nullable=False,
+                    existing_type=sa.BigInteger(), existing_nullable=True)
+    op.drop_column(TABLE, 'revision')
+
+def downgrade():
+    op.add_column(TABLE, sa.Column('revision', sa.Integer(), nullable=False,
+                                   server_default='1'))
+    op.alter_column(TABLE, 'standard_attr_id', nullable=True,
+                    existing_type=sa.BigInteger(), existing_nullable=False)
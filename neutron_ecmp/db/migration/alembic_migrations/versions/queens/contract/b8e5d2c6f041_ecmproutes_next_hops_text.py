@@ -0,0 +1,39 @@
+# Copyright 2019 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+"""use a text column for the next hops of ecmproutes
+
+Revision ID: b8e5d2c6f041
+Revises: 4f2c8e1a7d93
+Create Date: 2020-11-04 10:42:19.206581
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8e5d2c6f041'
+down_revision = '4f2c8e1a7d93'
+branch_labels = None
+depends_on = ('5b7e0d94c1a6',)
+
+def upgrade():
+    # The next hops of a pool are not bounded by the api.
+    op.alter_column('ecmproutes', 'next_hops', type_=sa.Text(),
+                    existing_type=sa.String(length=255), existing_nullable=False)
+
+def downgrade():
+    op.alter_column('ecmproutes', 'next_hops', type_=sa.String(length=255),
+                    existing_type=sa.Text(), existing_nullable=False)
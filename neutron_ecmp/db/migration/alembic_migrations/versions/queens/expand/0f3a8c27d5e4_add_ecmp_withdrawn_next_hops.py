@@ -0,0 +1,45 @@
+# Copyright 2019 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+"""add ecmp withdrawn next hops table
+
+Revision ID: 0f3a8c27d5e4
+Revises: 5b7e0d94c1a6
+Create Date: 2020-09-02 11:47:05.920341
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0f3a8c27d5e4'
+down_revision = '5b7e0d94c1a6'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        'ecmp_withdrawn_next_hops',
+        sa.Column('router_id', sa.String(length=36), nullable=False),
+        sa.Column('ip_address', sa.String(length=64), nullable=False),
+        sa.Column('reason', sa.String(length=16), nullable=False),
+        sa.Column('port_id', sa.String(length=36), nullable=False),
+        sa.Column('host', sa.String(length=255), nullable=True, index=True),
+        sa.PrimaryKeyConstraint('router_id', 'ip_address', 'reason'),
+        sa.ForeignKeyConstraint(['router_id'], ['routers.id'], ondelete='CASCADE')
+    )
+
+def downgrade():
+    op.drop_table("ecmp_withdrawn_next_hops")
@@ -0,0 +1,51 @@
+# Copyright 2019 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+"""add ecmp next hop refcounts table
+
+Revision ID: 1e6f4a9c3b75
+Revises: 84d38b8ec06c
+Create Date: 2020-11-03 11:08:26.417390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1e6f4a9c3b75'
+down_revision = '84d38b8ec06c'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # No router is marked built: the plugin rebuilds the qr port refcounts
+    # of each router, with the next hops they are charged to, on the first
+    # change of one of its ecmp routes.
+    op.create_table(
+        'ecmp_next_hop_refcounts',
+        sa.Column('router_id', sa.String(length=36), nullable=False),
+        sa.Column('next_hop', sa.String(length=64), nullable=False),
+        sa.Column('port_id', sa.String(length=36), nullable=False),
+        sa.Column('refcount', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('router_id', 'next_hop'),
+        sa.ForeignKeyConstraint(['router_id'], ['routers.id'], ondelete='CASCADE')
+    )
+    op.add_column('ecmp_router_generations',
+                  sa.Column('refcounts_built', sa.Boolean(), nullable=False,
+                            server_default=sa.sql.false()))
+
+def downgrade():
+    op.drop_column('ecmp_router_generations', 'refcounts_built')
+    op.drop_table("ecmp_next_hop_refcounts")
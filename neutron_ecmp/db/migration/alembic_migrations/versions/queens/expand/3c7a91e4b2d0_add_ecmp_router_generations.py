@@ -0,0 +1,45 @@
+# Copyright 2019 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+"""add ecmp router generations table
+
+Revision ID: 3c7a91e4b2d0
+Revises: 9d2b6e5f8a13
+Create Date: 2020-10-12 10:21:47.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c7a91e4b2d0'
+down_revision = '9d2b6e5f8a13'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Routers get a row on the first change of their ecmp routes or of
+    # their interfaces, they are at generation 0 until then.
+    op.create_table(
+        'ecmp_router_generations',
+        sa.Column('router_id', sa.String(length=36), nullable=False),
+        sa.Column('route_generation', sa.BigInteger(), nullable=False),
+        sa.Column('interface_generation', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('router_id'),
+        sa.ForeignKeyConstraint(['router_id'], ['routers.id'], ondelete='CASCADE')
+    )
+
+def downgrade():
+    op.drop_table("ecmp_router_generations")
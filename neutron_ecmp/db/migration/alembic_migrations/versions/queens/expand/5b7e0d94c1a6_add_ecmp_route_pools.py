@@ -0,0 +1,47 @@
+# Copyright 2019 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+"""add ecmp route pools table
+
+Revision ID: 5b7e0d94c1a6
+Revises: c2f64b3ad9e1
+Create Date: 2020-08-26 09:12:40.335718
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b7e0d94c1a6'
+down_revision = 'c2f64b3ad9e1'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        'ecmp_route_pools',
+        sa.Column('route_id', sa.String(length=36), nullable=False),
+        sa.Column('selector_type', sa.String(length=36), nullable=False),
+        sa.Column('selector_value', sa.String(length=255), nullable=False),
+        sa.PrimaryKeyConstraint('route_id'),
+        sa.ForeignKeyConstraint(['route_id'], ['ecmproutes.id'], ondelete='CASCADE')
+    )
+    op.create_index('ix_ecmp_route_pools_selector', 'ecmp_route_pools',
+                    ['selector_type', 'selector_value'])
+    # The next_hops column of ecmproutes becomes a Text in the contract
+    # migration b8e5d2c6f041.
+
+def downgrade():
+    op.drop_table("ecmp_route_pools")
@@ -0,0 +1,37 @@
+# Copyright 2019 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+"""add next attempt to ecmp notifications
+
+Revision ID: 7b3d5f9e2a61
+Revises: 1e6f4a9c3b75
+Create Date: 2020-11-10 09:42:51.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b3d5f9e2a61'
+down_revision = '1e6f4a9c3b75'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('ecmp_notifications',
+                  sa.Column('next_attempt_at', sa.DateTime(), nullable=True))
+
+def downgrade():
+    op.drop_column('ecmp_notifications', 'next_attempt_at')
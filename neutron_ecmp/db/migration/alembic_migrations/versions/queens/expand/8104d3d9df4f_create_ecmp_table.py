@@ -20,13 +20,14 @@ Create Date: 2020-03-1 18:31:46.794040
 
 """
 from alembic import op
+from neutron.db.migration import cli
 import sqlalchemy as sa
 
 
 # revision identifiers, used by Alembic.
 revision = '8104d3d9df4f'
 down_revision = 'start_ecmp'
-branch_labels = None
+branch_labels = (cli.EXPAND_BRANCH,)
 depends_on = None
 
 def upgrade():
@@ -0,0 +1,43 @@
+# Copyright 2019 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+"""add ecmp notification leases table
+
+Revision ID: 84d38b8ec06c
+Revises: 3c7a91e4b2d0
+Create Date: 2020-10-26 15:40:12.604718
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '84d38b8ec06c'
+down_revision = '3c7a91e4b2d0'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        'ecmp_notification_leases',
+        sa.Column('router_id', sa.String(length=36), nullable=False),
+        sa.Column('owner', sa.String(length=255), nullable=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('router_id'),
+        sa.ForeignKeyConstraint(['router_id'], ['routers.id'], ondelete='CASCADE')
+    )
+
+def downgrade():
+    op.drop_table("ecmp_notification_leases")
@@ -0,0 +1,37 @@
+# Copyright 2019 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+"""add hash policy to ecmproutes
+
+Revision ID: 9d2b6e5f8a13
+Revises: 0f3a8c27d5e4
+Create Date: 2020-09-09 15:30:12.402817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d2b6e5f8a13'
+down_revision = '0f3a8c27d5e4'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('ecmproutes',
+                  sa.Column('hash_policy', sa.String(length=16), nullable=True))
+
+def downgrade():
+    op.drop_column('ecmproutes', 'hash_policy')
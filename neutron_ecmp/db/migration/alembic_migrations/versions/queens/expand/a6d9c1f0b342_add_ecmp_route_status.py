@@ -0,0 +1,49 @@
+# Copyright 2019 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+"""add ecmp route revision and realization status per host
+
+Revision ID: a6d9c1f0b342
+Revises: e470b077f924
+Create Date: 2020-08-12 10:21:47.103562
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6d9c1f0b342'
+down_revision = 'e470b077f924'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('ecmproutes',
+                  sa.Column('revision', sa.Integer(), nullable=False,
+                            server_default='1'))
+    # Existing routes stay PENDING until their agents resync them.
+    op.create_table(
+        'ecmp_route_hosts',
+        sa.Column('route_id', sa.String(length=36), nullable=False),
+        sa.Column('host', sa.String(length=255), nullable=False),
+        sa.Column('revision', sa.Integer(), nullable=False),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.PrimaryKeyConstraint('route_id', 'host'),
+        sa.ForeignKeyConstraint(['route_id'], ['ecmproutes.id'], ondelete='CASCADE')
+    )
+
+def downgrade():
+    op.drop_table("ecmp_route_hosts")
+    op.drop_column('ecmproutes', 'revision')
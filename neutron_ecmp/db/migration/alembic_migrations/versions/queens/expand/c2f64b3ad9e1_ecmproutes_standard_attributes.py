@@ -0,0 +1,80 @@
+# Copyright 2019 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+"""use standard attributes for ecmproutes
+
+Revision ID: c2f64b3ad9e1
+Revises: a6d9c1f0b342
+Create Date: 2020-08-19 14:02:33.581207
+
+"""
+from alembic import op
+from oslo_utils import timeutils
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2f64b3ad9e1'
+down_revision = 'a6d9c1f0b342'
+branch_labels = None
+depends_on = None
+
+TABLE = 'ecmproutes'
+
+standardattrs = sa.Table(
+    'standardattributes', sa.MetaData(),
+    sa.Column('id', sa.BigInteger(), primary_key=True, autoincrement=True),
+    sa.Column('resource_type', sa.String(length=255), nullable=False),
+    sa.Column('revision_number', sa.BigInteger(), nullable=False),
+    sa.Column('created_at', sa.DateTime()),
+    sa.Column('updated_at', sa.DateTime()))
+
+ecmproutes = sa.Table(
+    TABLE, sa.MetaData(),
+    sa.Column('id', sa.String(length=36), primary_key=True),
+    sa.Column('revision', sa.Integer()),
+    sa.Column('standard_attr_id', sa.BigInteger()))
+
+
+def upgrade():
+    # The column becomes NOT NULL and the revision column is dropped by the
+    # contract migration 4f2c8e1a7d93, the servers of the previous release
+    # still create routes without standard attributes until then.
+    op.add_column(TABLE, sa.Column('standard_attr_id', sa.BigInteger(),
+                                   nullable=True))
+    # The revision of the existing routes becomes their revision_number.
+    bind = op.get_bind()
+    now = timeutils.utcnow()
+    for route_id, route_revision in bind.execute(
+            sa.select([ecmproutes.c.id, ecmproutes.c.revision])).fetchall():
+        result = bind.execute(standardattrs.insert().values(
+            resource_type=TABLE, revision_number=route_revision,
+            created_at=now, updated_at=now))
+        bind.execute(ecmproutes.update().values(
+            standard_attr_id=result.inserted_primary_key[0]).where(
+                ecmproutes.c.id == route_id))
+    op.create_unique_constraint('uniq_ecmproutes0standard_attr_id', TABLE,
+                                ['standard_attr_id'])
+    op.create_foreign_key('ecmproutes_standard_attr_id_fkey', TABLE,
+                          'standardattributes', ['standard_attr_id'], ['id'],
+                          ondelete='CASCADE')
+
+def downgrade():
+    op.drop_constraint('ecmproutes_standard_attr_id_fkey', TABLE,
+                       type_='foreignkey')
+    op.execute(standardattrs.delete().where(
+        standardattrs.c.resource_type == TABLE))
+    op.drop_constraint('uniq_ecmproutes0standard_attr_id', TABLE,
+                       type_='unique')
+    op.drop_column(TABLE, 'standard_attr_id')
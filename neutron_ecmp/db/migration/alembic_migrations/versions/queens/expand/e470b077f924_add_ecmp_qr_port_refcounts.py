@@ -0,0 +1,45 @@
+# Copyright 2019 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+"""add ecmp qr port refcounts table
+
+Revision ID: e470b077f924
+Revises: ed44e9a822ec
+Create Date: 2020-08-05 16:40:02.551874
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e470b077f924'
+down_revision = 'ed44e9a822ec'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # The refcounts of existing routers are rebuilt by the plugin on the
+    # first change of one of their ecmp routes.
+    op.create_table(
+        'ecmp_qr_port_refcounts',
+        sa.Column('router_id', sa.String(length=36), nullable=False),
+        sa.Column('port_id', sa.String(length=36), nullable=False),
+        sa.Column('refcount', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('router_id', 'port_id'),
+        sa.ForeignKeyConstraint(['router_id'], ['routers.id'], ondelete='CASCADE')
+    )
+
+def downgrade():
+    op.drop_table("ecmp_qr_port_refcounts")
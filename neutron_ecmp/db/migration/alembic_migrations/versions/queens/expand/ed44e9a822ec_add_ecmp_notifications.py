@@ -0,0 +1,46 @@
+# Copyright 2019 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+"""add ecmp notifications table
+
+Revision ID: ed44e9a822ec
+Revises: 8104d3d9df4f
+Create Date: 2020-08-03 10:12:31.108220
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ed44e9a822ec'
+down_revision = '8104d3d9df4f'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        'ecmp_notifications',
+        sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'),
+                  primary_key=True, autoincrement=True),
+        sa.Column('router_id', sa.String(length=36), nullable=False,
+                  index=True),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False,
+                  server_default='0'),
+        sa.Column('created_at', sa.DateTime(), nullable=False)
+    )
+
+def downgrade():
+    op.drop_table("ecmp_notifications")
@@ -36,7 +36,7 @@ class Ecmp(extensions.APIExtensionDescriptor):
             {}, ecmp_api.RESOURCE_ATTRIBUTE_MAP)
         return resource_helper.build_resource_info(
             plural_mappings, ecmp_api.RESOURCE_ATTRIBUTE_MAP,
-            'ECMP')
+            'ECMP', allow_bulk=True)
 
     @classmethod
     def get_plugin_interface(cls):
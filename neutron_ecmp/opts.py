@@ -15,14 +15,22 @@
 
 import neutron.conf.services.provider_configuration
 
-import neutron_ecmp.agent.acl.acl_agent_api
-import neutron_ecmp.extensions.acl
+import neutron_ecmp.agents.ecmp.l3.ecmp_l3_agent
+import neutron_ecmp.agents.ecmp.l3.route_programmer
+import neutron_ecmp.agents.ecmp.l3.snapshot
+import neutron_ecmp.services.ecmp.drivers.agent
+import neutron_ecmp.services.ecmp.drivers.ovn
+import neutron_ecmp.services.ecmp.ecmp_plugin
 
 
 def list_agent_opts():
-    return [('acl', neutron_ecmp.agent.acl.acl_agent_api.ACLOpts), ]
+    return [('ecmp', neutron_ecmp.agents.ecmp.l3.route_programmer.ECMPAgentOpts +
+             neutron_ecmp.agents.ecmp.l3.ecmp_l3_agent.ECMPReportOpts +
+             neutron_ecmp.agents.ecmp.l3.snapshot.ECMPSnapshotOpts), ]
 
 
 def list_opts():
-    return [('quotas', neutron_ecmp.extensions.acl.acl_quota_opts),
+    return [('ecmp', neutron_ecmp.services.ecmp.ecmp_plugin.ECMPOpts +
+             neutron_ecmp.services.ecmp.drivers.agent.AgentDriverOpts +
+             neutron_ecmp.services.ecmp.drivers.ovn.OVNOpts),
             ('service_providers', neutron.conf.services.provider_configuration.serviceprovider_opts), ]
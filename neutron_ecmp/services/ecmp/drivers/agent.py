@@ -0,0 +1,204 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import time
+
+from neutron.common import rpc as n_rpc
+from neutron_lib.plugins import constants as plugin_constants
+from neutron_lib.plugins import directory
+from oslo_config import cfg
+import oslo_messaging
+from oslo_log import log as logging
+from osprofiler import profiler
+
+from neutron_ecmp._i18n import _
+from neutron_ecmp.services.ecmp.drivers import base
+
+LOG = logging.getLogger(__name__)
+
+ECMP_AGENT = 'ecmp_agent'
+
+AgentDriverOpts = [
+    cfg.IntOpt('batch_max_routes', default=1000, min=1,
+               help=_('Maximum number of ecmp routes sent to an l3 agent in '
+                      'one cast by the batching agent driver.')),
+]
+cfg.CONF.register_opts(AgentDriverOpts, 'ecmp')
+
+
+class EcmpAgentApi(object):
+    """Plugin side of plugin to agent RPC API
+
+    API version history:
+        1.0 - Initial version.
+        1.1 - Add update_ecmp_routes to notify several routes in one cast.
+        1.2 - Add dump_ecmp_routes.
+        1.3 - Add resync_ecmp_routers.
+        1.4 - Add purge_ecmp_routers.
+    """
+
+    def __init__(self, topic, host):
+        self.host = host
+        target = oslo_messaging.Target(topic=topic, version='1.0')
+        self.client = n_rpc.get_client(target)
+
+    def _prepare_rpc_client(self, host=None, version=None):
+        kwargs = {'version': version} if version else {}
+        if host:
+            return self.client.prepare(server=host, **kwargs)
+        else:
+            # historical behaviour (RPC broadcast)
+            return self.client.prepare(fanout=True, **kwargs)
+
+    def update_ecmp_route(self, context, ecmproute, host=None):
+        cctxt = self._prepare_rpc_client(host)
+        cctxt.cast(context, 'update_ecmp_route', ecmproute=ecmproute, host=self.host)
+
+    def update_ecmp_routes(self, context, ecmproutes, host=None):
+        cctxt = self._prepare_rpc_client(host, version='1.1')
+        cctxt.cast(context, 'update_ecmp_routes', ecmproutes=ecmproutes, host=self.host)
+
+    def dump_ecmp_routes(self, context, router_ids, host, timeout=None):
+        kwargs = {'timeout': timeout} if timeout else {}
+        cctxt = self.client.prepare(server=host, version='1.2', **kwargs)
+        return cctxt.call(context, 'dump_ecmp_routes', router_ids=router_ids)
+
+    def resync_ecmp_routers(self, context, router_ids, host):
+        cctxt = self._prepare_rpc_client(host, version='1.3')
+        cctxt.cast(context, 'resync_ecmp_routers', router_ids=router_ids)
+
+    def purge_ecmp_routers(self, context, router_ids):
+        # the hosts of deleted routers are no longer known
+        cctxt = self._prepare_rpc_client(version='1.4')
+        cctxt.cast(context, 'purge_ecmp_routers', router_ids=router_ids)
+
+
+class AgentRpcDriver(base.EcmpDriverBase):
+    """Cast the route changes to the l3 agents hosting the routers.
+
+    The changes are cast by the dispatcher of the RPC workers, so that the
+    API workers neither look up the hosts of the routers nor publish the
+    casts, grouped by host into one cast per host, which the
+    ECMPL3AgentExtension of the agent programs into the router namespace.
+    """
+
+    def __init__(self, plugin, agent_rpc=None):
+        super(AgentRpcDriver, self).__init__(plugin)
+        self.agent_rpc = agent_rpc or EcmpAgentApi(ECMP_AGENT, cfg.CONF.host)
+
+    def _get_hosts_to_notify(self, context, router_id):
+        """Notify changed routers to hosting l3 agents."""
+        adminContext = context if context.is_admin else context.elevated()
+        l3_plugin = directory.get_plugin(plugin_constants.L3)
+        hosts = l3_plugin.get_hosts_to_notify(adminContext, router_id)
+        return hosts
+
+    def _get_casts(self, host_routes):
+        """Split the routes of a host into the ecmproutes of its casts."""
+        return [host_routes]
+
+    def realize_ecmp_routes(self, context, ecmproutes):
+        hosts_of_router = {}
+        failed_routers = set()
+        for router_id in collections.OrderedDict.fromkeys(data['router_id'] for data in ecmproutes):
+            try:
+                hosts_of_router[router_id] = self._get_hosts_to_notify(context, router_id)
+            except Exception:
+                LOG.exception('ecmp: failed to get hosts of router %s', router_id)
+                failed_routers.add(router_id)
+        routes_of_host = collections.defaultdict(list)
+        routers_of_host = collections.defaultdict(set)
+        hosts_of_route = {}
+        for data in ecmproutes:
+            router_id = data['router_id']
+            for host in hosts_of_router.get(router_id, []):
+                routes_of_host[host].append(data)
+                routers_of_host[host].add(router_id)
+            if data.get('id') and data['operation'] != 'delete' and router_id in hosts_of_router:
+                hosts_of_route[data['id']] = set(hosts_of_router[router_id])
+        # Before the casts, so that no realization report can come first.
+        self.plugin._set_ecmp_route_hosts(context, hosts_of_route)
+        for host, host_routes in routes_of_host.items():
+            LOG.debug('ecmp: start notify host %s to update ecmproutes %s', host, host_routes)
+            dispatched_at = time.time()
+            for data in host_routes:
+                data['dispatched_at'] = dispatched_at
+            try:
+                for cast_routes in self._get_casts(host_routes):
+                    with profiler.Trace('ecmp_notify_host',
+                                        info={'host': host, 'routes': len(cast_routes)}):
+                        self.agent_rpc.update_ecmp_routes(context, cast_routes, host=host)
+            except Exception:
+                LOG.exception('ecmp: failed to notify host %s', host)
+                failed_routers |= routers_of_host[host]
+        return failed_routers
+
+    def resync_routers(self, context, router_ids):
+        """Cast the routers to resync to their agents, in one cast per host."""
+        failed_routers = set()
+        routers_of_host = collections.defaultdict(list)
+        hosts_of_router = {}
+        for router_id in router_ids:
+            try:
+                hosts_of_router[router_id] = self._get_hosts_to_notify(context, router_id)
+            except Exception:
+                LOG.exception('ecmp: failed to get hosts of router %s', router_id)
+                failed_routers.add(router_id)
+                continue
+            for host in hosts_of_router[router_id]:
+                routers_of_host[host].append(router_id)
+        route_ids_of_router = self.plugin._get_route_ids_of_routers(context, list(hosts_of_router))
+        self.plugin._set_ecmp_route_hosts(context, dict(
+            (route_id, set(hosts_of_router[router_id]))
+            for router_id, route_ids in route_ids_of_router.items() for route_id in route_ids))
+        for host, host_routers in routers_of_host.items():
+            LOG.debug('ecmp: notify host %s to resync routers %s', host, host_routers)
+            try:
+                self.agent_rpc.resync_ecmp_routers(context, host_routers, host)
+            except Exception:
+                LOG.exception('ecmp: failed to notify host %s', host)
+                failed_routers.update(host_routers)
+        return failed_routers
+
+    def purge_routers(self, context, router_ids):
+        """Broadcast the deleted routers to the agents in one cast."""
+        LOG.debug('ecmp: notify the agents to purge routers %s', router_ids)
+        self.agent_rpc.purge_ecmp_routers(context, router_ids)
+
+
+class BatchingAgentRpcDriver(AgentRpcDriver):
+    """Cast the route changes to the l3 agents in bounded batches.
+
+    The changes of all the requests of a notification_interval, merged per
+    route by the dispatcher, are sent in few casts per host of at most
+    batch_max_routes routes each. The routes of a router are kept in one
+    cast unless they exceed that size.
+    """
+
+    def _get_casts(self, host_routes):
+        max_routes = cfg.CONF.ecmp.batch_max_routes
+        routes_of_router = collections.OrderedDict()
+        for data in host_routes:
+            routes_of_router.setdefault(data['router_id'], []).append(data)
+        casts = [[]]
+        for router_routes in routes_of_router.values():
+            if casts[-1] and len(casts[-1]) + len(router_routes) > max_routes:
+                casts.append([])
+            for data in router_routes:
+                if len(casts[-1]) >= max_routes:
+                    casts.append([])
+                casts[-1].append(data)
+        return casts
@@ -0,0 +1,132 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import abc
+
+from oslo_log import log as logging
+import six
+
+LOG = logging.getLogger(__name__)
+
+
+@six.add_metaclass(abc.ABCMeta)
+class EcmpDriverBase(object):
+    """Interface of the backends realizing the ecmp routes.
+
+    A driver is loaded from the ECMP service provider of the
+    [service_providers] configuration, e.g.:
+
+        service_provider = ECMP:ovn:neutron_ecmp.services.ecmp.drivers.ovn.OvnNbDriver:default
+
+    The precommit hooks are called in the transaction of the change, an
+    exception aborts it. The postcommit hooks are called once it is
+    committed; their failures are only logged. The bulk variants get the
+    routes changed by one transaction and default to the single hooks.
+
+    Besides the hooks, the plugin stores each route change in the
+    transaction of the request and hands the pending changes to
+    realize_ecmp_routes once they are committed, merged per route and in
+    order.
+    """
+
+    # Whether the pending changes are handed to the driver as soon as the
+    # request which queued them is committed, rather than on the next run
+    # of the periodic dispatcher only.
+    dispatch_on_commit = False
+
+    def __init__(self, plugin):
+        self.plugin = plugin
+
+    def initialize(self):
+        """Called once the plugin starts its RPC listeners."""
+
+    def create_ecmp_route_precommit(self, context, ecmp_route):
+        pass
+
+    def create_ecmp_route_postcommit(self, context, ecmp_route):
+        pass
+
+    def create_ecmp_routes_precommit(self, context, ecmp_routes):
+        for ecmp_route in ecmp_routes:
+            self.create_ecmp_route_precommit(context, ecmp_route)
+
+    def create_ecmp_routes_postcommit(self, context, ecmp_routes):
+        for ecmp_route in ecmp_routes:
+            self.create_ecmp_route_postcommit(context, ecmp_route)
+
+    def update_ecmp_route_precommit(self, context, ecmp_route, original):
+        pass
+
+    def update_ecmp_route_postcommit(self, context, ecmp_route, original):
+        pass
+
+    def update_ecmp_routes_precommit(self, context, ecmp_routes, originals):
+        for ecmp_route, original in zip(ecmp_routes, originals):
+            self.update_ecmp_route_precommit(context, ecmp_route, original)
+
+    def update_ecmp_routes_postcommit(self, context, ecmp_routes, originals):
+        for ecmp_route, original in zip(ecmp_routes, originals):
+            self.update_ecmp_route_postcommit(context, ecmp_route, original)
+
+    def delete_ecmp_route_precommit(self, context, ecmp_route):
+        pass
+
+    def delete_ecmp_route_postcommit(self, context, ecmp_route):
+        pass
+
+    @abc.abstractmethod
+    def realize_ecmp_routes(self, context, ecmproutes):
+        """Realize ecmp route changes.
+
+        :param ecmproutes: list of route notifications, as queued by
+               EcmpPlugin._rpc_notify_ecmp_route, of one or more routers.
+        :returns: the set of ids of the routers whose changes failed; their
+                  notifications are kept and handed again on the next run.
+        """
+
+    def resync_routers(self, context, router_ids):
+        """Realize again all the ecmp routes of routers.
+
+        Called for routes written without notifying them, e.g. bulk loaded
+        by neutron-ecmp-transfer. Every route of the routers is handed to
+        realize_ecmp_routes by default.
+
+        :returns: the set of ids of the routers which failed.
+        """
+        ecmproutes = []
+        for router_id in router_ids:
+            for route in self.plugin._get_route_of_router(context, router_id)[1]:
+                ecmproutes.append(dict(route, router_id=router_id, operation='replace',
+                                       set_arp_proxy_qrs=route['qr_interfaces'],
+                                       unset_arp_proxy_qrs=None))
+        if not ecmproutes:
+            return set()
+        return self.realize_ecmp_routes(context, ecmproutes)
+
+    def purge_routers(self, context, router_ids):
+        """Drop what is left of the ecmp routes of deleted routers.
+
+        The routes were deleted with their routers, without a notification
+        each. Nothing to do by default, the backend router being deleted
+        with them.
+        """
+
+
+class NoopDriver(EcmpDriverBase):
+    """Realize nothing, e.g. to benchmark the plugin alone."""
+
+    def realize_ecmp_routes(self, context, ecmproutes):
+        LOG.debug('ecmp: drop %d ecmp route changes', len(ecmproutes))
+        return set()
@@ -0,0 +1,144 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import netaddr
+from oslo_config import cfg
+from oslo_log import log as logging
+from ovsdbapp.backend.ovs_idl import connection
+from ovsdbapp.backend.ovs_idl import idlutils
+from ovsdbapp.schema.ovn_northbound import impl_idl
+
+from neutron_ecmp._i18n import _
+from neutron_ecmp.api.definitions import ecmp as ecmp_ext
+from neutron_ecmp.services.ecmp.drivers import base
+
+LOG = logging.getLogger(__name__)
+
+OVNOpts = [
+    cfg.StrOpt('ovn_nb_connection', default='tcp:127.0.0.1:6641',
+               help=_('Connection string of the OVN northbound database '
+                      'the ovn driver writes the ecmp routes to.')),
+    cfg.IntOpt('ovn_ovsdb_timeout', default=180, min=1,
+               help=_('Seconds the ovn driver waits for an OVSDB '
+                      'transaction to complete.')),
+    cfg.BoolOpt('ovn_ecmp_symmetric_reply', default=False,
+                help=_('Set ecmp_symmetric_reply on the static routes, so '
+                       'that the replies of a connection leave through the '
+                       'next hop it came from. Needs ovn 20.06 or newer.')),
+]
+cfg.CONF.register_opts(OVNOpts, 'ecmp')
+
+ROUTE_TABLE = 'Logical_Router_Static_Route'
+ROUTER_TABLE = 'Logical_Router'
+# Marks the static routes written by this driver, the other static routes
+# of the logical routers, e.g. the extra routes of neutron, are left alone.
+ECMP_ROUTE_ID_KEY = 'neutron:ecmp_route_id'
+# The ecmp routes realized by the northbound database are reported as
+# realized by this pseudo host.
+OVN_HOST = 'ovn'
+
+
+def ovn_router_name(router_id):
+    return 'neutron-%s' % router_id
+
+
+class OvnNbDriver(base.EcmpDriverBase):
+    """Write the ecmp routes as static routes of the OVN logical routers.
+
+    Each next hop of a route is one Logical_Router_Static_Route of the vip
+    prefix, which ovn-northd turns into an ecmp route. The changes handed
+    in one call, i.e. those of one API request, are written in a single
+    OVSDB transaction, against the current rows of the routers, so the
+    same changes can be written again safely. No agent is involved.
+
+    The IDL only replicates the two tables the driver reads.
+    """
+
+    dispatch_on_commit = True
+
+    def __init__(self, plugin, nb_api=None):
+        super(OvnNbDriver, self).__init__(plugin)
+        self._nb_api = nb_api
+
+    @property
+    def nb_api(self):
+        if self._nb_api is None:
+            remote = cfg.CONF.ecmp.ovn_nb_connection
+            helper = idlutils.get_schema_helper(remote, 'OVN_Northbound')
+            helper.register_table(ROUTER_TABLE)
+            helper.register_table(ROUTE_TABLE)
+            idl = connection.OvsdbIdl(remote, helper)
+            self._nb_api = impl_idl.OvnNbApiIdlImpl(connection.Connection(
+                idl, timeout=cfg.CONF.ecmp.ovn_ovsdb_timeout))
+        return self._nb_api
+
+    def initialize(self):
+        # Connect on start rather than on the first request.
+        self.nb_api
+
+    def _route_options(self):
+        if cfg.CONF.ecmp.ovn_ecmp_symmetric_reply:
+            return {'ecmp_symmetric_reply': 'true'}
+        return {}
+
+    def _sync_route(self, txn, ecmproute, options):
+        """Queue the commands making the static routes of a vip match."""
+        api = self.nb_api
+        router_name = ovn_router_name(ecmproute['router_id'])
+        try:
+            router = api.lookup(ROUTER_TABLE, router_name)
+        except idlutils.RowNotFound:
+            LOG.warning('ecmp: no logical router %s for ecmp route of vip %s',
+                        router_name, ecmproute['vip'])
+            return
+        prefix = str(netaddr.IPNetwork(ecmproute['vip']))
+        wanted = set()
+        if ecmproute['operation'] != 'delete':
+            wanted = set(ecmproute['next_hops'] or [])
+        for row in router.static_routes:
+            if row.ip_prefix != prefix or ECMP_ROUTE_ID_KEY not in row.external_ids:
+                continue
+            if row.nexthop in wanted:
+                # Keep one row per next hop, drop duplicates.
+                wanted.discard(row.nexthop)
+                if dict(row.options) != options:
+                    txn.add(api.db_set(ROUTE_TABLE, row.uuid, ('options', options)))
+            else:
+                txn.add(api.db_remove(ROUTER_TABLE, router_name, 'static_routes', row.uuid))
+        for nexthop in sorted(wanted):
+            route = txn.add(api.db_create(
+                ROUTE_TABLE, ip_prefix=prefix, nexthop=nexthop, policy='dst-ip',
+                options=options, external_ids={ECMP_ROUTE_ID_KEY: ecmproute.get('id') or ''}))
+            txn.add(api.db_add(ROUTER_TABLE, router_name, 'static_routes', route))
+
+    def realize_ecmp_routes(self, context, ecmproutes):
+        options = self._route_options()
+        try:
+            with self.nb_api.transaction(check_error=True) as txn:
+                for data in ecmproutes:
+                    self._sync_route(txn, data, options)
+        except Exception:
+            LOG.exception('ecmp: failed to write %d ecmp routes to the ovn '
+                          'northbound database', len(ecmproutes))
+            return set(data['router_id'] for data in ecmproutes)
+        statuses = [{'id': data['id'], 'revision': data['revision'],
+                     'status': ecmp_ext.STATUS_ACTIVE}
+                    for data in ecmproutes
+                    if data.get('id') and data.get('revision') is not None and
+                    data['operation'] != 'delete']
+        self.plugin._set_ecmp_route_hosts(
+            context, dict((status['id'], set([OVN_HOST])) for status in statuses))
+        self.plugin._update_ecmp_route_hosts(context, OVN_HOST, statuses)
+        return set()
@@ -13,179 +13,796 @@
 #    under the License.
 
 
+import collections
+import os
+import time
+
 import netaddr
+from neutron_ecmp._i18n import _
 from neutron_ecmp.db.ecmp import ecmp_db
 from neutron_ecmp.api.definitions import ecmp as ecmp_ext
+from neutron_ecmp.common import ecmp_cache
+from neutron_ecmp.common import ecmp_digest
 from neutron_ecmp.common import ecmp_exceptions as exception
+from neutron_ecmp.common import ecmp_metrics
 from neutron import service
 from neutron.common import rpc as n_rpc
-from neutron_lib.plugins import constants as plugin_constants
-from neutron_lib.plugins import directory
+from neutron.db import api as db_api
+from neutron.db import servicetype_db as st_db
+from neutron.services import provider_configuration as pconf
+from neutron_lib.api.definitions import portbindings
+from neutron_lib import constants as n_const
+from neutron_lib import context as n_context
+from neutron_lib import exceptions as n_exc
 from oslo_config import cfg
 import oslo_messaging
 from oslo_log import log as logging
+from oslo_serialization import jsonutils
+from oslo_service import loopingcall
+from oslo_utils import importutils
+from oslo_utils import uuidutils
+import six
 
 LOG = logging.getLogger(__name__)
 
-ECMP_AGENT = 'ecmp_agent'
 ECMP_PLUGIN = 'q-ecmp-plugin'
 LINUX_DEV_LEN = 14
 INTERNAL_DEV_PREFIX = 'qr-'
+WITHDRAWN_PORT_DOWN = 'port_down'
+WITHDRAWN_AGENT_DOWN = 'agent_down'
 
-class EcmpAgentApi(object):
-    """Plugin side of plugin to agent RPC API"""
+ECMPOpts = [
+    cfg.IntOpt('notification_interval', default=1, min=1,
+               help=_('Seconds between two runs of the dispatcher which '
+                      'sends the pending ecmp notifications to the l3 '
+                      'agents.')),
+    cfg.IntOpt('notification_batch_size', default=500, min=1,
+               help=_('Maximum number of pending ecmp notifications '
+                      'handled by one run of the dispatcher.')),
+    cfg.IntOpt('notification_max_attempts', default=10, min=1,
+               deprecated_for_removal=True,
+               deprecated_reason=_('Pending ecmp notifications are no '
+                                   'longer dropped, they are tried again '
+                                   'until they are dispatched.'),
+               help=_('Number of failed dispatches after which a pending '
+                      'ecmp notification is dropped.')),
+    cfg.IntOpt('notification_retry_interval', default=1, min=1,
+               help=_('Seconds before a pending ecmp notification whose '
+                      'dispatch failed is tried again, doubled by each '
+                      'further failure.')),
+    cfg.IntOpt('notification_max_retry_interval', default=300, min=1,
+               help=_('Maximum number of seconds between two attempts to '
+                      'dispatch a pending ecmp notification.')),
+    cfg.IntOpt('notification_lease_time', default=60, min=1,
+               help=_('Seconds a dispatcher holds the routers whose pending '
+                      'ecmp notifications it claimed, after which another '
+                      'dispatcher may take them over, e.g. of a '
+                      'neutron-server which died while sending them.')),
+    cfg.IntOpt('realization_log_interval', default=60, min=0,
+               help=_('Seconds between two logs of the ecmp realization '
+                      'latencies reported by the l3 agents, 0 disables '
+                      'them.')),
+    cfg.IntOpt('realization_max_routes', default=10000, min=0,
+               help=_('Maximum number of ecmp routes whose last reported '
+                      'realization is kept by each RPC worker, for the '
+                      'slowest routes of its realization logs.')),
+    cfg.IntOpt('next_hop_agent_check_interval', default=10, min=0,
+               help=_('Seconds between two checks of the l2 agents of the '
+                      'hosts of the next hops, the next hops of a host whose '
+                      'agent is dead are withdrawn until it is back. 0 '
+                      'disables the checks.')),
+    cfg.ListOpt('next_hop_agent_types',
+                default=[n_const.AGENT_TYPE_OVS, n_const.AGENT_TYPE_LINUXBRIDGE],
+                help=_('Types of the l2 agents checked for the next hops.')),
+    cfg.IntOpt('router_cache_size', default=1024, min=0,
+               help=_('Maximum number of routers whose interface subnets '
+                      'are cached by each neutron-server worker. A cached '
+                      'router is checked against its generation in the '
+                      'database, bumped by every change of its interfaces. '
+                      '0 disables the cache.')),
+    cfg.IntOpt('route_response_cache_size', default=1024, min=0,
+               help=_('Maximum number of routers whose get_route_of_router '
+                      'response is cached by each neutron-server worker, '
+                      'for the agents of the other hosts of the router. A '
+                      'response is used while the ecmp route and interface '
+                      'generations of its router are unchanged. 0 disables '
+                      'the cache.')),
+]
+cfg.CONF.register_opts(ECMPOpts, 'ecmp')
 
-    def __init__(self, topic, host):
-        self.host = host
-        target = oslo_messaging.Target(topic=topic, version='1.0')
-        self.client = n_rpc.get_client(target)
+ECMP_SERVICE_TYPE = 'ECMP'
+# Realizes the ecmp routes when no ECMP service provider is configured.
+DEFAULT_ECMP_DRIVER = 'neutron_ecmp.services.ecmp.drivers.agent.BatchingAgentRpcDriver'
 
-    def _prepare_rpc_client(self, host=None):
-        if host:
-            return self.client.prepare(server=host)
-        else:
-            # historical behaviour (RPC broadcast)
-            return self.client.prepare(fanout=True)
 
-    def update_ecmp_route(self, context, ecmproute, host=None):
-        cctxt = self._prepare_rpc_client(host)
-        cctxt.cast(context, 'update_ecmp_route', ecmproute=ecmproute, host=self.host)
+def merge_ecmp_notifications(previous, current):
+    """Merge two consecutive notifications of the same ecmp route.
+
+    The routing part of the later one wins, while the proxy parameter
+    changes of both are combined as if they were applied in order.
+    """
+    set_prev = set(previous.get('set_arp_proxy_qrs') or [])
+    unset_prev = set(previous.get('unset_arp_proxy_qrs') or [])
+    set_cur = set(current.get('set_arp_proxy_qrs') or [])
+    unset_cur = set(current.get('unset_arp_proxy_qrs') or [])
+    merged = dict(current)
+    merged['set_arp_proxy_qrs'] = sorted((set_prev - unset_cur) | set_cur)
+    merged['unset_arp_proxy_qrs'] = sorted((unset_prev - set_cur) | unset_cur)
+    return merged
 
 
 class EcmpPlugin(ecmp_db.Ecmp_db_mixin):
-    """ECMP service plugin class"""
+    """ECMP service plugin class
+
+    API version history of the agent to plugin RPC API:
+        1.0 - Initial version.
+        1.1 - Add report_ecmp_realization.
+        1.2 - Add report_ecmp_route_status.
+        1.3 - Add get_changed_routes_of_routers.
+        1.4 - Add get_route_of_router_if_changed.
+    """
     supported_extension_aliases = [ecmp_ext.ALIAS]
+    target = oslo_messaging.Target(version='1.4')
+    __native_bulk_support = True
 
 
     def __init__(self):
         """Do the initialization for the ecmp service plugin here."""
         LOG.info("Initializing ECMP plugin")
-        self.agent_rpc = EcmpAgentApi(ECMP_AGENT, cfg.CONF.host)
+        self.driver = self._load_driver()
+        self._router_subnets = ecmp_cache.GenerationCache(cfg.CONF.ecmp.router_cache_size)
+        self._route_responses = ecmp_cache.GenerationCache(cfg.CONF.ecmp.route_response_cache_size)
         ecmp_db.subscribe()
         rpc_worker = service.RpcWorker([self], worker_process_count=0)
         self.add_worker(rpc_worker)
 
+    def _load_driver(self):
+        """Load the driver of the default ECMP service provider."""
+        self.service_type_manager = st_db.ServiceTypeManager.get_instance()
+        # ProviderConfiguration takes no service type in neutron 13, the
+        # providers are filtered on it by get_default_service_provider.
+        self.service_type_manager.add_provider_configuration(
+            ECMP_SERVICE_TYPE, pconf.ProviderConfiguration())
+        try:
+            provider = self.service_type_manager.get_default_service_provider(
+                None, ECMP_SERVICE_TYPE)
+            driver = provider['driver']
+        except pconf.DefaultServiceProviderNotFound:
+            driver = DEFAULT_ECMP_DRIVER
+        LOG.info('ecmp: realizing the ecmp routes with driver %s', driver)
+        return importutils.import_object(driver, self)
+
+    def _driver_postcommit(self, method, context, *args):
+        """Call a postcommit hook of the driver.
+
+        The change is committed by then and its realization goes through
+        the pending notifications anyway, so a failure is only logged.
+        """
+        try:
+            getattr(self.driver, method)(context, *args)
+        except Exception:
+            LOG.exception('ecmp: %s of driver %s failed', method, type(self.driver).__name__)
+
     def start_rpc_listeners(self):
         self.endpoints = [self]
         self.conn = n_rpc.Connection()
         self.conn.create_consumer(ECMP_PLUGIN, self.endpoints, fanout=False)
+        self.driver.initialize()
+        self._notification_loop = loopingcall.FixedIntervalLoopingCall(
+            self._run_ecmp_notification_dispatcher)
+        self._notification_loop.start(
+            interval=cfg.CONF.ecmp.notification_interval)
+        self._realization_histograms = ecmp_metrics.Histograms(())
+        self._route_realization = collections.OrderedDict()
+        if cfg.CONF.ecmp.realization_log_interval:
+            self._realization_loop = loopingcall.FixedIntervalLoopingCall(
+                self._log_realization)
+            self._realization_loop.start(
+                interval=cfg.CONF.ecmp.realization_log_interval)
+        self._dead_agent_hosts = set()
+        if cfg.CONF.ecmp.next_hop_agent_check_interval:
+            self._agent_check_loop = loopingcall.FixedIntervalLoopingCall(
+                self._check_next_hop_agents)
+            self._agent_check_loop.start(
+                interval=cfg.CONF.ecmp.next_hop_agent_check_interval)
         return self.conn.consume_in_threads()
 
-    def _get_hosts_to_notify(self, context, router_id):
-        """Notify changed routers to hosting l3 agents."""
-        adminContext = context if context.is_admin else context.elevated()
-        l3_plugin = directory.get_plugin(plugin_constants.L3)
-        hosts = l3_plugin.get_hosts_to_notify(adminContext, router_id)
-        return hosts
+    def _rpc_notify_ecmp_route(self, context, operation, vip, next_hops, router_id, related_qr_interfaces=None,
+                               unused_qr_interfaces=None, qr_interfaces=None, route_id=None, revision=None,
+                               hash_policy=None):
+        """Queue the notification of a route change to the hosting agents.
 
-    def _rpc_notify_ecmp_route(self, context, operation, vip, next_hops, router_id, related_qr_interfaces=None, unused_qr_interfaces=None):
-        data = {'router_id': router_id,
+        The notification is stored in the transaction of the caller and is
+        handed to the driver by _dispatch_ecmp_notifications once that
+        transaction commits. It carries the hash policy of the route, the
+        agents derive the one of the router namespace from its routes.
+        """
+        data = {'id': route_id,
+                'revision': revision,
+                'router_id': router_id,
                 'vip': vip,
                 'next_hops': next_hops,
                 'operation': operation,
                 'set_arp_proxy_qrs': related_qr_interfaces,
-                'unset_arp_proxy_qrs': unused_qr_interfaces}
-        hosts = self._get_hosts_to_notify(context, router_id)
-        for host in hosts:
-            LOG.debug('ecmp: start notify host %s to update ecmproute %s', host, data)
-            self.agent_rpc.update_ecmp_route(context, data, host=host)
+                'unset_arp_proxy_qrs': unused_qr_interfaces,
+                'qr_interfaces': qr_interfaces or [],
+                'hash_policy': hash_policy,
+                'trace_id': context.request_id or uuidutils.generate_uuid(),
+                'timestamp': time.time()}
+        self._add_ecmp_notification(context, router_id, data)
+
+    def _run_ecmp_notification_dispatcher(self):
+        try:
+            self._dispatch_ecmp_notifications()
+        except Exception:
+            LOG.exception('ecmp: failed to dispatch ecmp notifications')
+
+    def _dispatch_on_commit(self):
+        """Dispatch right away the changes of a committed request.
+
+        Only for the drivers realizing the changes themselves, e.g. in one
+        transaction per request; a failure leaves them to the periodic run.
+        """
+        if self.driver.dispatch_on_commit:
+            self._run_ecmp_notification_dispatcher()
+
+    @staticmethod
+    def _get_dispatcher_id():
+        # the workers of a neutron-server are forked processes
+        return '%s:%d' % (cfg.CONF.host, os.getpid())
+
+    def _dispatch_ecmp_notifications(self):
+        """Hand the pending ecmp notifications to the driver.
+
+        The routers of the notifications are claimed first, so that the
+        dispatchers of all the neutron-servers share the notifications
+        instead of sending them each. Pending notifications of the same
+        route are merged, the remaining ones are realized by the driver in
+        one call. Notifications of the routers whose changes failed are
+        kept, in order, for a later run.
+        """
+        context = n_context.get_admin_context()
+        dispatcher_id = self._get_dispatcher_id()
+        notifications = self._claim_ecmp_notifications(
+            context, dispatcher_id, cfg.CONF.ecmp.notification_batch_size,
+            cfg.CONF.ecmp.notification_lease_time)
+        try:
+            if notifications:
+                self._realize_ecmp_notifications(context, notifications)
+        finally:
+            self._release_ecmp_notification_leases(context, dispatcher_id)
+
+    @staticmethod
+    def _get_notification_retry_delay(attempts):
+        """Return the seconds to wait after the attempts-th failed dispatch."""
+        max_delay = cfg.CONF.ecmp.notification_max_retry_interval
+        # the exponent is bounded, the attempts are not
+        delay = cfg.CONF.ecmp.notification_retry_interval * 2 ** min(attempts - 1, 32)
+        return min(delay, max_delay)
+
+    def _realize_ecmp_notifications(self, context, notifications):
+        """Realize the claimed notifications with one call of the driver.
+
+        The notifications of the routers whose changes failed are kept and
+        tried again later, with a delay doubled by each failure, up to
+        notification_max_retry_interval; their routes stay PENDING
+        meanwhile.
+        """
+        routes = collections.OrderedDict()
+        ids_of_router = collections.defaultdict(list)
+        attempts_of_router = {}
+        for notification in notifications:
+            attempts_of_router[notification.router_id] = max(
+                attempts_of_router.get(notification.router_id, 0), notification.attempts)
+            data = jsonutils.loads(notification.payload)
+            key = (notification.router_id, data['vip'])
+            if key in routes:
+                data = merge_ecmp_notifications(routes[key], data)
+            routes[key] = data
+            ids_of_router[notification.router_id].append(notification.id)
+
+        failed_routers = self.driver.realize_ecmp_routes(context, list(routes.values()))
+
+        sent_ids = []
+        failed_ids = collections.defaultdict(list)
+        for router_id, ids in ids_of_router.items():
+            if router_id in failed_routers:
+                attempts = attempts_of_router[router_id] + 1
+                delay = self._get_notification_retry_delay(attempts)
+                LOG.warning('ecmp: failed to dispatch %d notifications of router %s, '
+                            'attempt %d, trying again in %ds', len(ids), router_id, attempts, delay)
+                failed_ids[delay].extend(ids)
+            else:
+                sent_ids.extend(ids)
+        self._delete_ecmp_notifications(context, sent_ids)
+        self._retry_ecmp_notifications(context, failed_ids)
+
+    def report_ecmp_realization(self, context, host, histograms, routes):
+        """RPC from an agent reporting how fast it realized ecmp routes."""
+        self._realization_histograms.merge(histograms)
+        for route in routes:
+            key = (route['router_id'], route['vip'])
+            state = self._route_realization.pop(key, None)
+            if not state or state['trace_id'] != route['trace_id']:
+                state = {'trace_id': route['trace_id'],
+                         'operation': route['operation'],
+                         'hosts': {}}
+            state['hosts'][host] = route['realization']
+            self._route_realization[key] = state
+            LOG.debug('ecmp route %s of router %s realized on %s in %.3fs, trace %s',
+                      route['vip'], route['router_id'], host,
+                      route['realization'], route['trace_id'])
+        while len(self._route_realization) > cfg.CONF.ecmp.realization_max_routes:
+            self._route_realization.popitem(last=False)
+
+    @db_api.retry_if_session_inactive()
+    def report_ecmp_route_status(self, context, host, statuses):
+        """RPC from an agent reporting the route revisions it realized."""
+        LOG.debug('ecmp: host %s realized %d route revisions', host, len(statuses))
+        self._update_ecmp_route_hosts(context, host, statuses)
+
+    def _log_realization(self):
+        summary = self._realization_histograms.summary()
+        if not any(stage['count'] for stage in summary.values()):
+            return
+        slowest = sorted(
+            ((max(state['hosts'].values()), router_id, vip, state['trace_id'])
+             for (router_id, vip), state in self._route_realization.items()
+             if state['hosts']), reverse=True)[:5]
+        LOG.info('ecmp realization latencies (seconds) since last log: %s, '
+                 'slowest routes (seconds, router, vip, trace): %s',
+                 summary, slowest)
+        self._realization_histograms.reset()
 
     def _get_router_qr_name(self, port_id):
         return (INTERNAL_DEV_PREFIX + port_id)[:LINUX_DEV_LEN]
 
-    def _get_router_gw_port_with_cidr(self, context, router_id):
+    def _get_router_gw_port_with_cidr(self, context, router_id, generation=None):
+        """Return the router interface subnets indexed by ip version.
+
+        The subnets of each family are sorted longest prefix first, so the
+        first one containing an ip is its best match. They are cached while
+        the interface generation of the router is unchanged; the value is
+        shared, callers must not change it.
+
+        :param generation: the interface generation of the router, when
+               already read by the caller.
+        """
+        if generation is None:
+            generation = self._get_router_generations(context, [router_id])[router_id].interfaces
+        router_subnet = self._router_subnets.get(router_id, generation)
+        if router_subnet is None:
+            router_subnet = self._read_router_subnets(context, router_id)
+            self._router_subnets.set(router_id, generation, router_subnet)
+        return router_subnet
+
+    def _get_router_subnets_of_routers(self, context, router_ids):
+        """Return the interface subnets of routers, validated in one query."""
+        generations = self._get_router_generations(context, set(router_ids))
+        return dict((router_id, self._get_router_gw_port_with_cidr(
+            context, router_id, generation.interfaces)) for router_id, generation in generations.items())
+
+    def _read_router_subnets(self, context, router_id):
         context = context.elevated()
         filters = {'device_id': [router_id], 'device_owner': ['network:router_interface_distributed']}
         ports = self._core_plugin.get_ports(context, filters)
-        router_subnet = []
+        router_subnet = {4: [], 6: []}
         for port in ports:
             for ip in port['fixed_ips']:
                 cidr = self._core_plugin.get_subnet(
                     context, ip['subnet_id'])['cidr']
                 subnet = {'cidr': netaddr.IPNetwork(cidr),
+                          'subnet_id': ip['subnet_id'],
                           'port_id': port['id']}
-                router_subnet.append(subnet)
+                router_subnet[subnet['cidr'].version].append(subnet)
+        for subnets in router_subnet.values():
+            subnets.sort(key=lambda rs: rs['cidr'].prefixlen, reverse=True)
         LOG.debug('Test the router_subnet is %s', router_subnet)
         return router_subnet
 
-    def _validate_next_hops(self, context, router_id, add_next_hops, router_subnet):
+    def bump_router_interface_generations(self, context, router_ids):
+        """Invalidate what the workers cached of the interfaces of routers.
+
+        Called in the transaction changing a router interface port.
+        """
+        self._bump_router_generations(context, router_ids, routes=False, interfaces=True)
+
+    def _get_qr_port_of_ip(self, ip, router_subnet):
+        ip = netaddr.IPAddress(ip)
+        for rs in router_subnet[ip.version]:
+            if ip in rs['cidr']:
+                return rs['port_id']
+        return None
+
+    def _validate_next_hops(self, context, router_id, add_next_hops, router_subnet, vip=None):
         next_hops_gw_ports = set()
+        ip_version = vip and netaddr.IPNetwork(vip).version
         for next_hop_ip in add_next_hops:
-            ip = netaddr.IPAddress(next_hop_ip)
-            for rs in router_subnet:
-                if ip in rs['cidr']:
-                    next_hops_gw_ports.add(rs['port_id'])
-                    break
-            else:
+            if ip_version and netaddr.IPAddress(next_hop_ip).version != ip_version:
+                raise exception.EcmpNextHopVersionMismatch(next_hop=next_hop_ip, vip=vip)
+            port_id = self._get_qr_port_of_ip(next_hop_ip, router_subnet)
+            if port_id is None:
                 raise exception.EcmpInvalidRoutes(next_hop=next_hop_ip, router_id=router_id)
+            next_hops_gw_ports.add(port_id)
         LOG.debug('Test the next_hop related router gw port is %s', next_hops_gw_ports)
         return next_hops_gw_ports
 
-    def _get_unused_qr_from_remove_next_hops(self, context, router_id, remove_next_hops, router_subnet):
-        all_next_hops = self._get_all_next_hop_ips_of_router(context, router_id)
-        all_related_qr_port = set()
-        for next_hop in set(all_next_hops):
-            ip = netaddr.IPAddress(next_hop)
-            for rs in router_subnet:
-                if ip in rs['cidr']:
-                    all_related_qr_port.add(rs['port_id'])
-                    break
-        remove_related_qr_port = set()
-        for remove_next_hop in remove_next_hops:
-            remove_ip = netaddr.IPAddress(remove_next_hop)
-            for rs in router_subnet:
-                if remove_ip in rs['cidr']:
-                    remove_related_qr_port.add(rs['port_id'])
-                    break
-        unused_qr_interface = []
-        unused_qr_port = remove_related_qr_port - all_related_qr_port
-
-        for port in unused_qr_port:
-            unused_qr_interface.append(self._get_router_qr_name(port))
-        LOG.debug('The ecmp unsed qr port is %s', unused_qr_interface)
-        return unused_qr_interface
+    def _get_next_hop_refcounts(self, context, router_id):
+        """Count the routes of the router using each next hop."""
+        refcounts = collections.Counter()
+        for next_hops in self._get_next_hops_of_router(context, router_id):
+            refcounts.update(set(next_hops))
+        return refcounts
 
-    def create_ecmp_route(self, context, ecmp_route):
-        LOG.debug('start create ecmp route : %s', ecmp_route)
-        next_hops = ecmp_route['ecmp_route'].get('next_hops', [])
+    def _ensure_qr_port_refcounts(self, context, router_id, router_subnet):
+        # The refcounts of a router are built once from its routes, e.g.
+        # for routes created before they existed.
+        if not self._are_qr_port_refcounts_built(context, router_id):
+            refcounts = self._get_next_hop_refcounts(context, router_id)
+            port_of_next_hop = dict((next_hop, self._get_qr_port_of_ip(next_hop, router_subnet))
+                                    for next_hop in refcounts)
+            LOG.debug('ecmp: build the refcounts of %d next hops of router %s',
+                      len(refcounts), router_id)
+            self._set_qr_port_refcounts(context, router_id, refcounts, port_of_next_hop)
+
+    def _update_next_hop_refcounts(self, context, router_id, deltas, router_subnet):
+        return self._update_qr_port_refcounts(
+            context, router_id, deltas,
+            lambda next_hop: self._get_qr_port_of_ip(next_hop, router_subnet))
+
+    def _apply_next_hop_changes(self, context, router_id, added_next_hops, removed_next_hops, router_subnet):
+        """Update the qr port refcounts, return the qr no longer used.
+
+        Must be called in the transaction changing the route, before the
+        route itself is written.
+        """
+        self._ensure_qr_port_refcounts(context, router_id, router_subnet)
+        deltas = collections.Counter(set(added_next_hops))
+        deltas.subtract(set(removed_next_hops))
+        unused_ports = self._update_next_hop_refcounts(context, router_id, deltas, router_subnet)
+        unused_qr_interfaces = [self._get_router_qr_name(port_id) for port_id in unused_ports]
+        LOG.debug('The ecmp unsed qr port is %s', unused_qr_interfaces)
+        return unused_qr_interfaces
+
+    def _validate_port_selector(self, selector):
+        if (len(selector) != 1 or
+                list(selector)[0] not in ecmp_ext.PORT_SELECTOR_TYPES or
+                not isinstance(list(selector.values())[0], six.string_types)):
+            raise exception.EcmpInvalidPortSelector(
+                selector=selector, types=', '.join(ecmp_ext.PORT_SELECTOR_TYPES))
+
+    @staticmethod
+    def _get_port_selectors(port):
+        """Return the (selector type, value) pairs a port is matched by."""
+        if not port:
+            return set()
+        selectors = set([('device_owner', port.get('device_owner'))])
+        selectors.update(('tag', tag) for tag in port.get('tags') or [])
+        selectors.update(('allowed_address_pair', pair['ip_address'])
+                         for pair in port.get('allowed_address_pairs') or [])
+        return selectors
+
+    def _get_pool_next_hops(self, port, vip, router_subnet):
+        """Return the addresses of a pool member in the router subnets."""
+        ip_version = netaddr.IPNetwork(vip).version
+        if port['id'] in set(rs['port_id'] for rs in router_subnet[ip_version]):
+            return set()
+        next_hops = set()
+        for fixed_ip in port.get('fixed_ips') or []:
+            address = fixed_ip['ip_address']
+            if (netaddr.IPAddress(address).version == ip_version and
+                    self._get_qr_port_of_ip(address, router_subnet)):
+                next_hops.add(address)
+        return next_hops
+
+    def _get_pool_members_next_hops(self, context, vip, selector, router_subnet):
+        """Return the next hops of the ports currently matching a selector."""
+        ip_version = netaddr.IPNetwork(vip).version
+        subnet_ids = [rs['subnet_id'] for rs in router_subnet[ip_version]]
+        if not subnet_ids:
+            return []
+        selector_type, value = list(selector.items())[0]
+        filters = {'fixed_ips': {'subnet_id': subnet_ids}}
+        if selector_type == 'device_owner':
+            filters['device_owner'] = [value]
+        elif selector_type == 'tag':
+            filters['tags'] = [value]
+        next_hops = set()
+        for port in self._core_plugin.get_ports(context.elevated(), filters):
+            if (selector_type, value) in self._get_port_selectors(port):
+                next_hops |= self._get_pool_next_hops(port, vip, router_subnet)
+        return sorted(next_hops)
+
+    def _validate_hash_policy(self, context, router_id, hash_policy):
+        """Check that a new route has the hash policy of its router.
+
+        The hash policy is set per router namespace, all the routes of a
+        router setting one must agree on it. The router is locked, so that
+        concurrent creations of routes with different policies are checked
+        one after the other.
+        """
+        if not hash_policy:
+            return
+        self._lock_router(context, router_id)
+        current = self._get_router_hash_policy(context, router_id)
+        if current and current != hash_policy:
+            raise exception.EcmpHashPolicyConflict(router_id=router_id, current=current,
+                                                   hash_policy=hash_policy)
+
+    @staticmethod
+    def _normalize_vip(vip):
+        """Return a vip prefix in canonical form, a host one as an address."""
+        try:
+            network = netaddr.IPNetwork(vip)
+        except (netaddr.AddrFormatError, TypeError, ValueError):
+            raise exception.EcmpInvalidVip(vip=vip)
+        if network.ip != network.network:
+            raise exception.EcmpInvalidVip(vip=vip)
+        if network.size == 1:
+            return str(network.ip)
+        return str(network.cidr)
+
+    def _prepare_ecmp_route(self, context, ecmp_route, router_port_with_cidr):
+        """Validate a new route, return the qr interfaces of its next hops."""
+        ecmp_route['ecmp_route']['vip'] = self._normalize_vip(ecmp_route['ecmp_route'].get('vip'))
+        next_hops = ecmp_route['ecmp_route'].get('next_hops') or []
         router_id = ecmp_route['ecmp_route'].get('router_id')
-        router_port_with_cidr = self._get_router_gw_port_with_cidr(context, router_id)
-        next_hops_gw_ports = self._validate_next_hops(context, router_id, next_hops, router_port_with_cidr)
-        ecmp_r = super(EcmpPlugin, self).create_ecmp_route(context, ecmp_route)
+        selector = ecmp_route['ecmp_route'].get('port_selector')
+        if bool(selector) == bool(next_hops):
+            raise exception.EcmpPoolNextHops()
+        if selector:
+            self._validate_port_selector(selector)
+            next_hops = self._get_pool_members_next_hops(
+                context, ecmp_route['ecmp_route'].get('vip'), selector, router_port_with_cidr)
+            ecmp_route['ecmp_route']['next_hops'] = next_hops
+        next_hops_gw_ports = self._validate_next_hops(context, router_id, next_hops, router_port_with_cidr,
+                                                      vip=ecmp_route['ecmp_route'].get('vip'))
         related_qr_interfaces = []
         for port in next_hops_gw_ports:
             related_qr_interfaces.append(self._get_router_qr_name(port))
-        self._rpc_notify_ecmp_route(context, 'replace', ecmp_r['vip'], next_hops, router_id,
-                                    related_qr_interfaces=related_qr_interfaces)
+        return related_qr_interfaces
+
+    def _create_ecmp_route(self, context, ecmp_route, router_port_with_cidr, related_qr_interfaces):
+        """Write and notify a route prepared by _prepare_ecmp_route, in a transaction of the caller."""
+        router_id = ecmp_route['ecmp_route']['router_id']
+        next_hops = ecmp_route['ecmp_route']['next_hops']
+        self._validate_hash_policy(context, router_id, ecmp_route['ecmp_route'].get('hash_policy'))
+        self._apply_next_hop_changes(context, router_id, set(next_hops), [], router_port_with_cidr)
+        ecmp_r = super(EcmpPlugin, self).create_ecmp_route(context, ecmp_route)
+        self._rpc_notify_ecmp_route(context, 'replace', ecmp_r['vip'], ecmp_r['effective_next_hops'], router_id,
+                                    related_qr_interfaces=related_qr_interfaces,
+                                    qr_interfaces=related_qr_interfaces,
+                                    route_id=ecmp_r['id'], revision=ecmp_r['revision_number'],
+                                    hash_policy=ecmp_r['hash_policy'])
         return ecmp_r
 
+    @db_api.retry_if_session_inactive()
+    def create_ecmp_route(self, context, ecmp_route):
+        LOG.debug('start create ecmp route : %s', ecmp_route)
+        router_id = ecmp_route['ecmp_route'].get('router_id')
+        router_port_with_cidr = self._get_router_gw_port_with_cidr(context, router_id)
+        related_qr_interfaces = self._prepare_ecmp_route(context, ecmp_route, router_port_with_cidr)
+        with context.session.begin(subtransactions=True):
+            ecmp_r = self._create_ecmp_route(context, ecmp_route, router_port_with_cidr, related_qr_interfaces)
+            self._bump_router_generations(context, [router_id])
+            self.driver.create_ecmp_route_precommit(context, ecmp_r)
+        self._driver_postcommit('create_ecmp_route_postcommit', context, ecmp_r)
+        self._dispatch_on_commit()
+        return ecmp_r
+
+    @db_api.retry_if_session_inactive()
+    def create_ecmp_route_bulk(self, context, ecmp_routes):
+        """Create several routes in one transaction, all or none of them."""
+        LOG.debug('start create %d ecmp routes', len(ecmp_routes['ecmp_routes']))
+        subnets_of_router = self._get_router_subnets_of_routers(
+            context, [ecmp_route['ecmp_route'].get('router_id') for ecmp_route in ecmp_routes['ecmp_routes']])
+        prepared = []
+        for ecmp_route in ecmp_routes['ecmp_routes']:
+            router_port_with_cidr = subnets_of_router[ecmp_route['ecmp_route'].get('router_id')]
+            prepared.append((ecmp_route, router_port_with_cidr,
+                             self._prepare_ecmp_route(context, ecmp_route, router_port_with_cidr)))
+        with context.session.begin(subtransactions=True):
+            ecmp_rs = [self._create_ecmp_route(context, *args) for args in prepared]
+            self._bump_router_generations(context, subnets_of_router)
+            self.driver.create_ecmp_routes_precommit(context, ecmp_rs)
+        self._driver_postcommit('create_ecmp_routes_postcommit', context, ecmp_rs)
+        self._dispatch_on_commit()
+        return ecmp_rs
+
+    @db_api.retry_if_session_inactive()
     def update_ecmp_route(self, context, id, ecmp_route):
+        """Replace the next hops of a route.
+
+        The route is locked while the change is computed, and its
+        revision_number is compared and bumped when written: an update
+        racing with another one is retried on fresh data, while one whose
+        If-Match revision is outdated fails with a conflict.
+        """
         LOG.debug('start update ecmp route : %s', ecmp_route)
         new_next_hops = ecmp_route['ecmp_route'].get('next_hops', [])
-        if new_next_hops:
-            old_ecmproute = self._get_ecmproute(context, id)
-            old_next_hops = old_ecmproute['next_hops'].split(',')
-            added = set(new_next_hops) - set(old_next_hops)
-            removed = set(old_next_hops) - set(new_next_hops)
-            vip = old_ecmproute['vip']
-            router_id = old_ecmproute['router_id']
+        if not new_next_hops:
+            return self.get_ecmp_route(context, id)
+        with context.session.begin(subtransactions=True):
+            ecmproute_db = self._lock_ecmproute(context, id)
+            if ecmproute_db.pool:
+                raise exception.EcmpPoolNextHops()
+            ecmp_r, original = self._replace_ecmp_route_next_hops(context, ecmproute_db, new_next_hops)
+        self._driver_postcommit('update_ecmp_route_postcommit', context, ecmp_r, original)
+        self._dispatch_on_commit()
+        return ecmp_r
+
+    def _replace_ecmp_route_next_hops(self, context, ecmproute_db, new_next_hops, router_port_with_cidr=None):
+        """Write and notify the new next hops of a route locked by the caller.
+
+        :returns: the route and the route before the change.
+        """
+        original = self._make_ecmp_route_dict(ecmproute_db)
+        old_next_hops = ecmp_db.split_next_hops(ecmproute_db['next_hops'])
+        added = set(new_next_hops) - set(old_next_hops)
+        removed = set(old_next_hops) - set(new_next_hops)
+        vip = ecmproute_db['vip']
+        router_id = ecmproute_db['router_id']
 
+        if router_port_with_cidr is None:
             router_port_with_cidr = self._get_router_gw_port_with_cidr(context, router_id)
-            next_hops_gw_ports = self._validate_next_hops(context, router_id, added, router_port_with_cidr)
+        next_hops_gw_ports = self._validate_next_hops(context, router_id, added, router_port_with_cidr, vip=vip)
+        related_qr_interfaces = []
+        for port in next_hops_gw_ports:
+            related_qr_interfaces.append(self._get_router_qr_name(port))
+        qr_interfaces = self._get_qr_interface(context, new_next_hops, router_id, router_port_with_cidr)
 
-            ecmproute_db = super(EcmpPlugin, self).update_ecmp_route(context, id, ecmp_route)
-            #new_next_hops.sort()
-            related_qr_interfaces = []
-            for port in next_hops_gw_ports:
-                related_qr_interfaces.append(self._get_router_qr_name(port))
+        unused_qr_interfaces = self._apply_next_hop_changes(context, router_id, added, removed,
+                                                            router_port_with_cidr)
+        ecmp_r = self._update_ecmp_route_next_hops(context, ecmproute_db, new_next_hops)
+        self._bump_router_generations(context, [router_id])
+        self._forget_withdrawn_next_hops(context, router_id, removed)
+        self._rpc_notify_ecmp_route(context, 'replace', vip, ecmp_r['effective_next_hops'], router_id,
+                                    related_qr_interfaces=related_qr_interfaces,
+                                    unused_qr_interfaces=unused_qr_interfaces,
+                                    qr_interfaces=qr_interfaces,
+                                    route_id=ecmproute_db['id'], revision=ecmp_r['revision_number'],
+                                    hash_policy=ecmp_r['hash_policy'])
+        self.driver.update_ecmp_route_precommit(context, ecmp_r, original)
+        return ecmp_r, original
 
-            unused_qr_interfaces = self._get_unused_qr_from_remove_next_hops(context, router_id, removed,
-                                                                            router_port_with_cidr)
+    @db_api.retry_if_session_inactive()
+    def update_ecmp_pools(self, context, port, original_port=None, deleted=False):
+        """Follow a port change in the next hops of the pools it is member of.
 
-            self._rpc_notify_ecmp_route(context, 'replace', vip, new_next_hops, router_id,
-                                        related_qr_interfaces=related_qr_interfaces,
-                                        unused_qr_interfaces=unused_qr_interfaces)
-            return ecmproute_db
+        Called for every port created, updated or deleted: the pools are
+        found with one query on the selectors the port (and its previous
+        version) is matched by, and only the addresses of this port are
+        added to or removed from their next hops. Each changed route is
+        notified through the ecmp notification queue, which coalesces the
+        changes of a burst of port events into few casts per host.
+        """
+        selectors = self._get_port_selectors(port) | self._get_port_selectors(original_port)
+        route_ids = self._get_ecmp_pool_route_ids(context, selectors)
+        if not route_ids:
+            return
+        subnets_of_router = {}
+        for route_id in route_ids:
+            with context.session.begin(subtransactions=True):
+                try:
+                    ecmproute_db = self._lock_ecmproute(context, route_id)
+                except exception.EcmprouteNotFound:
+                    continue
+                selector = (ecmproute_db.pool.selector_type, ecmproute_db.pool.selector_value)
+                router_id = ecmproute_db['router_id']
+                if router_id not in subnets_of_router:
+                    subnets_of_router[router_id] = self._get_router_gw_port_with_cidr(context, router_id)
+                router_subnet = subnets_of_router[router_id]
+                vip = ecmproute_db['vip']
+                before = set()
+                if original_port is not None or deleted:
+                    previous = port if deleted else original_port
+                    if selector in self._get_port_selectors(previous):
+                        before = self._get_pool_next_hops(previous, vip, router_subnet)
+                after = set()
+                if not deleted and selector in self._get_port_selectors(port):
+                    after = self._get_pool_next_hops(port, vip, router_subnet)
+                if before == after:
+                    continue
+                old_next_hops = set(ecmp_db.split_next_hops(ecmproute_db['next_hops']))
+                new_next_hops = sorted((old_next_hops - before) | after)
+                LOG.debug('ecmp: port %s changes pool route %s from %s to %s',
+                          port['id'], route_id, sorted(old_next_hops), new_next_hops)
+                ecmp_r, original = self._replace_ecmp_route_next_hops(
+                    context, ecmproute_db, new_next_hops, router_subnet)
+            self._driver_postcommit('update_ecmp_route_postcommit', context, ecmp_r, original)
+        self._dispatch_on_commit()
+
+    @db_api.retry_if_session_inactive()
+    def finish_ecmp_route_import(self, context, router_id, route_ids):
+        """Validate the routes bulk loaded into a router, in one transaction.
+
+        The routes were written as exported, without reading the router;
+        they are checked here against its subnets and hash policy all at
+        once, the invalid ones are deleted. The next hops of the pool routes
+        are those of the ports matching their selector in this region.
+
+        :param route_ids: the ids of the loaded routes of the router.
+        :returns: list of dicts of the id, vip and error of the deleted
+                  routes.
+        """
+        route_ids = set(route_ids)
+        invalid = []
+        with context.session.begin(subtransactions=True):
+            # checked against the hash policy of the routes being created
+            self._lock_router(context, router_id)
+            had_refcounts = self._are_qr_port_refcounts_built(context, router_id)
+            router_subnet = self._get_router_gw_port_with_cidr(context, router_id)
+            ecmpdb = self._get_ecmproute_by_router_id(context, router_id)
+            hash_policy = next((ecmpr['hash_policy'] for ecmpr in ecmpdb
+                                if ecmpr['id'] not in route_ids and ecmpr['hash_policy']), None)
+            deltas = collections.Counter()
+            for ecmpr in ecmpdb:
+                if ecmpr['id'] not in route_ids:
+                    continue
+                try:
+                    if hash_policy and ecmpr['hash_policy'] and ecmpr['hash_policy'] != hash_policy:
+                        raise exception.EcmpHashPolicyConflict(router_id=router_id, current=hash_policy,
+                                                               hash_policy=ecmpr['hash_policy'])
+                    selector = self._make_port_selector(ecmpr.pool)
+                    if selector:
+                        next_hops = self._get_pool_members_next_hops(context, ecmpr['vip'], selector,
+                                                                     router_subnet)
+                        ecmpr.next_hops = ','.join(next_hops)
+                    else:
+                        next_hops = ecmp_db.split_next_hops(ecmpr['next_hops'])
+                        if not next_hops:
+                            raise exception.EcmpPoolNextHops()
+                    self._validate_next_hops(context, router_id, next_hops, router_subnet, vip=ecmpr['vip'])
+                except n_exc.NeutronException as e:
+                    invalid.append({'id': ecmpr['id'], 'vip': ecmpr['vip'], 'error': str(e)})
+                    context.session.delete(ecmpr)
+                    continue
+                hash_policy = hash_policy or ecmpr['hash_policy']
+                deltas.update(set(next_hops))
+            context.session.flush()
+            if had_refcounts:
+                self._update_next_hop_refcounts(context, router_id, deltas, router_subnet)
+            else:
+                # counts the loaded routes as well
+                self._ensure_qr_port_refcounts(context, router_id, router_subnet)
+            self._bump_router_generations(context, [router_id])
+        LOG.debug('ecmp: imported %d routes into router %s, %d invalid',
+                  len(route_ids), router_id, len(invalid))
+        return invalid
+
+    def resync_ecmp_routers(self, context, router_ids):
+        """Have the driver realize again all the routes of routers.
+
+        One message per router replaces the notifications of its routes,
+        e.g. once they were bulk loaded.
+
+        :returns: the set of ids of the routers which failed.
+        """
+        failed_routers = self.driver.resync_routers(context, router_ids)
+        if failed_routers:
+            LOG.warning('ecmp: failed to resync routers %s', sorted(failed_routers))
+        return failed_routers
+
+    def resync_ecmp_routers_of_interface(self, context, router_id):
+        """Resync a router an interface was removed from, if it has routes.
+
+        Its agents reprogram its routes with one message, which drops the
+        state left by the removed qr device.
+        """
+        if self._get_ecmproute_count_of_router(context, router_id):
+            self.resync_ecmp_routers(context, [router_id])
+
+    def purge_ecmp_routers(self, context, router_ids):
+        """Drop the state of the ecmp routes of deleted routers.
+
+        Their pending notifications are discarded, and the driver purges
+        each router with one message rather than a deletion per route.
+        """
+        self._delete_ecmp_notifications_of_routers(context, router_ids)
+        try:
+            self.driver.purge_routers(context, router_ids)
+        except Exception:
+            LOG.exception('ecmp: failed to purge routers %s', router_ids)
 
     def get_ecmp_route(self, context, id, fields=None):
         return super(EcmpPlugin, self).get_ecmp_route(context, id, fields)
@@ -193,28 +810,173 @@ class EcmpPlugin(ecmp_db.Ecmp_db_mixin):
     def get_ecmp_routes(self, context, filters=None, fields=None):
         return super(EcmpPlugin, self).get_ecmp_routes(context, filters, fields)
 
+    @db_api.retry_if_session_inactive()
     def delete_ecmp_route(self, context, id):
         LOG.debug('start delete ecmp route : %s', id)
-        ecmp_r = self._get_ecmproute(context, id)
-        router_id = ecmp_r['router_id']
-        next_hops = ecmp_r['next_hops'].split(',')
-        super(EcmpPlugin, self).delete_ecmp_route(context, id)
+        with context.session.begin(subtransactions=True):
+            ecmp_r = self._lock_ecmproute(context, id)
+            router_id = ecmp_r['router_id']
+            next_hops = ecmp_db.split_next_hops(ecmp_r['next_hops'])
+            router_port_with_cidr = self._get_router_gw_port_with_cidr(context, router_id)
+            unused_qr_interfaces = self._apply_next_hop_changes(context, router_id, [], set(next_hops),
+                                                                router_port_with_cidr)
+            ecmp_route = self._make_ecmp_route_dict(ecmp_r)
+            super(EcmpPlugin, self).delete_ecmp_route(context, id)
+            self._bump_router_generations(context, [router_id])
+            self._forget_withdrawn_next_hops(context, router_id, next_hops)
+            self._rpc_notify_ecmp_route(context, 'delete', ecmp_r['vip'], next_hops, router_id,
+                                        unused_qr_interfaces=unused_qr_interfaces,
+                                        route_id=id, revision=ecmp_r['revision_number'],
+                                        hash_policy=ecmp_r['hash_policy'])
+            self.driver.delete_ecmp_route_precommit(context, ecmp_route)
+        self._driver_postcommit('delete_ecmp_route_postcommit', context, ecmp_route)
+        self._dispatch_on_commit()
 
-        router_port_with_cidr = self._get_router_gw_port_with_cidr(context, router_id)
-        unused_qr_interfaces = self._get_unused_qr_from_remove_next_hops(context, router_id, next_hops,
-                                                                        router_port_with_cidr)
-        self._rpc_notify_ecmp_route(context, 'delete', ecmp_r['vip'], next_hops, router_id,
-                                    unused_qr_interfaces=unused_qr_interfaces)
+    def _get_next_hops_of_ports(self, context, ports):
+        """Return the addresses of ports which are next hops of ecmp routes.
 
-    def _get_qr_interface(self, context, netxt_hops, router_id):
-        router_port_with_cidr = self._get_router_gw_port_with_cidr(context, router_id)
+        :returns: dict of router id to a dict of next hop to port id.
+        """
+        ips_of_subnet = collections.defaultdict(dict)
+        for port in ports:
+            for fixed_ip in port.get('fixed_ips') or []:
+                ips_of_subnet[fixed_ip['subnet_id']][fixed_ip['ip_address']] = port['id']
+        if not ips_of_subnet:
+            return {}
+        filters = {'fixed_ips': {'subnet_id': list(ips_of_subnet)},
+                   'device_owner': [n_const.DEVICE_OWNER_DVR_INTERFACE]}
+        ips_of_router = collections.defaultdict(dict)
+        for router_port in self._core_plugin.get_ports(context.elevated(), filters):
+            for fixed_ip in router_port['fixed_ips']:
+                ips_of_router[router_port['device_id']].update(
+                    ips_of_subnet.get(fixed_ip['subnet_id'], {}))
+        next_hops_of_router = self._get_next_hop_sets_of_routers(context, list(ips_of_router))
+        result = {}
+        for router_id, ips in ips_of_router.items():
+            next_hops = dict((ip, port_id) for ip, port_id in ips.items()
+                             if ip in next_hops_of_router.get(router_id, ()))
+            if next_hops:
+                result[router_id] = next_hops
+        return result
+
+    def _notify_next_hops_health(self, context, changed, healthy):
+        """Notify the effective next hops of the routes using changed next hops.
+
+        Only the routing of the routes changes, their proxy parameters do
+        not, and the notification queue merges the changes of a burst of
+        events into few casts per host. Called in the transaction changing
+        the withdrawn next hops.
+
+        :returns: the changed routes and the routes before the change.
+        """
+        ecmp_routes = []
+        originals = []
+        subnets_of_router = self._get_router_subnets_of_routers(context, list(changed))
+        for ecmproute_db in self._lock_ecmproutes_of_routers(context, list(changed)):
+            router_id = ecmproute_db['router_id']
+            next_hops = ecmp_db.split_next_hops(ecmproute_db['next_hops'])
+            if not changed[router_id] & set(next_hops):
+                continue
+            context.session.expire(ecmproute_db, ['withdrawn'])
+            effective = self._get_effective_next_hops(ecmproute_db, next_hops)
+            qr_interfaces = self._get_qr_interface(context, next_hops, router_id, subnets_of_router[router_id])
+            LOG.debug('ecmp: effective next hops of route %s are now %s', ecmproute_db['id'], effective)
+            self._rpc_notify_ecmp_route(context, 'replace', ecmproute_db['vip'], effective, router_id,
+                                        qr_interfaces=qr_interfaces, route_id=ecmproute_db['id'],
+                                        revision=ecmproute_db['revision_number'],
+                                        hash_policy=ecmproute_db['hash_policy'])
+            ecmp_route = self._make_ecmp_route_dict(ecmproute_db, next_hops=next_hops)
+            withdrawn = set(w.ip_address for w in ecmproute_db.withdrawn)
+            if healthy:
+                withdrawn |= changed[router_id]
+            else:
+                withdrawn -= changed[router_id]
+            previous = [next_hop for next_hop in next_hops if next_hop not in withdrawn]
+            ecmp_routes.append(ecmp_route)
+            originals.append(dict(ecmp_route, effective_next_hops=previous or list(next_hops)))
+        # the effective next hops changed, not the revisions of the routes;
+        # bumped once the routes are locked, as the other changes do
+        self._bump_router_generations(context, set(ecmp_route['router_id'] for ecmp_route in ecmp_routes))
+        self.driver.update_ecmp_routes_precommit(context, ecmp_routes, originals)
+        return ecmp_routes, originals
+
+    @db_api.retry_if_session_inactive()
+    def update_next_hops_health(self, context, ports, reason, healthy, host=None):
+        """Withdraw, or restore, for a reason the next hops on ports.
+
+        The configured next hops of the routes are kept, only their
+        effective next hops change.
+        """
+        next_hops_of_router = self._get_next_hops_of_ports(context, ports)
+        if not next_hops_of_router:
+            return
+        ecmp_routes, originals = [], []
+        with context.session.begin(subtransactions=True):
+            if healthy:
+                changed = self._delete_withdrawn_next_hops(
+                    context, reason, next_hops_of_router=next_hops_of_router)
+            else:
+                changed = self._add_withdrawn_next_hops(
+                    context, next_hops_of_router, reason, host=host)
+            if changed:
+                LOG.info('ecmp: %s next hops %s for %s',
+                         'restore' if healthy else 'withdraw', dict(changed), reason)
+                ecmp_routes, originals = self._notify_next_hops_health(context, changed, healthy)
+        if ecmp_routes:
+            self._driver_postcommit('update_ecmp_routes_postcommit', context, ecmp_routes, originals)
+        self._dispatch_on_commit()
+
+    def update_port_health(self, context, port, original_port=None, deleted=False):
+        """Withdraw the next hops of a port while it is down or deleted."""
+        if deleted:
+            healthy = False
+        elif original_port is None or port.get('status') == original_port.get('status'):
+            return
+        elif port['status'] == n_const.PORT_STATUS_ACTIVE:
+            healthy = True
+        elif port['status'] == n_const.PORT_STATUS_DOWN:
+            healthy = False
+        else:
+            return
+        self.update_next_hops_health(context, [port], WITHDRAWN_PORT_DOWN, healthy)
+
+    @db_api.retry_if_session_inactive()
+    def _restore_next_hops_of_hosts(self, context, hosts):
+        ecmp_routes, originals = [], []
+        with context.session.begin(subtransactions=True):
+            changed = self._delete_withdrawn_next_hops(context, WITHDRAWN_AGENT_DOWN, hosts=hosts)
+            if changed:
+                LOG.info('ecmp: restore next hops %s of hosts %s', dict(changed), sorted(hosts))
+                ecmp_routes, originals = self._notify_next_hops_health(context, changed, True)
+        if ecmp_routes:
+            self._driver_postcommit('update_ecmp_routes_postcommit', context, ecmp_routes, originals)
+        self._dispatch_on_commit()
+
+    def _check_next_hop_agents(self):
+        """Withdraw the next hops of the hosts whose l2 agent is dead."""
+        try:
+            context = n_context.get_admin_context()
+            agents = self._core_plugin.get_agents(
+                context, filters={'agent_type': cfg.CONF.ecmp.next_hop_agent_types})
+            dead_hosts = set(agent['host'] for agent in agents if not agent['alive'])
+            for host in dead_hosts - self._dead_agent_hosts:
+                ports = self._core_plugin.get_ports(
+                    context, filters={portbindings.HOST_ID: [host]})
+                self.update_next_hops_health(context, ports, WITHDRAWN_AGENT_DOWN, False, host=host)
+            self._dead_agent_hosts = dead_hosts
+            revived_hosts = self._get_withdrawn_hosts(context, WITHDRAWN_AGENT_DOWN) - dead_hosts
+            if revived_hosts:
+                self._restore_next_hops_of_hosts(context, revived_hosts)
+        except Exception:
+            LOG.exception('ecmp: failed to check the agents of the next hops')
+
+    def _get_qr_interface(self, context, netxt_hops, router_id, router_port_with_cidr=None):
+        if router_port_with_cidr is None:
+            router_port_with_cidr = self._get_router_gw_port_with_cidr(context, router_id)
         next_hops_gw_ports = set()
         for next_hop_ip in netxt_hops:
-            ip = netaddr.IPAddress(next_hop_ip)
-            for rs in router_port_with_cidr:
-                if ip in rs['cidr']:
-                    next_hops_gw_ports.add(rs['port_id'])
-                    break
+            next_hops_gw_ports.add(self._get_qr_port_of_ip(next_hop_ip, router_port_with_cidr))
+        next_hops_gw_ports.discard(None)
 
         qr_interfaces = []
         for port in next_hops_gw_ports:
@@ -236,14 +998,87 @@ class EcmpPlugin(ecmp_db.Ecmp_db_mixin):
 
     def get_route_of_router(self, context, router_id, host):
         LOG.debug('get rpc call from %s to get ecmp route of router %s', host, router_id)
+        return self._get_route_of_router(context, router_id)[1]
+
+    def get_route_of_router_if_changed(self, context, router_id, host, revision=None):
+        """RPC returning the routes of a router unless the agent has them.
+
+        :param revision: the revision of the routes the agent has, as
+               returned by a previous call.
+        :returns: dict with the revision of the routes of the router and
+                  its routes, None when they are at the given revision.
+        """
+        LOG.debug('get rpc call from %s to get ecmp route of router %s changed since %s',
+                  host, router_id, revision)
+        generation = self._get_router_generations(context, [router_id])[router_id]
+        current = self._get_route_revision(generation)
+        if revision is not None and revision == current:
+            return {'revision': current, 'routes': None}
+        revision, routes = self._get_route_of_router(context, router_id, generation)
+        return {'revision': revision, 'routes': routes}
+
+    @staticmethod
+    def _get_route_revision(generation):
+        # A router is at generation (0, 0) until its first change, and
+        # again once deleted: it has no revision then.
+        if not any(generation):
+            return None
+        return '%d.%d' % generation
+
+    def _get_route_of_router(self, context, router_id, generation=None):
+        """Return the revision and the routes of a router, as sent to agents.
+
+        The response is cached while the router is at the same route and
+        interface generations; it is shared, callers must not change it.
+        """
+        if generation is None:
+            generation = self._get_router_generations(context, [router_id])[router_id]
+        revision = self._get_route_revision(generation)
+        if revision is not None:
+            ecmp_route = self._route_responses.get(router_id, generation)
+            if ecmp_route is not None:
+                return revision, ecmp_route
         ecmpdb = self._get_ecmproute_by_router_id(context, router_id)
         ecmp_route = []
+        router_port_with_cidr = None
+        if ecmpdb:
+            router_port_with_cidr = self._get_router_gw_port_with_cidr(context, router_id, generation.interfaces)
         for ecmpr in ecmpdb:
-            next_hop = ecmpr['next_hops'].split(',')
-            qr_interfaces = self._get_qr_interface(context, next_hop, router_id)
-            data = {'vip': ecmpr['vip'],
-                    'next_hops': next_hop,
-                    'qr_interfaces': qr_interfaces}
+            next_hop = ecmp_db.split_next_hops(ecmpr['next_hops'])
+            qr_interfaces = self._get_qr_interface(context, next_hop, router_id, router_port_with_cidr)
+            data = {'id': ecmpr['id'],
+                    'revision': ecmpr['revision_number'],
+                    'vip': ecmpr['vip'],
+                    'next_hops': self._get_effective_next_hops(ecmpr, next_hop),
+                    'qr_interfaces': qr_interfaces,
+                    'hash_policy': ecmpr['hash_policy']}
             ecmp_route.append(data)
-        return ecmp_route
+        if revision is not None:
+            self._route_responses.set(router_id, generation, ecmp_route)
+        return revision, ecmp_route
+
+    def get_changed_routes_of_routers(self, context, host, digests):
+        """RPC from an agent restored from its snapshot.
+
+        The digests of the routes the agent has are compared with the
+        routes in the database, read in one query; only the routers which
+        differ are returned, with all their routes.
+
+        :param digests: dict of router id to ecmp_digest.get_routes_digest
+               of the routes of the router on the agent.
+        :returns: dict of router id to get_route_of_router of the router.
+        """
+        routes_of_router = collections.defaultdict(list)
+        for ecmpr in self._get_ecmproutes_of_routers(context, list(digests)):
+            next_hops = ecmp_db.split_next_hops(ecmpr['next_hops'])
+            routes_of_router[ecmpr['router_id']].append(
+                {'id': ecmpr['id'],
+                 'revision': ecmpr['revision_number'],
+                 'next_hops': self._get_effective_next_hops(ecmpr, next_hops)})
+        changed = {}
+        for router_id, digest in digests.items():
+            if ecmp_digest.get_routes_digest(routes_of_router.get(router_id, [])) != digest:
+                changed[router_id] = self.get_route_of_router(context, router_id, host)
+        LOG.debug('ecmp: %d of the %d routers restored by %s changed', len(changed), len(digests), host)
+        return changed
 
@@ -0,0 +1,334 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Benchmark of the ecmp programming of the l3 agent extension.
+
+ip_lib.IPWrapper is replaced by an executor which counts the commands the
+extension runs in the router namespaces. By default the commands are only
+recorded; with --unshare they are run in a real network namespace owned
+by an unprivileged user namespace (unshare -rn), holding a dummy qr
+device per router interface, so no root is needed.
+
+A synthetic fleet of routers is replayed for each route programmer
+backend: add_router of every router (full resync), then next hop changes
+sent one route per notification and in per-router batches, then deletes.
+Per backend and phase, the command count, the wall time and the routes
+programmed per second are reported:
+
+    python -m neutron_ecmp.tests.benchmarks.agent_benchmark \\
+        --routers 100 --routes 100 --backends cli,batch --unshare
+
+With --next-hop-sets, the routes of a router share a few next hop sets, as
+behind a load balancer, which the vip aggregation of the agent compiles
+into few prefixes.
+"""
+
+import argparse
+import collections
+import itertools
+import random
+import signal
+import subprocess
+import sys
+import time
+import uuid
+
+import netaddr
+from neutron.agent.linux import ip_lib
+from neutron_lib import context as n_context
+from oslo_config import cfg
+
+from neutron_ecmp.agents.ecmp.l3 import ecmp_l3_agent
+from neutron_ecmp.agents.ecmp.l3 import route_cache
+from neutron_ecmp.agents.ecmp.l3 import route_programmer
+from neutron_ecmp.common import ecmp_metrics
+from neutron_ecmp.tests.benchmarks import base
+
+VIP_BASE = int(netaddr.IPAddress('172.16.0.0'))
+VIP6_BASE = int(netaddr.IPAddress('fd00:ec00::'))
+SUBNET_BASE = int(netaddr.IPAddress('10.0.0.0'))
+SUBNET6_BASE = int(netaddr.IPAddress('fd00:10::'))
+
+
+class Executor(object):
+    """Count the commands run in namespaces, optionally running them."""
+    def __init__(self, ns_pid=None):
+        self.ns_pid = ns_pid
+        self.execs = 0
+        self.lines = 0
+
+    def execute(self, cmd, process_input=None, **kwargs):
+        self.execs += 1
+        if process_input:
+            self.lines += process_input.count('\n')
+        if self.ns_pid is None:
+            return ''
+        proc = subprocess.Popen(
+            ['nsenter', '--preserve-credentials', '-t', str(self.ns_pid),
+             '-U', '-n'] + cmd,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, universal_newlines=True)
+        output = proc.communicate(process_input)[0]
+        return output
+
+    def ip_wrapper(self, namespace=None):
+        executor = self
+
+        class _Netns(object):
+            def execute(self, cmds, process_input=None, **kwargs):
+                return executor.execute(cmds, process_input=process_input)
+
+        class _IPWrapper(object):
+            def __init__(self, namespace=None):
+                self.namespace = namespace
+                self.netns = _Netns()
+
+        return _IPWrapper(namespace)
+
+
+class UnprivilegedNamespace(object):
+    """A network namespace in a user namespace of the current user."""
+    def __init__(self):
+        self.proc = subprocess.Popen(['unshare', '-rn', 'sleep', '1000000'])
+        time.sleep(0.2)
+        self.pid = self.proc.pid
+
+    def run(self, cmd):
+        subprocess.check_call(['nsenter', '--preserve-credentials', '-t',
+                               str(self.pid), '-U', '-n'] + cmd)
+
+    def add_interface(self, name, cidrs):
+        self.run(['ip', 'link', 'add', name, 'type', 'dummy'])
+        for cidr in cidrs:
+            self.run(['ip', 'addr', 'add', str(cidr), 'dev', name])
+        self.run(['ip', 'link', 'set', name, 'up'])
+
+    def close(self):
+        self.proc.send_signal(signal.SIGTERM)
+        self.proc.wait()
+
+
+class FakeRouterInfo(object):
+    def __init__(self, ns_name):
+        self.ns_name = ns_name
+
+
+class FakeAgentApi(object):
+    def __init__(self, routers):
+        self.routers = routers
+
+    def get_router_info(self, router_id):
+        return self.routers.get(router_id)
+
+
+class FakePluginApi(object):
+    def __init__(self, fleet):
+        self.fleet = fleet
+
+    def get_route_of_router(self, context, router_id):
+        return self.fleet.routes[router_id]
+
+    def get_route_of_router_if_changed(self, context, router_id, revision=None):
+        return {'revision': None, 'routes': self.fleet.routes[router_id]}
+
+
+class BenchmarkExtension(ecmp_l3_agent.ECMPL3AgentExtension):
+    """ECMPL3AgentExtension without RPC listeners."""
+    def __init__(self, agent_api, plugin_rpc):
+        self.conf = cfg.CONF
+        self.agent_api = agent_api
+        self.ecmpplugin_rpc = plugin_rpc
+        self._route_programmers = {}
+        self._histograms = ecmp_metrics.Histograms(
+            ecmp_l3_agent.REALIZATION_STAGES)
+        self._realized_routes = collections.deque(maxlen=0)
+        self._route_statuses = collections.OrderedDict()
+        self._route_compilers = {}
+        self._route_cache = route_cache.RouteCache()
+        self._router_routes = {}
+        self._router_revisions = {}
+        self._snapshot_dirty = False
+        self._routers_to_verify = set()
+        self._snapshot_routes = {}
+
+
+class Fleet(object):
+    """Synthetic routers, their qr interfaces and their ecmp routes."""
+    def __init__(self, args):
+        rng = random.Random(args.seed)
+        vips = itertools.count()
+        subnets = itertools.count()
+        self.rng = rng
+        self.interfaces = {}
+        self.routes = {}
+        self.next_hop_sets = {}
+        for r in range(args.routers):
+            router_id = 'bench-router-%08d' % r
+            interfaces = []
+            for i in range(args.interfaces):
+                index = next(subnets)
+                cidrs = {4: netaddr.IPNetwork((SUBNET_BASE + index * 2 ** 8, 24)),
+                         6: netaddr.IPNetwork((SUBNET6_BASE + index * 2 ** 64, 64), 6)}
+                interfaces.append(('qr-%06x-%02d' % (r, i), cidrs))
+            self.interfaces[router_id] = interfaces
+            self.next_hop_sets[router_id] = {}
+            for version in (4, 6):
+                self.next_hop_sets[router_id][version] = [
+                    self.next_hops(router_id, version, args.next_hops)
+                    for i in range(args.next_hop_sets)]
+            routes = []
+            for n in range(args.routes):
+                index = next(vips)
+                if args.ipv6_ratio and rng.random() < args.ipv6_ratio:
+                    vip = str(netaddr.IPAddress(VIP6_BASE + index, 6))
+                else:
+                    vip = str(netaddr.IPAddress(VIP_BASE + index))
+                routes.append(self.route(router_id, vip, args.next_hops))
+            self.routes[router_id] = routes
+
+    def next_hops(self, router_id, version, count):
+        hops = set()
+        qrs = set()
+        while len(hops) < count:
+            name, cidrs = self.rng.choice(self.interfaces[router_id])
+            hops.add(str(cidrs[version][self.rng.randint(2, 254)]))
+            qrs.add(name)
+        return hops, qrs
+
+    def route(self, router_id, vip, count):
+        version = netaddr.IPAddress(vip).version
+        next_hop_sets = self.next_hop_sets[router_id][version]
+        if next_hop_sets:
+            hops, qrs = self.rng.choice(next_hop_sets)
+        else:
+            hops, qrs = self.next_hops(router_id, version, count)
+        return {'id': str(uuid.UUID(int=self.rng.getrandbits(128))),
+                'revision': 0,
+                'router_id': router_id,
+                'vip': vip,
+                'next_hops': sorted(hops),
+                'qr_interfaces': sorted(qrs)}
+
+
+def run_backend(backend, fleet, executor, args):
+    cfg.CONF.set_override('route_programmer', backend, 'ecmp')
+    routers = dict((router_id, FakeRouterInfo('qrouter-%s' % router_id))
+                   for router_id in fleet.routes)
+    extension = BenchmarkExtension(FakeAgentApi(routers), FakePluginApi(fleet))
+    context = n_context.get_admin_context()
+    recorder = base.Recorder()
+    counters = {'execs': lambda: executor.execs,
+                'batch_lines': lambda: executor.lines}
+    routes_of_phase = {}
+
+    def phase(name, routes):
+        routes_of_phase[name] = routes_of_phase.get(name, 0) + routes
+        return recorder.measure(name, **counters)
+
+    for router_id, routes in fleet.routes.items():
+        with phase('add_router', len(routes)):
+            extension.add_router(context, {'id': router_id})
+
+    updates = {}
+    for router_id, routes in fleet.routes.items():
+        updates[router_id] = []
+        for route in routes:
+            update = fleet.route(router_id, route['vip'], args.next_hops)
+            update.update({'id': route['id'], 'revision': route['revision'] + 1})
+            added = set(update['qr_interfaces']) - set(route['qr_interfaces'])
+            removed = set(route['qr_interfaces']) - set(update['qr_interfaces'])
+            update.update({'operation': 'replace',
+                           'set_arp_proxy_qrs': sorted(added),
+                           'unset_arp_proxy_qrs': sorted(removed)})
+            updates[router_id].append(update)
+    for router_id, router_updates in updates.items():
+        for update in router_updates:
+            with phase('update', 1):
+                extension.update_ecmp_route(context, update, 'server')
+    for router_id, router_updates in updates.items():
+        with phase('update_batch', len(router_updates)):
+            extension.update_ecmp_routes(context, router_updates, 'server')
+    for router_id, router_updates in updates.items():
+        deletes = [dict(update, operation='delete', set_arp_proxy_qrs=[],
+                        unset_arp_proxy_qrs=[]) for update in router_updates]
+        with phase('delete_batch', len(deletes)):
+            extension.update_ecmp_routes(context, deletes, 'server')
+
+    results = recorder.summary()
+    for name, summary in results.items():
+        samples = recorder.samples[name]
+        total = sum(sample['time'] for sample in samples)
+        summary['total_s'] = total
+        summary['total_execs'] = sum(sample['execs'] for sample in samples)
+        summary['routes_per_second'] = routes_of_phase[name] / total if total else 0
+    return results
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--routers', type=int, default=100)
+    parser.add_argument('--routes', type=int, default=100,
+                        help='Ecmp routes per router.')
+    parser.add_argument('--interfaces', type=int, default=4,
+                        help='qr interfaces per router.')
+    parser.add_argument('--next-hops', type=int, default=8,
+                        help='Next hops per ecmp route.')
+    parser.add_argument('--next-hop-sets', type=int, default=0,
+                        help='Distinct next hop sets per router the routes '
+                             'pick theirs from, 0 for random next hops per '
+                             'route.')
+    parser.add_argument('--ipv6-ratio', type=float, default=0.0,
+                        help='Share of the vips which are IPv6.')
+    parser.add_argument('--backends',
+                        default=','.join(sorted(route_programmer.ROUTE_PROGRAMMERS)),
+                        help='Comma separated route programmer backends.')
+    parser.add_argument('--unshare', action='store_true',
+                        help='Run the commands in a real unprivileged '
+                             'network namespace.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the JSON report to a file.')
+    parser.add_argument('--baseline', help='JSON report to compare with.')
+    parser.add_argument('--threshold', type=float, default=1.25)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    cfg.CONF(args=[], project='neutron')
+    fleet = Fleet(args)
+    results = {}
+    original_ip_wrapper = ip_lib.IPWrapper
+    for backend in args.backends.split(','):
+        namespace = UnprivilegedNamespace() if args.unshare else None
+        try:
+            if namespace:
+                for interfaces in fleet.interfaces.values():
+                    for name, cidrs in interfaces:
+                        namespace.add_interface(name, [
+                            netaddr.IPNetwork((cidr[1], cidr.prefixlen), cidr.version)
+                            for cidr in cidrs.values()])
+            executor = Executor(namespace and namespace.pid)
+            ip_lib.IPWrapper = executor.ip_wrapper
+            results[backend] = run_backend(backend, fleet, executor, args)
+        finally:
+            ip_lib.IPWrapper = original_ip_wrapper
+            if namespace:
+                namespace.close()
+    return base.report(results, args.output, args.baseline, args.threshold,
+                       keys=('p50_ms', 'execs'))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
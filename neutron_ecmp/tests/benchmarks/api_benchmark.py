@@ -0,0 +1,392 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Load generator driving the ecmp_routes REST API of a neutron-server.
+
+Workers, each with its own EcmpRoutesClient of the vendored tempest, run a
+mix of create, update, delete and list requests on the routes of a router
+for --duration seconds; the routes a worker created are the ones it
+updates and deletes. Each --workers level is run in turn, so that the
+level where the throughput stops growing shows where the server
+saturates. The throughput, the latency percentiles and histogram and the
+errors of each operation are reported:
+
+    PYTHONPATH=neutron_ecmp/tests/tempest-master-acl/tempest-master \\
+    python -m neutron_ecmp.tests.benchmarks.api_benchmark \\
+        --auth-url http://keystone:5000/v3 --username admin --password secret \\
+        --project-name admin --router-id <router> \\
+        --next-hops 10.0.0.11,10.0.0.12,10.0.0.13 \\
+        --workers 1,8,32,128 --mix create=4,update=4,delete=3,list=1
+
+The next hops must be addresses of the router subnets. --endpoint sends
+the requests without a token, e.g. to a neutron-server running with
+auth_strategy = noauth, and --fake serves them from an in-memory fake
+API in this process, to measure the generator itself. The routes left
+at the end of a level are deleted unless --keep.
+
+With --baseline, the exit code is 1 when a p50 latency grew by more than
+--threshold compared to a previous report.
+"""
+
+import argparse
+import collections
+import itertools
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+
+import netaddr
+from six.moves import socketserver
+from tempest.lib import auth
+from tempest.lib.services.network import ecmp_routes_client
+from wsgiref import simple_server
+
+from neutron_ecmp.common import ecmp_metrics
+from neutron_ecmp.tests.benchmarks import base
+
+OPERATIONS = ('create', 'update', 'delete', 'list')
+
+
+class NoAuthProvider(auth.AuthProvider):
+    """Send the requests to a fixed endpoint, without a token."""
+
+    def __init__(self, endpoint, project_id):
+        self.endpoint = endpoint.rstrip('/')
+        self.project_id = project_id
+        super(NoAuthProvider, self).__init__(auth.Credentials())
+
+    @classmethod
+    def check_credentials(cls, credentials):
+        return True
+
+    def _decorate_request(self, filters, method, url, headers=None, body=None,
+                          auth_data=None):
+        headers = dict(headers or {})
+        headers['X-Project-Id'] = self.project_id
+        return '%s/%s' % (self.endpoint, url.lstrip('/')), headers, body
+
+    def _get_auth(self):
+        return None, {}
+
+    def _fill_credentials(self, auth_data_body):
+        pass
+
+    def is_expired(self, auth_data):
+        return False
+
+    def base_url(self, filters, auth_data=None):
+        return self.endpoint
+
+    def get_token(self):
+        return None
+
+
+class FakeEcmpRoutesApp(object):
+    """In-memory ecmp_routes API, answering after --fake-latency ms."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.routes = {}
+        self.lock = threading.Lock()
+
+    def _create(self, data):
+        route = dict(data, id=str(uuid.uuid4()), status='ACTIVE', revision_number=0)
+        route['effective_next_hops'] = route.get('next_hops', [])
+        self.routes[route['id']] = route
+        return route
+
+    def _handle(self, method, parts, body):
+        if len(parts) == 1:
+            if method == 'POST' and 'ecmp_routes' in body:
+                return 201, {'ecmp_routes': [self._create(data) for data in body['ecmp_routes']]}
+            if method == 'POST':
+                return 201, {'ecmp_route': self._create(body['ecmp_route'])}
+            return 200, {'ecmp_routes': list(self.routes.values())}
+        route = self.routes.get(parts[1])
+        if route is None:
+            return 404, {'NeutronError': {'type': 'EcmprouteNotFound'}}
+        if method == 'PUT':
+            route.update(body['ecmp_route'], revision_number=route['revision_number'] + 1)
+            route['effective_next_hops'] = route['next_hops']
+        elif method == 'DELETE':
+            del self.routes[parts[1]]
+            return 204, None
+        return 200, {'ecmp_route': route}
+
+    def __call__(self, environ, start_response):
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        body = json.loads(environ['wsgi.input'].read(length)) if length else {}
+        # /v2.0/ecmp_routes[/<id>]
+        parts = environ['PATH_INFO'].strip('/').split('/')[1:]
+        time.sleep(self.latency)
+        with self.lock:
+            status, data = self._handle(environ['REQUEST_METHOD'], parts, body)
+        payload = json.dumps(data).encode() if data is not None else b''
+        start_response('%d %s' % (status, {200: 'OK', 201: 'Created', 204: 'No Content',
+                                           404: 'Not Found'}[status]),
+                       [('Content-Type', 'application/json'),
+                        ('Content-Length', str(len(payload)))])
+        return [payload]
+
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, simple_server.WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(simple_server.WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+def start_fake_server(latency):
+    server = simple_server.make_server('127.0.0.1', 0, FakeEcmpRoutesApp(latency),
+                                       server_class=ThreadingWSGIServer,
+                                       handler_class=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:%d' % server.server_port
+
+
+def get_auth_provider(args, endpoint=None):
+    if endpoint:
+        return NoAuthProvider(endpoint, args.project_id)
+    credentials = auth.KeystoneV3Credentials(
+        username=args.username, password=args.password,
+        project_name=args.project_name,
+        user_domain_name=args.user_domain_name,
+        project_domain_name=args.project_domain_name)
+    return auth.KeystoneV3AuthProvider(
+        credentials, args.auth_url, disable_ssl_certificate_validation=args.insecure)
+
+
+def parse_mix(mix):
+    weights = {}
+    for item in mix.split(','):
+        operation, _, weight = item.partition('=')
+        if operation not in OPERATIONS:
+            raise ValueError('unknown operation %s' % operation)
+        weights[operation] = float(weight or 1)
+    return weights
+
+
+class VipAllocator(object):
+    """Hand out the host addresses of a prefix, from its first one."""
+
+    def __init__(self, cidr):
+        network = netaddr.IPNetwork(cidr)
+        self.addresses = (str(netaddr.IPAddress(value, network.version))
+                          for value in itertools.count(network.first + 1))
+        self.last = network.last
+        self.lock = threading.Lock()
+
+    def allocate(self):
+        with self.lock:
+            vip = next(self.addresses)
+        if int(netaddr.IPAddress(vip)) >= self.last:
+            raise RuntimeError('the vip prefix is exhausted')
+        return vip
+
+
+class Worker(threading.Thread):
+
+    def __init__(self, client, args, vips, deadline, seed):
+        super(Worker, self).__init__()
+        self.daemon = True
+        self.client = client
+        self.args = args
+        self.vips = vips
+        self.deadline = deadline
+        self.rng = random.Random(seed)
+        self.weights = sorted(parse_mix(args.mix).items())
+        self.route_ids = []
+        self.samples = collections.defaultdict(list)
+        self.errors = collections.defaultdict(collections.Counter)
+
+    def _next_hops(self):
+        count = min(self.args.next_hops_per_route, len(self.args.next_hops))
+        return sorted(self.rng.sample(self.args.next_hops, count))
+
+    def _choose(self):
+        pick = self.rng.uniform(0, sum(weight for _, weight in self.weights))
+        for operation, weight in self.weights:
+            pick -= weight
+            if pick <= 0:
+                break
+        if operation in ('update', 'delete') and not self.route_ids:
+            return 'create'
+        return operation
+
+    def create(self):
+        route = {'router_id': self.args.router_id,
+                 'vip': self.vips.allocate(),
+                 'next_hops': self._next_hops()}
+        if self.args.project_id:
+            route['tenant_id'] = self.args.project_id
+        body = self.client.create_ecmp_route(**route)
+        self.route_ids.append(body['ecmp_route']['id'])
+
+    def update(self):
+        self.client.update_ecmp_route(self.rng.choice(self.route_ids),
+                                      next_hops=self._next_hops())
+
+    def delete(self):
+        route_id = self.route_ids.pop(self.rng.randrange(len(self.route_ids)))
+        self.client.delete_ecmp_route(route_id)
+
+    def list(self):
+        self.client.list_ecmp_routes(router_id=self.args.router_id, fields='id')
+
+    def run(self):
+        while time.time() < self.deadline:
+            operation = self._choose()
+            start = time.time()
+            try:
+                getattr(self, operation)()
+            except Exception as e:
+                self.errors[operation][type(e).__name__] += 1
+                continue
+            self.samples[operation].append(time.time() - start)
+
+    def cleanup(self):
+        for route_id in self.route_ids:
+            try:
+                self.client.delete_ecmp_route(route_id)
+            except Exception:
+                pass
+        self.route_ids = []
+
+
+def summarize(samples, errors, duration):
+    times = sorted(samples)
+    histogram = ecmp_metrics.Histogram()
+    for seconds in times:
+        histogram.add(seconds)
+    summary = {'count': len(times),
+               'errors': dict(errors),
+               'ops_per_s': len(times) / duration,
+               'histogram': histogram.to_list()}
+    if times:
+        summary.update({'p50_ms': base.percentile(times, 50) * 1000,
+                        'p90_ms': base.percentile(times, 90) * 1000,
+                        'p99_ms': base.percentile(times, 99) * 1000,
+                        'max_ms': times[-1] * 1000})
+    return summary
+
+
+def run_level(workers, args, vips, endpoint):
+    deadline = time.time() + args.duration
+    threads = [Worker(ecmp_routes_client.EcmpRoutesClient(
+        get_auth_provider(args, endpoint), 'network', args.region,
+        endpoint_type=args.endpoint_type,
+        disable_ssl_certificate_validation=args.insecure),
+        args, vips, deadline, args.seed + i) for i in range(workers)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.time() - started
+    results = {}
+    for operation in OPERATIONS:
+        errors = collections.Counter()
+        for thread in threads:
+            errors.update(thread.errors[operation])
+        results[operation] = summarize(
+            [seconds for thread in threads for seconds in thread.samples[operation]],
+            errors, duration)
+    errors = collections.Counter()
+    for thread in threads:
+        for counter in thread.errors.values():
+            errors.update(counter)
+    results['total'] = summarize(
+        [seconds for thread in threads for samples in thread.samples.values()
+         for seconds in samples], errors, duration)
+    if not args.keep:
+        for thread in threads:
+            thread.cleanup()
+    return results
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', default='1,4,16,64',
+                        help='Comma separated numbers of concurrent workers.')
+    parser.add_argument('--duration', type=float, default=30,
+                        help='Seconds each number of workers runs.')
+    parser.add_argument('--mix', default='create=4,update=4,delete=3,list=1',
+                        help='Relative weights of the operations.')
+    parser.add_argument('--router-id', default=str(uuid.uuid4()))
+    parser.add_argument('--next-hops', type=lambda value: value.split(','),
+                        default=['10.0.0.%d' % i for i in range(11, 19)])
+    parser.add_argument('--next-hops-per-route', type=int, default=4)
+    parser.add_argument('--vip-cidr', default='172.16.0.0/12',
+                        help='Prefix the vips of the created routes are taken from.')
+    parser.add_argument('--keep', action='store_true',
+                        help='Keep the routes created by the workers.')
+    parser.add_argument('--auth-url')
+    parser.add_argument('--username')
+    parser.add_argument('--password')
+    parser.add_argument('--project-name')
+    parser.add_argument('--project-id', default='',
+                        help='Project of the created routes, for --endpoint.')
+    parser.add_argument('--user-domain-name', default='Default')
+    parser.add_argument('--project-domain-name', default='Default')
+    parser.add_argument('--region', default='RegionOne')
+    parser.add_argument('--endpoint-type', default='publicURL')
+    parser.add_argument('--insecure', action='store_true')
+    parser.add_argument('--endpoint',
+                        help='URL of a neutron-server to send the requests to without a token.')
+    parser.add_argument('--fake', action='store_true',
+                        help='Send the requests to an in-memory fake API.')
+    parser.add_argument('--fake-latency', type=float, default=0.0,
+                        help='Milliseconds the fake API waits before answering.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the JSON report to a file.')
+    parser.add_argument('--baseline', help='JSON report to compare with.')
+    parser.add_argument('--threshold', type=float, default=1.25)
+    args = parser.parse_args(argv)
+    parse_mix(args.mix)
+    if not (args.fake or args.endpoint or args.auth_url):
+        parser.error('one of --auth-url, --endpoint or --fake is required')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    server = None
+    endpoint = args.endpoint
+    if args.fake:
+        server, endpoint = start_fake_server(args.fake_latency / 1000.0)
+    vips = VipAllocator(args.vip_cidr)
+    results = {}
+    try:
+        for workers in [int(value) for value in args.workers.split(',')]:
+            results['workers=%d' % workers] = run_level(workers, args, vips, endpoint)
+            sys.stderr.write('%d workers: %.1f ops/s\n' % (
+                workers, results['workers=%d' % workers]['total']['ops_per_s']))
+    finally:
+        if server:
+            server.shutdown()
+    results['histogram_buckets'] = {'seconds': list(ecmp_metrics.BUCKETS)}
+    return base.report(results, args.output, args.baseline, args.threshold)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Helpers shared by the ecmp benchmarks."""
+
+import collections
+import contextlib
+import json
+import sys
+import time
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return 0.0
+    index = int(round(pct / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+class Recorder(object):
+    """Collect samples of named operations.
+
+    Each sample has a wall time and any number of named counters, e.g. the
+    number of DB queries or of executed commands of the operation.
+    """
+    def __init__(self):
+        self.samples = collections.defaultdict(list)
+
+    @contextlib.contextmanager
+    def measure(self, operation, **counters):
+        """Time the block; counters are callables sampled around it."""
+        before = dict((name, read()) for name, read in counters.items())
+        start = time.time()
+        yield
+        elapsed = time.time() - start
+        sample = {'time': elapsed}
+        for name, read in counters.items():
+            sample[name] = read() - before[name]
+        self.samples[operation].append(sample)
+
+    def summary(self):
+        result = {}
+        for operation, samples in sorted(self.samples.items()):
+            times = sorted(sample['time'] for sample in samples)
+            summary = {'count': len(samples),
+                       'p50_ms': percentile(times, 50) * 1000,
+                       'p90_ms': percentile(times, 90) * 1000,
+                       'p99_ms': percentile(times, 99) * 1000,
+                       'max_ms': times[-1] * 1000}
+            for name in samples[0]:
+                if name != 'time':
+                    summary[name] = (sum(sample[name] for sample in samples) /
+                                     float(len(samples)))
+            result[operation] = summary
+        return result
+
+
+def find_regressions(results, baseline, threshold, keys=('p50_ms',)):
+    """Compare two reports, return a line per value grown over threshold."""
+    regressions = []
+    for scale, operations in sorted(results.items()):
+        for operation, summary in sorted(operations.items()):
+            old = baseline.get(scale, {}).get(operation)
+            if not old:
+                continue
+            for key in keys:
+                if key in old and old[key] and summary.get(key, 0) > old[key] * threshold:
+                    regressions.append('%s %s %s: %.3f -> %.3f' % (
+                        scale, operation, key, old[key], summary[key]))
+    return regressions
+
+
+def report(results, output=None, baseline=None, threshold=1.25, keys=('p50_ms',)):
+    """Print or write the results, return 1 if they regressed the baseline."""
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        sys.stdout.write(text + '\n')
+    if not baseline:
+        return 0
+    with open(baseline) as f:
+        regressions = find_regressions(results, json.load(f), threshold, keys)
+    for regression in regressions:
+        sys.stderr.write('regression: %s\n' % regression)
+    return 1 if regressions else 0
@@ -0,0 +1,156 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Benchmark of the memory the l3 agent extension holds per ecmp route.
+
+The routes of a synthetic fleet of routers are decoded from the JSON the
+plugin sends them as, and kept the way the agent keeps them. For each
+representation, the memory it retains is measured with tracemalloc, and
+reported per route and in megabytes per 100k routes:
+
+    python -m neutron_ecmp.tests.benchmarks.cache_benchmark \\
+        --routers 1000 --routes 100 --next-hop-sets 4
+
+"dicts" is the former cache of the agent, a dict per route and a dict of
+revisions per router; "compact" is the route_cache of the agent;
+"compiler" is the route compiler of each router, with its compiled
+prefixes.
+"""
+
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+from oslo_config import cfg
+
+from neutron_ecmp.agents.ecmp.l3 import route_cache
+from neutron_ecmp.agents.ecmp.l3 import route_compiler
+from neutron_ecmp.agents.ecmp.l3 import snapshot
+from neutron_ecmp.common import ecmp_digest
+from neutron_ecmp.tests.benchmarks import agent_benchmark
+from neutron_ecmp.tests.benchmarks import base
+
+
+def make_dict_route(ecmproute):
+    return dict((key, ecmproute.get(key)) for key in snapshot.ROUTE_KEYS)
+
+
+def build_dicts(payloads):
+    routes_of_router = {}
+    revisions_of_router = {}
+    for router_id, payload in payloads.items():
+        routes = json.loads(payload)
+        routes_of_router[router_id] = dict(
+            (route['vip'], make_dict_route(route)) for route in routes)
+        revisions_of_router[router_id] = dict(
+            (route['id'], route['revision']) for route in routes)
+    return routes_of_router, revisions_of_router
+
+
+def build_compact(payloads):
+    cache = route_cache.RouteCache()
+    return cache, dict((router_id, cache.new_table(json.loads(payload)))
+                       for router_id, payload in payloads.items())
+
+
+def build_compilers(payloads):
+    compilers = {}
+    for router_id, payload in payloads.items():
+        compiler = route_compiler.RouteCompiler(aggregate=True)
+        for route in json.loads(payload):
+            compiler.set_route(route['vip'], route['next_hops'])
+        compiler.set_programmed(compiler.compile())
+        compilers[router_id] = compiler
+    return compilers
+
+
+REPRESENTATIONS = {
+    'dicts': build_dicts,
+    'compact': build_compact,
+    'compiler': build_compilers,
+}
+
+
+def measure(build, payloads):
+    """Return what build retains from payloads, its size and duration."""
+    gc.collect()
+    tracemalloc.start()
+    start = time.time()
+    state = build(payloads)
+    elapsed = time.time() - start
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return state, size, elapsed
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--routers', type=int, default=1000)
+    parser.add_argument('--routes', type=int, default=100,
+                        help='Ecmp routes per router.')
+    parser.add_argument('--interfaces', type=int, default=4,
+                        help='qr interfaces per router.')
+    parser.add_argument('--next-hops', type=int, default=8,
+                        help='Next hops per ecmp route.')
+    parser.add_argument('--next-hop-sets', type=int, default=4,
+                        help='Distinct next hop sets per router the routes '
+                             'pick theirs from, 0 for random next hops per '
+                             'route.')
+    parser.add_argument('--ipv6-ratio', type=float, default=0.0,
+                        help='Share of the vips which are IPv6.')
+    parser.add_argument('--representations',
+                        default=','.join(sorted(REPRESENTATIONS)),
+                        help='Comma separated representations to measure.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the JSON report to a file.')
+    parser.add_argument('--baseline', help='JSON report to compare with.')
+    parser.add_argument('--threshold', type=float, default=1.25)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    cfg.CONF(args=[], project='neutron')
+    fleet = agent_benchmark.Fleet(args)
+    payloads = dict((router_id, json.dumps(routes))
+                    for router_id, routes in fleet.routes.items())
+    count = sum(len(routes) for routes in fleet.routes.values())
+    results = {}
+    for name in args.representations.split(','):
+        state, size, elapsed = measure(REPRESENTATIONS[name], payloads)
+        results[name] = {'routes': count,
+                         'bytes': size,
+                         'bytes_per_route': size / float(count),
+                         'mb_per_100k_routes': size * 100000.0 / count / 2 ** 20,
+                         'load_s': elapsed}
+        if name == 'compact':
+            cache, tables = state
+            results[name]['next_hop_groups'] = len(cache.next_hops)
+            results[name]['interface_groups'] = len(cache.interfaces)
+            results[name]['digests_match'] = all(
+                ecmp_digest.get_routes_digest(tables[router_id].get_routes()) ==
+                ecmp_digest.get_routes_digest(routes)
+                for router_id, routes in fleet.routes.items())
+        del state
+    return base.report({'memory': results}, args.output, args.baseline, args.threshold,
+                       keys=('mb_per_100k_routes',))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
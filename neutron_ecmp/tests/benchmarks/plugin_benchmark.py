@@ -0,0 +1,357 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Offline benchmark of the ecmp service plugin control plane.
+
+EcmpPlugin runs against an in-memory SQLite database, a fake core plugin
+serving synthetic router interface ports and subnets, a fake l3 plugin
+returning synthetic hosting hosts and an agent RPC client which only
+records its casts. For each scale, i.e. total number of ecmp routes, the
+latency percentiles and the DB queries of create, update, delete, list,
+get_route_of_router, of its "not modified" answer and of the notification
+dispatcher are reported:
+
+    python -m neutron_ecmp.tests.benchmarks.plugin_benchmark \\
+        --scales 10,1000,100000 --output plugin.json --baseline old.json
+
+--driver selects the realization driver: the batching or the per-request
+agent RPC driver, or the no-op driver to measure the plugin alone.
+
+With --baseline, the exit code is 1 when a p50 latency grew by more than
+--threshold compared to a previous report.
+"""
+
+import argparse
+import itertools
+import random
+import sys
+import uuid
+
+import netaddr
+from neutron.db.models import l3 as l3_models  # noqa
+from neutron.db import standard_attr
+from neutron_lib import context as n_context
+from neutron_lib.db import api as lib_db_api
+from neutron_lib.db import model_base
+from neutron_lib.plugins import constants as plugin_constants
+from neutron_lib.plugins import directory
+from oslo_config import cfg
+from oslo_db import options as db_options
+from oslo_utils import timeutils
+from sqlalchemy import event
+
+from neutron_ecmp.common import ecmp_cache
+from neutron_ecmp.db.ecmp import ecmp_db
+from neutron_ecmp.services.ecmp.drivers import agent
+from neutron_ecmp.services.ecmp.drivers import base as drivers_base
+from neutron_ecmp.services.ecmp import ecmp_plugin
+from neutron_ecmp.tests.benchmarks import base
+
+TENANT_ID = 'bench-tenant'
+DVR_INTERFACE = 'network:router_interface_distributed'
+VIP_BASE = int(netaddr.IPAddress('172.16.0.0'))
+SUBNET_BASE = int(netaddr.IPAddress('10.0.0.0'))
+
+
+def _uuid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128)))
+
+
+class FakeCorePlugin(object):
+    """Serve the router interface ports and subnets of a synthetic topology.
+
+    Router r gets `interfaces` /24 subnets, each on its own qr port.
+    """
+    def __init__(self, routers, interfaces, rng):
+        self.ports = {}
+        self.subnets = {}
+        self.calls = 0
+        index = itertools.count()
+        for router_id in routers:
+            ports = []
+            for i in range(interfaces):
+                cidr = netaddr.IPNetwork((SUBNET_BASE + next(index) * 256, 24))
+                subnet = {'id': _uuid(rng), 'cidr': str(cidr)}
+                self.subnets[subnet['id']] = subnet
+                ports.append({'id': _uuid(rng),
+                              'device_id': router_id,
+                              'device_owner': DVR_INTERFACE,
+                              'fixed_ips': [{'subnet_id': subnet['id'],
+                                             'ip_address': str(cidr[1])}]})
+            self.ports[router_id] = ports
+
+    def get_ports(self, context, filters=None, fields=None):
+        self.calls += 1
+        ports = []
+        for router_id in (filters or {}).get('device_id', self.ports):
+            ports.extend(self.ports.get(router_id, []))
+        return ports
+
+    def get_subnet(self, context, id, fields=None):
+        self.calls += 1
+        return self.subnets[id]
+
+    def subnet_hosts(self, router_id):
+        """Return, per interface subnet of the router, its usable ips."""
+        result = []
+        for port in self.ports[router_id]:
+            cidr = netaddr.IPNetwork(
+                self.subnets[port['fixed_ips'][0]['subnet_id']]['cidr'])
+            result.append([str(ip) for ip in cidr.iter_hosts()][1:])
+        return result
+
+
+class FakeL3Plugin(object):
+    def __init__(self, hosts):
+        self.hosts = ['host-%d' % i for i in range(hosts)]
+
+    def get_hosts_to_notify(self, context, router_id):
+        return self.hosts
+
+
+class RecordingAgentApi(object):
+    """Agent RPC client which records the casts instead of sending them."""
+    def __init__(self):
+        self.casts = 0
+        self.routes = 0
+
+    def update_ecmp_route(self, context, ecmproute, host=None):
+        self.casts += 1
+        self.routes += 1
+
+    def update_ecmp_routes(self, context, ecmproutes, host=None):
+        self.casts += 1
+        self.routes += len(ecmproutes)
+
+
+DRIVERS = {
+    'batching': agent.BatchingAgentRpcDriver,
+    'agent': agent.AgentRpcDriver,
+    'noop': drivers_base.NoopDriver,
+}
+
+
+class BenchmarkEcmpPlugin(ecmp_plugin.EcmpPlugin):
+    """EcmpPlugin without RPC consumers, workers and callbacks."""
+    def __init__(self, driver, agent_rpc):
+        self._router_subnets = ecmp_cache.GenerationCache(cfg.CONF.ecmp.router_cache_size)
+        self._route_responses = ecmp_cache.GenerationCache(cfg.CONF.ecmp.route_response_cache_size)
+        if driver == 'noop':
+            self.driver = DRIVERS[driver](self)
+        else:
+            self.driver = DRIVERS[driver](self, agent_rpc=agent_rpc)
+
+
+class QueryCounter(object):
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args, **kwargs):
+        self.count += 1
+
+
+def setup_database():
+    db_options.set_defaults(cfg.CONF, connection='sqlite://')
+    cfg.CONF(args=[], project='neutron')
+    engine = lib_db_api.get_context_manager().writer.get_engine()
+    model_base.BASEV2.metadata.create_all(engine, tables=[
+        standard_attr.StandardAttribute.__table__,
+        ecmp_db.EcmpRoute.__table__,
+        ecmp_db.EcmpRouteHost.__table__,
+        ecmp_db.EcmpRoutePool.__table__,
+        ecmp_db.EcmpWithdrawnNextHop.__table__,
+        ecmp_db.EcmpNotification.__table__,
+        ecmp_db.EcmpNotificationLease.__table__,
+        ecmp_db.EcmpNextHopRefcount.__table__,
+        ecmp_db.EcmpQrPortRefcount.__table__,
+        ecmp_db.EcmpRouterGeneration.__table__])
+    return engine
+
+
+def clear_database(context):
+    with context.session.begin():
+        for model in (ecmp_db.EcmpRouteHost, ecmp_db.EcmpRoutePool,
+                      ecmp_db.EcmpWithdrawnNextHop, ecmp_db.EcmpRoute,
+                      standard_attr.StandardAttribute,
+                      ecmp_db.EcmpNotification, ecmp_db.EcmpNotificationLease,
+                      ecmp_db.EcmpNextHopRefcount,
+                      ecmp_db.EcmpQrPortRefcount,
+                      ecmp_db.EcmpRouterGeneration):
+            context.session.query(model).delete()
+
+
+class PluginBenchmark(object):
+
+    def __init__(self, args, engine):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.queries = QueryCounter(engine)
+        self.context = n_context.get_admin_context()
+        self.vips = itertools.count()
+
+    def _vip(self):
+        return str(netaddr.IPAddress(VIP_BASE + next(self.vips)))
+
+    def _next_hops(self, router_id):
+        subnets = self.rng.sample(self.subnet_hosts[router_id],
+                                  min(self.args.interfaces, self.args.next_hops))
+        next_hops = set()
+        while len(next_hops) < self.args.next_hops:
+            next_hops.add(self.rng.choice(self.rng.choice(subnets)))
+        return sorted(next_hops)
+
+    def _body(self, router_id):
+        return {'ecmp_route': {'tenant_id': TENANT_ID,
+                               'vip': self._vip(),
+                               'router_id': router_id,
+                               'next_hops': self._next_hops(router_id)}}
+
+    def populate(self, scale):
+        """Bulk load scale routes over the routers, then the refcounts."""
+        routers = [_uuid(self.rng) for i in range(self.args.routers)]
+        self.core_plugin = FakeCorePlugin(routers, self.args.interfaces, self.rng)
+        self.subnet_hosts = dict(
+            (router_id, self.core_plugin.subnet_hosts(router_id))
+            for router_id in routers)
+        directory.add_plugin(plugin_constants.CORE, self.core_plugin)
+        directory.add_plugin(plugin_constants.L3, FakeL3Plugin(self.args.hosts))
+        self.agent_rpc = RecordingAgentApi()
+        self.plugin = BenchmarkEcmpPlugin(self.args.driver, self.agent_rpc)
+
+        clear_database(self.context)
+        rows = []
+        attr_rows = []
+        now = timeutils.utcnow()
+        for i in range(scale):
+            router_id = routers[i % len(routers)]
+            attr_rows.append({'id': i + 1,
+                              'resource_type': ecmp_db.EcmpRoute.__tablename__,
+                              'revision_number': 0,
+                              'created_at': now})
+            rows.append({'id': _uuid(self.rng),
+                         'project_id': TENANT_ID,
+                         'vip': self._vip(),
+                         'next_hops': ','.join(self._next_hops(router_id)),
+                         'router_id': router_id,
+                         'standard_attr_id': i + 1})
+        with self.context.session.begin():
+            self.context.session.bulk_insert_mappings(
+                standard_attr.StandardAttribute, attr_rows)
+            self.context.session.bulk_insert_mappings(ecmp_db.EcmpRoute, rows)
+            self.context.session.bulk_insert_mappings(ecmp_db.EcmpRouterGeneration, [
+                {'router_id': router_id, 'route_generation': 1, 'interface_generation': 1}
+                for router_id in routers])
+            for router_id in routers:
+                router_subnet = self.plugin._get_router_gw_port_with_cidr(
+                    self.context, router_id)
+                self.plugin._ensure_qr_port_refcounts(
+                    self.context, router_id, router_subnet)
+        self.routers = routers
+        self.route_ids = [row['id'] for row in rows]
+
+    def _measure(self, recorder, operation):
+        return recorder.measure(operation,
+                                queries=lambda: self.queries.count,
+                                core_calls=lambda: self.core_plugin.calls,
+                                casts=lambda: self.agent_rpc.casts)
+
+    def run(self, scale):
+        self.populate(scale)
+        recorder = base.Recorder()
+        plugin, context = self.plugin, self.context
+        created = []
+        for i in range(self.args.samples):
+            body = self._body(self.rng.choice(self.routers))
+            with self._measure(recorder, 'create'):
+                created.append(plugin.create_ecmp_route(context, body))
+        with self._measure(recorder, 'dispatch'):
+            plugin._dispatch_ecmp_notifications()
+
+        for route in created:
+            next_hops = list(route['next_hops'])
+            next_hops[-1] = self._next_hops(route['router_id'])[0]
+            body = {'ecmp_route': {'next_hops': sorted(set(next_hops))}}
+            with self._measure(recorder, 'update'):
+                plugin.update_ecmp_route(context, route['id'], body)
+        with self._measure(recorder, 'dispatch'):
+            plugin._dispatch_ecmp_notifications()
+
+        for i in range(self.args.samples):
+            router_id = self.rng.choice(self.routers)
+            with self._measure(recorder, 'list_of_router'):
+                plugin.get_ecmp_routes(context, filters={'router_id': [router_id]})
+            with self._measure(recorder, 'get_route_of_router'):
+                plugin.get_route_of_router(context, router_id, 'host-0')
+            revision = plugin.get_route_of_router_if_changed(context, router_id, 'host-0')['revision']
+            with self._measure(recorder, 'get_route_of_router_not_modified'):
+                plugin.get_route_of_router_if_changed(context, router_id, 'host-0', revision)
+            with self._measure(recorder, 'get'):
+                plugin.get_ecmp_route(context, self.rng.choice(self.route_ids))
+            # paid by every port event of the cloud
+            port = {'id': _uuid(self.rng), 'device_owner': 'compute:nova',
+                    'fixed_ips': [], 'tags': ['web']}
+            with self._measure(recorder, 'port_event'):
+                plugin.update_ecmp_pools(context, port, original_port=port)
+
+        for route in created:
+            with self._measure(recorder, 'delete'):
+                plugin.delete_ecmp_route(context, route['id'])
+        with self._measure(recorder, 'dispatch'):
+            plugin._dispatch_ecmp_notifications()
+
+        if scale <= self.args.max_list_scale:
+            for i in range(min(self.args.samples, 10)):
+                with self._measure(recorder, 'list_all'):
+                    plugin.get_ecmp_routes(context)
+        return recorder.summary()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', default='10,100,1000,10000,100000',
+                        help='Comma separated total numbers of ecmp routes.')
+    parser.add_argument('--routers', type=int, default=10)
+    parser.add_argument('--interfaces', type=int, default=4,
+                        help='Router interfaces (qr ports) per router.')
+    parser.add_argument('--next-hops', type=int, default=8,
+                        help='Next hops per ecmp route.')
+    parser.add_argument('--hosts', type=int, default=3,
+                        help='Hosts of each router to notify.')
+    parser.add_argument('--samples', type=int, default=100,
+                        help='Measured operations of each kind per scale.')
+    parser.add_argument('--max-list-scale', type=int, default=10000,
+                        help='Largest scale at which all routes are listed.')
+    parser.add_argument('--driver', default='batching', choices=sorted(DRIVERS),
+                        help='Driver realizing the ecmp routes.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the JSON report to a file.')
+    parser.add_argument('--baseline', help='JSON report to compare with.')
+    parser.add_argument('--threshold', type=float, default=1.25)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    benchmark = PluginBenchmark(args, setup_database())
+    results = {}
+    for scale in [int(scale) for scale in args.scales.split(',')]:
+        results[str(scale)] = benchmark.run(scale)
+    return base.report(results, args.output, args.baseline, args.threshold,
+                       keys=('p50_ms', 'queries'))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -85,6 +85,7 @@ class BaseNetworkTest(tempest.test.BaseTestCase):
         cls.service_providers_client = cls.os_primary.service_providers_client
         cls.tags_client = cls.os_primary.tags_client
         cls.acls_client = cls.os_primary.acls_client
+        cls.ecmp_routes_client = cls.os_primary.ecmp_routes_client
 
     @classmethod
     def resource_setup(cls):
@@ -238,3 +239,4 @@ class BaseAdminNetworkTest(BaseNetworkTest):
         cls.admin_metering_labels_client = cls.os_admin.metering_labels_client
         cls.admin_metering_label_rules_client = (
             cls.os_admin.metering_label_rules_client)
+        cls.admin_ecmp_routes_client = cls.os_admin.ecmp_routes_client
@@ -0,0 +1,177 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import itertools
+import time
+
+import netaddr
+from oslo_log import log
+
+from tempest.api.network import base
+from tempest.common import utils
+from tempest import config
+from tempest.lib.common.utils import data_utils
+from tempest.lib.common.utils import test_utils
+from tempest.lib import decorators
+
+CONF = config.CONF
+LOG = log.getLogger(__name__)
+
+
+class EcmpRoutesTest(base.BaseAdminNetworkTest):
+    """Tests the ecmp_routes API on one distributed router.
+
+    The sizes come from the [ecmp] section: next_hops per route, vips
+    created with bulk requests of bulk_size routes, churn_rounds changes
+    of their next hops. The timings are logged.
+    """
+
+    @classmethod
+    def skip_checks(cls):
+        super(EcmpRoutesTest, cls).skip_checks()
+        if not utils.is_extension_enabled('ecmp', 'network'):
+            raise cls.skipException("ecmp extension not enabled.")
+
+    @classmethod
+    def resource_setup(cls):
+        super(EcmpRoutesTest, cls).resource_setup()
+        cls.network = cls.create_network()
+        cls.subnet = cls.create_subnet(cls.network)
+        # next hops are taken from the subnets of distributed interfaces,
+        # only an admin creates distributed routers
+        body = cls.os_admin.routers_client.create_router(
+            name=data_utils.rand_name(cls.__name__ + '-router'),
+            tenant_id=cls.networks_client.tenant_id, distributed=True)
+        cls.router = body['router']
+        cls.addClassResourceCleanup(test_utils.call_and_ignore_notfound_exc,
+                                    cls.delete_router, cls.router)
+        cls.create_router_interface(cls.router['id'], cls.subnet['id'])
+        hosts = netaddr.IPNetwork(cls.subnet['cidr']).iter_hosts()
+        cls.next_hops = [str(ip) for ip in
+                         itertools.islice(hosts, 10, 10 + CONF.ecmp.next_hops)]
+        cls.vip_network = netaddr.IPNetwork(CONF.ecmp.vip_cidr)
+        cls.vip_index = itertools.count(1)
+
+    def _vip(self):
+        return str(self.vip_network[next(self.vip_index)])
+
+    def _create_ecmp_route(self, next_hops, **kwargs):
+        body = self.ecmp_routes_client.create_ecmp_route(
+            router_id=self.router['id'], vip=self._vip(),
+            next_hops=next_hops, **kwargs)
+        ecmp_route = body['ecmp_route']
+        self.addCleanup(test_utils.call_and_ignore_notfound_exc,
+                        self.ecmp_routes_client.delete_ecmp_route,
+                        ecmp_route['id'])
+        return ecmp_route
+
+    def _create_ecmp_routes(self, count, next_hops):
+        """Create count routes with bulk requests of bulk_size routes.
+
+        A bulk_size of 1 creates the routes one at a time.
+        """
+        ecmp_routes = []
+        while len(ecmp_routes) < count:
+            size = min(CONF.ecmp.bulk_size, count - len(ecmp_routes))
+            if size <= 1:
+                ecmp_routes.append(self._create_ecmp_route(next_hops))
+                continue
+            body = self.ecmp_routes_client.create_ecmp_routes([
+                {'router_id': self.router['id'], 'vip': self._vip(),
+                 'next_hops': next_hops} for _ in range(size)])
+            for ecmp_route in body['ecmp_routes']:
+                self.addCleanup(test_utils.call_and_ignore_notfound_exc,
+                                self.ecmp_routes_client.delete_ecmp_route,
+                                ecmp_route['id'])
+            ecmp_routes.extend(body['ecmp_routes'])
+        return ecmp_routes
+
+    def _list_router_ecmp_routes(self):
+        body = self.ecmp_routes_client.list_ecmp_routes(
+            router_id=self.router['id'])
+        return dict((r['id'], r) for r in body['ecmp_routes'])
+
+    @decorators.idempotent_id('0a7fe89a-28d0-4477-8d53-fd3dbf01144d')
+    def test_create_list_update_show_delete_ecmp_route(self):
+        ecmp_route = self._create_ecmp_route(self.next_hops)
+        self.assertEqual(self.router['id'], ecmp_route['router_id'])
+        self.assertEqual(sorted(self.next_hops),
+                         sorted(ecmp_route['next_hops']))
+
+        # List ecmp routes and verify if created ecmp route is there
+        self.assertIn(ecmp_route['id'], self._list_router_ecmp_routes())
+
+        # Update the next hops of the route and verify if they are updated
+        next_hops = self.next_hops[:-1]
+        body = self.ecmp_routes_client.update_ecmp_route(
+            ecmp_route['id'], next_hops=next_hops)
+        updated = body['ecmp_route']
+        self.assertEqual(sorted(next_hops), sorted(updated['next_hops']))
+        self.assertGreater(updated['revision_number'],
+                           ecmp_route['revision_number'])
+
+        # Show the ecmp route and verify its details
+        body = self.ecmp_routes_client.show_ecmp_route(ecmp_route['id'])
+        shown = body['ecmp_route']
+        self.assertEqual(ecmp_route['vip'], shown['vip'])
+        self.assertEqual(sorted(next_hops), sorted(shown['next_hops']))
+        self.assertEqual(updated['revision_number'],
+                         shown['revision_number'])
+
+        # Delete the ecmp route and verify it is not listed any more
+        self.ecmp_routes_client.delete_ecmp_route(ecmp_route['id'])
+        self.assertNotIn(ecmp_route['id'], self._list_router_ecmp_routes())
+
+    @decorators.idempotent_id('66691ca5-2be6-413d-9e7f-27ed75297441')
+    def test_bulk_create_ecmp_routes(self):
+        start = time.time()
+        ecmp_routes = self._create_ecmp_routes(CONF.ecmp.vips, self.next_hops)
+        created = time.time() - start
+        self.assertEqual(CONF.ecmp.vips, len(ecmp_routes))
+        self.assertEqual(CONF.ecmp.vips,
+                         len(set(r['vip'] for r in ecmp_routes)))
+
+        start = time.time()
+        listed = self._list_router_ecmp_routes()
+        LOG.info('ecmp: created %d routes in %.2fs, listed them in %.2fs',
+                 len(ecmp_routes), created, time.time() - start)
+        for ecmp_route in ecmp_routes:
+            self.assertIn(ecmp_route['id'], listed)
+            self.assertEqual(sorted(self.next_hops),
+                             sorted(listed[ecmp_route['id']]['next_hops']))
+
+    @decorators.idempotent_id('f678ac6b-fbd3-4a4f-91d0-375a222767ec')
+    def test_ecmp_routes_next_hop_churn(self):
+        ecmp_routes = self._create_ecmp_routes(CONF.ecmp.vips, self.next_hops)
+        revisions = dict((r['id'], r['revision_number']) for r in ecmp_routes)
+        for i in range(CONF.ecmp.churn_rounds):
+            # each round leaves out another next hop
+            next_hops = [ip for j, ip in enumerate(self.next_hops)
+                         if j != i % len(self.next_hops)]
+            start = time.time()
+            for ecmp_route in ecmp_routes:
+                self.ecmp_routes_client.update_ecmp_route(
+                    ecmp_route['id'], next_hops=next_hops)
+            LOG.info('ecmp: churn round %d updated %d routes in %.2fs',
+                     i, len(ecmp_routes), time.time() - start)
+
+            listed = self._list_router_ecmp_routes()
+            for ecmp_route in ecmp_routes:
+                current = listed[ecmp_route['id']]
+                self.assertEqual(sorted(next_hops),
+                                 sorted(current['next_hops']))
+                self.assertGreater(current['revision_number'],
+                                   revisions[ecmp_route['id']])
+                revisions[ecmp_route['id']] = current['revision_number']
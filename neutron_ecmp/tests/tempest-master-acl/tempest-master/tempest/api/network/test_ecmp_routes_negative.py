@@ -0,0 +1,82 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import netaddr
+
+from tempest.api.network import base
+from tempest.common import utils
+from tempest import config
+from tempest.lib.common.utils import data_utils
+from tempest.lib.common.utils import test_utils
+from tempest.lib import decorators
+from tempest.lib import exceptions as lib_exc
+
+CONF = config.CONF
+
+
+class NegativeEcmpRoutesTest(base.BaseAdminNetworkTest):
+
+    @classmethod
+    def skip_checks(cls):
+        super(NegativeEcmpRoutesTest, cls).skip_checks()
+        if not utils.is_extension_enabled('ecmp', 'network'):
+            raise cls.skipException("ecmp extension not enabled.")
+
+    @classmethod
+    def resource_setup(cls):
+        super(NegativeEcmpRoutesTest, cls).resource_setup()
+        cls.network = cls.create_network()
+        cls.subnet = cls.create_subnet(cls.network)
+        body = cls.os_admin.routers_client.create_router(
+            name=data_utils.rand_name(cls.__name__ + '-router'),
+            tenant_id=cls.networks_client.tenant_id, distributed=True)
+        cls.router = body['router']
+        cls.addClassResourceCleanup(test_utils.call_and_ignore_notfound_exc,
+                                    cls.delete_router, cls.router)
+        cls.create_router_interface(cls.router['id'], cls.subnet['id'])
+        cls.next_hop = str(netaddr.IPNetwork(cls.subnet['cidr'])[10])
+        cls.vip_network = netaddr.IPNetwork(CONF.ecmp.vip_cidr)
+
+    @decorators.attr(type=['negative'])
+    @decorators.idempotent_id('c55bb382-9669-4893-9bce-253bc8e43c5c')
+    def test_create_ecmp_route_next_hop_outside_router_subnets(self):
+        # the vip prefix is not a subnet of the router
+        next_hop = str(self.vip_network[-2])
+        self.assertRaises(lib_exc.BadRequest,
+                          self.ecmp_routes_client.create_ecmp_route,
+                          router_id=self.router['id'],
+                          vip=str(self.vip_network[1]),
+                          next_hops=[next_hop])
+
+    @decorators.attr(type=['negative'])
+    @decorators.idempotent_id('6365d0fd-f7f3-490e-9b77-8e5d78f9a358')
+    def test_create_ecmp_route_duplicated_vip(self):
+        vip = str(self.vip_network[2])
+        body = self.ecmp_routes_client.create_ecmp_route(
+            router_id=self.router['id'], vip=vip, next_hops=[self.next_hop])
+        self.addCleanup(test_utils.call_and_ignore_notfound_exc,
+                        self.ecmp_routes_client.delete_ecmp_route,
+                        body['ecmp_route']['id'])
+        self.assertRaises(lib_exc.Conflict,
+                          self.ecmp_routes_client.create_ecmp_route,
+                          router_id=self.router['id'], vip=vip,
+                          next_hops=[self.next_hop])
+
+    @decorators.attr(type=['negative'])
+    @decorators.idempotent_id('c859e9d7-18e1-44fd-9ed2-742994fe092a')
+    def test_show_nonexistent_ecmp_route(self):
+        self.assertRaises(lib_exc.NotFound,
+                          self.ecmp_routes_client.show_ecmp_route,
+                          data_utils.rand_uuid())
@@ -70,6 +70,7 @@ class Manager(clients.ServiceClients):
         self.service_providers_client = self.network.ServiceProvidersClient()
         self.tags_client = self.network.TagsClient()
         self.acls_client = self.network.AclsClient()
+        self.ecmp_routes_client = self.network.EcmpRoutesClient()
 
     def _set_image_clients(self):
         if CONF.service_available.glance:
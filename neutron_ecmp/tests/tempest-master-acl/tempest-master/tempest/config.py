@@ -738,6 +738,53 @@ NetworkFeaturesGroup = [
                 help='Does the test environment support floating_ips')
 ]
 
+ecmp_group = cfg.OptGroup(name='ecmp',
+                          title='ECMP route test options')
+
+EcmpGroup = [
+    cfg.IntOpt('vips',
+               default=200,
+               help="Number of vips, each with its own ecmp route, created "
+                    "on one router by the scale tests."),
+    cfg.IntOpt('next_hops',
+               default=8,
+               help="Number of next hops of each ecmp route of the API "
+                    "tests."),
+    cfg.IntOpt('backends',
+               default=3,
+               help="Number of backend servers the ecmp routes of the "
+                    "scenario tests spread traffic over."),
+    cfg.IntOpt('churn_rounds',
+               default=3,
+               help="Number of times the next hops of the ecmp routes are "
+                    "changed by the churn tests."),
+    cfg.IntOpt('bulk_size',
+               default=100,
+               help="Number of ecmp routes created by one bulk request. "
+                    "Bulk requests of ecmp_routes need a neutron-server "
+                    "whose ecmp extension allows bulk; set it to 1 to "
+                    "create the routes one at a time otherwise."),
+    cfg.StrOpt('vip_cidr',
+               default='172.31.0.0/16',
+               help="Prefix the vips of the ecmp routes are taken from; the "
+                    "backend servers answer on all of its addresses."),
+    cfg.IntOpt('traffic_port',
+               default=8080,
+               help="TCP port the backend servers answer on."),
+    cfg.IntOpt('traffic_probes',
+               default=24,
+               help="Number of connections to a vip made at once to tell "
+                    "which backends it reaches."),
+    cfg.IntOpt('convergence_timeout',
+               default=300,
+               help="Timeout in seconds to wait for a change of the ecmp "
+                    "routes to be realized."),
+    cfg.IntOpt('convergence_interval',
+               default=2,
+               help="Time in seconds between checks of the realization of "
+                    "the ecmp routes."),
+]
+
 validation_group = cfg.OptGroup(name='validation',
                                 title='SSH Validation options')
 
@@ -1135,6 +1182,7 @@ _opts = [
     (image_feature_group, ImageFeaturesGroup),
     (network_group, NetworkGroup),
     (network_feature_group, NetworkFeaturesGroup),
+    (ecmp_group, EcmpGroup),
     (validation_group, ValidationGroup),
     (volume_group, VolumeGroup),
     (volume_feature_group, VolumeFeaturesGroup),
@@ -1202,6 +1250,7 @@ class TempestConfigPrivate(object):
         self.image_feature_enabled = _CONF['image-feature-enabled']
         self.network = _CONF.network
         self.network_feature_enabled = _CONF['network-feature-enabled']
+        self.ecmp = _CONF.ecmp
         self.validation = _CONF.validation
         self.volume = _CONF.volume
         self.volume_feature_enabled = _CONF['volume-feature-enabled']
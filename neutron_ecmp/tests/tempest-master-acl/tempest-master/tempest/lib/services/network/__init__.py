@@ -34,10 +34,12 @@ from tempest.lib.services.network.subnets_client import SubnetsClient
 from tempest.lib.services.network.tags_client import TagsClient
 from tempest.lib.services.network.versions_client import NetworkVersionsClient
 from tempest.lib.services.network.acls_client import AclsClient
+from tempest.lib.services.network.ecmp_routes_client import EcmpRoutesClient
 
 __all__ = ['AgentsClient', 'ExtensionsClient', 'FloatingIPsClient',
            'MeteringLabelRulesClient', 'MeteringLabelsClient',
            'NetworksClient', 'NetworkVersionsClient', 'PortsClient',
            'QuotasClient', 'RoutersClient', 'SecurityGroupRulesClient',
            'SecurityGroupsClient', 'ServiceProvidersClient',
-           'SubnetpoolsClient', 'SubnetsClient', 'TagsClient', 'AclsClient']
+           'SubnetpoolsClient', 'SubnetsClient', 'TagsClient', 'AclsClient',
+           'EcmpRoutesClient']
@@ -0,0 +1,31 @@
+from tempest.lib.services.network import base
+
+
+class EcmpRoutesClient(base.BaseNetworkClient):
+
+    def create_ecmp_route(self, **kwargs):
+        uri = '/ecmp_routes'
+        post_data = {'ecmp_route': kwargs}
+        return self.create_resource(uri, post_data)
+
+    def create_ecmp_routes(self, ecmp_routes):
+        uri = '/ecmp_routes'
+        post_data = {'ecmp_routes': ecmp_routes}
+        return self.create_resource(uri, post_data)
+
+    def update_ecmp_route(self, ecmp_route_id, **kwargs):
+        uri = '/ecmp_routes/%s' % ecmp_route_id
+        post_data = {'ecmp_route': kwargs}
+        return self.update_resource(uri, post_data)
+
+    def show_ecmp_route(self, ecmp_route_id, **fields):
+        uri = '/ecmp_routes/%s' % ecmp_route_id
+        return self.show_resource(uri, **fields)
+
+    def list_ecmp_routes(self, **filters):
+        uri = '/ecmp_routes'
+        return self.list_resources(uri, **filters)
+
+    def delete_ecmp_route(self, ecmp_route_id):
+        uri = '/ecmp_routes/%s' % ecmp_route_id
+        return self.delete_resource(uri)
@@ -0,0 +1,243 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+
+import netaddr
+from oslo_log import log as logging
+
+from tempest.common import utils
+from tempest import config
+from tempest.lib.common.utils import data_utils
+from tempest.lib.common.utils import test_utils
+from tempest.lib import decorators
+from tempest.scenario import manager
+
+CONF = config.CONF
+LOG = logging.getLogger(__name__)
+
+
+class TestEcmpRoutesConvergence(manager.NetworkScenarioTest):
+    """Measure how fast ecmp route changes reach the data path.
+
+    A distributed router routes the vips of vip_cidr to [ecmp] backends
+    servers, which answer on every address of vip_cidr with their name.
+    A client server connects traffic_probes times to a vip: the names it
+    gets back are the next hops the route currently spreads traffic over.
+    After each change of the routes, the time until the route status is
+    ACTIVE and until the client reaches the expected backends is logged.
+    """
+
+    @classmethod
+    def skip_checks(cls):
+        super(TestEcmpRoutesConvergence, cls).skip_checks()
+        if not utils.is_extension_enabled('ecmp', 'network'):
+            raise cls.skipException("ecmp extension not enabled.")
+        if not CONF.network_feature_enabled.floating_ips:
+            raise cls.skipException("Floating ips are not available")
+        if not CONF.network.public_network_id:
+            raise cls.skipException("public_network_id must be defined.")
+        if not CONF.validation.run_validation:
+            raise cls.skipException("Validation should be run with ssh.")
+
+    @classmethod
+    def setup_credentials(cls):
+        # Create no network resources for these tests.
+        cls.set_network_resources()
+        super(TestEcmpRoutesConvergence, cls).setup_credentials()
+
+    @classmethod
+    def setup_clients(cls):
+        super(TestEcmpRoutesConvergence, cls).setup_clients()
+        cls.ecmp_routes_client = cls.os_primary.ecmp_routes_client
+
+    def setUp(self):
+        super(TestEcmpRoutesConvergence, self).setUp()
+        self.vip_network = netaddr.IPNetwork(CONF.ecmp.vip_cidr)
+        self.keypair = self.create_keypair()
+        self._create_distributed_network()
+        self.security_group = self._create_security_group()
+        self._create_security_group_rule(
+            secgroup=self.security_group, direction='ingress',
+            protocol='tcp', port_range_min=CONF.ecmp.traffic_port,
+            port_range_max=CONF.ecmp.traffic_port)
+        self.backends = {}
+        for i in range(CONF.ecmp.backends):
+            name = 'backend-%d' % i
+            self.backends[name] = self._create_backend(name)
+        self.client_ssh = self._create_server_with_fip('client')[1]
+
+    def _create_distributed_network(self):
+        # the next hops of ecmp routes are in the subnets of distributed
+        # interfaces, only an admin creates distributed routers
+        body = self.os_admin.routers_client.create_router(
+            name=data_utils.rand_name('ecmp-router'),
+            tenant_id=self.routers_client.tenant_id, distributed=True,
+            external_gateway_info={
+                'network_id': CONF.network.public_network_id})
+        self.router = body['router']
+        self.addCleanup(test_utils.call_and_ignore_notfound_exc,
+                        self.os_admin.routers_client.delete_router,
+                        self.router['id'])
+        self.network = self._create_network()
+        self.subnet = self.create_subnet(self.network)
+        self.routers_client.add_router_interface(self.router['id'],
+                                                 subnet_id=self.subnet['id'])
+        self.addCleanup(test_utils.call_and_ignore_notfound_exc,
+                        self.routers_client.remove_router_interface,
+                        self.router['id'], subnet_id=self.subnet['id'])
+
+    def _create_server_with_fip(self, name, **port_kwargs):
+        port = self.create_port(self.network['id'],
+                                security_groups=[self.security_group['id']],
+                                **port_kwargs)
+        server = self.create_server(
+            name=data_utils.rand_name(name), key_name=self.keypair['name'],
+            networks=[{'port': port['id']}])
+        fip = self.create_floating_ip(server, port_id=port['id'])
+        ssh_client = self.get_remote_client(fip['floating_ip_address'],
+                                            server=server)
+        return port, ssh_client
+
+    def _create_backend(self, name):
+        """Boot a server answering with its name on every vip.
+
+        :returns: the fixed ip of the server, its next hop.
+        """
+        # the replies come from the vips
+        port, ssh_client = self._create_server_with_fip(
+            name, allowed_address_pairs=[{'ip_address': CONF.ecmp.vip_cidr}])
+        ssh_client.exec_command('sudo ip addr add %s dev lo' %
+                                CONF.ecmp.vip_cidr)
+        ssh_client.exec_command(
+            "nohup sh -c 'while true; do echo %s | sudo nc -l -p %d; done' "
+            "> /dev/null 2>&1 &" % (name, CONF.ecmp.traffic_port))
+        return port['fixed_ips'][0]['ip_address']
+
+    def _vip(self, index):
+        return str(self.vip_network[index + 1])
+
+    def _probe(self, vip):
+        """Return the names of the backends the client reached on vip."""
+        output = self.client_ssh.exec_command(
+            'for i in $(seq %d); do nc -w 2 %s %d < /dev/null; done; true' %
+            (CONF.ecmp.traffic_probes, vip, CONF.ecmp.traffic_port))
+        return set(line.strip() for line in output.splitlines()
+                   if line.strip() in self.backends)
+
+    def _wait_for_backends(self, vips, names, start):
+        """Wait until the vips reach the backends names and only them.
+
+        :returns: the seconds since start.
+        """
+        def converged():
+            return all(self._probe(vip) == names for vip in vips)
+
+        if not test_utils.call_until_true(converged,
+                                          CONF.ecmp.convergence_timeout,
+                                          CONF.ecmp.convergence_interval):
+            self.fail('vips %s did not reach the backends %s within %ds' %
+                      (vips, sorted(names), CONF.ecmp.convergence_timeout))
+        return time.time() - start
+
+    def _wait_for_active(self, route_ids, start):
+        """Wait until the routes are realized by every host of the router.
+
+        :returns: the seconds since start.
+        """
+        route_ids = set(route_ids)
+
+        def active():
+            body = self.ecmp_routes_client.list_ecmp_routes(
+                router_id=self.router['id'])
+            return all(r['status'] == 'ACTIVE' for r in body['ecmp_routes']
+                       if r['id'] in route_ids)
+
+        if not test_utils.call_until_true(active,
+                                          CONF.ecmp.convergence_timeout,
+                                          CONF.ecmp.convergence_interval):
+            self.fail('%d ecmp routes are not ACTIVE within %ds' %
+                      (len(route_ids), CONF.ecmp.convergence_timeout))
+        return time.time() - start
+
+    def _create_ecmp_routes(self, count, next_hops):
+        ecmp_routes = []
+        while len(ecmp_routes) < count:
+            size = min(CONF.ecmp.bulk_size, count - len(ecmp_routes))
+            routes = [{'router_id': self.router['id'],
+                       'vip': self._vip(len(ecmp_routes) + i),
+                       'next_hops': next_hops} for i in range(size)]
+            if size <= 1:
+                body = self.ecmp_routes_client.create_ecmp_route(**routes[0])
+                body = {'ecmp_routes': [body['ecmp_route']]}
+            else:
+                body = self.ecmp_routes_client.create_ecmp_routes(routes)
+            for ecmp_route in body['ecmp_routes']:
+                self.addCleanup(test_utils.call_and_ignore_notfound_exc,
+                                self.ecmp_routes_client.delete_ecmp_route,
+                                ecmp_route['id'])
+            ecmp_routes.extend(body['ecmp_routes'])
+        return ecmp_routes
+
+    def _churn(self, ecmp_routes, sample_vips):
+        """Take each backend out of the routes in turn, then back in."""
+        names = sorted(self.backends)
+        for i in range(CONF.ecmp.churn_rounds):
+            removed = names[i % len(names)]
+            for kept in (set(names) - set([removed]), set(names)):
+                next_hops = [self.backends[name] for name in sorted(kept)]
+                start = time.time()
+                for ecmp_route in ecmp_routes:
+                    self.ecmp_routes_client.update_ecmp_route(
+                        ecmp_route['id'], next_hops=next_hops)
+                updated = time.time() - start
+                active = self._wait_for_active(
+                    [r['id'] for r in ecmp_routes], start)
+                converged = self._wait_for_backends(sample_vips, kept, start)
+                LOG.info('ecmp: churn round %d to %s: %d routes updated in '
+                         '%.2fs, ACTIVE in %.2fs, traffic converged in '
+                         '%.2fs', i, sorted(kept), len(ecmp_routes),
+                         updated, active, converged)
+
+    @decorators.idempotent_id('09169b82-5673-4e1e-a216-da1514dc2412')
+    @utils.services('compute', 'network')
+    def test_ecmp_route_convergence(self):
+        next_hops = sorted(self.backends.values())
+        start = time.time()
+        ecmp_routes = self._create_ecmp_routes(1, next_hops)
+        active = self._wait_for_active([ecmp_routes[0]['id']], start)
+        vip = ecmp_routes[0]['vip']
+        converged = self._wait_for_backends([vip], set(self.backends), start)
+        LOG.info('ecmp: route to %s ACTIVE in %.2fs, traffic converged in '
+                 '%.2fs', vip, active, converged)
+        self._churn(ecmp_routes, [vip])
+
+    @decorators.idempotent_id('d3524ef7-0b69-49aa-89bf-28b9765b7c35')
+    @utils.services('compute', 'network')
+    def test_ecmp_routes_convergence_at_scale(self):
+        next_hops = sorted(self.backends.values())
+        start = time.time()
+        ecmp_routes = self._create_ecmp_routes(CONF.ecmp.vips, next_hops)
+        created = time.time() - start
+        active = self._wait_for_active([r['id'] for r in ecmp_routes], start)
+        # the first, middle and last vips stand for all of them
+        sample_vips = sorted(set(ecmp_routes[i]['vip'] for i in
+                                 (0, len(ecmp_routes) // 2, -1)))
+        converged = self._wait_for_backends(sample_vips, set(self.backends),
+                                            start)
+        LOG.info('ecmp: %d routes created in %.2fs, ACTIVE in %.2fs, '
+                 'traffic converged in %.2fs', len(ecmp_routes), created,
+                 active, converged)
+        self._churn(ecmp_routes, sample_vips)
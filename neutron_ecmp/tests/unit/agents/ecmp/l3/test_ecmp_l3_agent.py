@@ -0,0 +1,214 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+from oslo_config import cfg
+from oslo_utils import uuidutils
+
+from neutron_ecmp.agents.ecmp.l3 import ecmp_l3_agent
+from neutron_ecmp.common import ecmp_digest
+from neutron_ecmp.tests import base
+
+ROUTER_ID = uuidutils.generate_uuid()
+
+
+def _route(vip, next_hops, revision=1):
+    return {'id': uuidutils.generate_uuid(), 'revision': revision, 'vip': vip,
+            'next_hops': next_hops, 'qr_interfaces': ['qr-1'], 'hash_policy': None}
+
+
+class EcmpL3AgentTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(EcmpL3AgentTestCase, self).setUp()
+        mock.patch.object(ecmp_l3_agent.n_rpc, 'Connection').start()
+        mock.patch.object(ecmp_l3_agent.loopingcall, 'FixedIntervalLoopingCall').start()
+        self.plugin_rpc = mock.patch.object(ecmp_l3_agent, 'EcmpL3PluginApi').start().return_value
+        self.programmer = mock.Mock()
+        self.programmer.get_routes.return_value = {}
+        mock.patch.object(ecmp_l3_agent.route_programmer, 'get_route_programmer',
+                          return_value=self.programmer).start()
+        self.routes = [_route('192.168.0.1', ['10.0.0.1', '10.0.0.2']),
+                       _route('192.168.0.2', ['10.0.0.3'])]
+
+    def _new_agent(self):
+        agent = ecmp_l3_agent.ECMPL3AgentExtension('host-1', cfg.CONF)
+        agent.consume_api(mock.Mock())
+        return agent
+
+    def _programmed(self):
+        return dict(call[0] for call in self.programmer.replace_route.call_args_list)
+
+
+class TestSnapshotRestore(EcmpL3AgentTestCase):
+
+    def setUp(self):
+        super(TestSnapshotRestore, self).setUp()
+        self.plugin_rpc.get_route_of_router_if_changed.return_value = {
+            'revision': '1.1', 'routes': self.routes}
+        agent = self._new_agent()
+        agent.add_router(mock.ANY, {'id': ROUTER_ID})
+        agent._write_snapshot()
+        self.plugin_rpc.reset_mock()
+        self.programmer.reset_mock()
+
+    def test_restored_without_fetching(self):
+        agent = self._new_agent()
+        agent.add_router(mock.ANY, {'id': ROUTER_ID})
+        self.assertFalse(self.plugin_rpc.get_route_of_router_if_changed.called)
+        self.assertEqual({'192.168.0.1/32': ('10.0.0.1', '10.0.0.2'),
+                          '192.168.0.2/32': ('10.0.0.3',)}, self._programmed())
+        self.assertEqual(set([ROUTER_ID]), agent._routers_to_verify)
+
+    def test_unchanged_router_verified(self):
+        agent = self._new_agent()
+        agent.add_router(mock.ANY, {'id': ROUTER_ID})
+        self.plugin_rpc.get_changed_routes_of_routers.return_value = {}
+        agent._verify_restored_routers()
+        self.plugin_rpc.get_changed_routes_of_routers.assert_called_once_with(
+            mock.ANY, {ROUTER_ID: ecmp_digest.get_routes_digest(self.routes)})
+        self.assertEqual(set(), agent._routers_to_verify)
+        self.assertEqual(2, self.programmer.replace_route.call_count)
+
+    def test_changed_router_reprogrammed(self):
+        agent = self._new_agent()
+        agent.add_router(mock.ANY, {'id': ROUTER_ID})
+        self.programmer.reset_mock()
+        changed = [dict(self.routes[0], revision=2, next_hops=['10.0.0.1'])]
+        self.plugin_rpc.get_changed_routes_of_routers.return_value = {ROUTER_ID: changed}
+        agent._verify_restored_routers()
+        self.programmer.replace_route.assert_called_once_with('192.168.0.1/32', ('10.0.0.1',))
+        self.programmer.delete_route.assert_called_once_with('192.168.0.2/32')
+        self.assertEqual([2], [route['revision'] for route in
+                               agent._router_routes[ROUTER_ID].get_routes()])
+
+    def test_router_not_in_snapshot_fetched(self):
+        agent = self._new_agent()
+        router_id = uuidutils.generate_uuid()
+        agent.add_router(mock.ANY, {'id': router_id})
+        self.assertTrue(self.plugin_rpc.get_route_of_router_if_changed.called)
+        self.assertEqual(set(), agent._routers_to_verify)
+
+    def test_snapshot_disabled(self):
+        self.config(snapshot_interval=0, group='ecmp')
+        agent = self._new_agent()
+        agent.add_router(mock.ANY, {'id': ROUTER_ID})
+        self.assertTrue(self.plugin_rpc.get_route_of_router_if_changed.called)
+
+
+class TestDumpEcmpRoutes(EcmpL3AgentTestCase):
+
+    def setUp(self):
+        super(TestDumpEcmpRoutes, self).setUp()
+        self.config(snapshot_interval=0, group='ecmp')
+        self.plugin_rpc.get_route_of_router_if_changed.return_value = {
+            'revision': '1.1', 'routes': self.routes}
+        self.agent = self._new_agent()
+        self.agent.add_router(mock.ANY, {'id': ROUTER_ID})
+        self.agent.agent_api.get_router_info.side_effect = (
+            lambda router_id: mock.Mock(ns_name='qrouter-%s' % router_id)
+            if router_id == ROUTER_ID else None)
+        self.kernel = mock.patch.object(ecmp_l3_agent.route_programmer,
+                                        'RouteProgrammer').start().return_value
+        self.kernel.get_routes.return_value = {'192.168.0.1/32': ['10.0.0.1']}
+
+    def test_dump(self):
+        dump = self.agent.dump_ecmp_routes(mock.ANY)
+        self.assertEqual({ROUTER_ID: {
+            'programmed': ['192.168.0.1/32', '192.168.0.2/32'],
+            'aggregate_vips': cfg.CONF.ecmp.aggregate_vips,
+            'routes': {'192.168.0.1/32': ['10.0.0.1']}}}, dump)
+
+    def test_dump_skips_routers_not_hosted(self):
+        self.assertEqual([ROUTER_ID], list(self.agent.dump_ecmp_routes(
+            mock.ANY, [ROUTER_ID, uuidutils.generate_uuid()])))
+
+    def test_dump_error(self):
+        self.kernel.get_routes.side_effect = RuntimeError('no namespace')
+        dump = self.agent.dump_ecmp_routes(mock.ANY, [ROUTER_ID])
+        self.assertEqual('no namespace', dump[ROUTER_ID]['error'])
+        self.assertNotIn('routes', dump[ROUTER_ID])
+
+    def test_dump_does_not_program(self):
+        self.programmer.reset_mock()
+        self.agent.dump_ecmp_routes(mock.ANY)
+        self.assertEqual([], self.programmer.mock_calls)
+
+
+class TestFetchRouterRoutes(EcmpL3AgentTestCase):
+
+    def setUp(self):
+        super(TestFetchRouterRoutes, self).setUp()
+        self.config(snapshot_interval=0, group='ecmp')
+        self.agent = self._new_agent()
+        self.fetch = self.plugin_rpc.get_route_of_router_if_changed
+        self.fetch.return_value = {'revision': '1.1', 'routes': self.routes}
+
+    def test_known_revision_sent(self):
+        self.agent.add_router(mock.ANY, {'id': ROUTER_ID})
+        self.fetch.assert_called_once_with(mock.ANY, ROUTER_ID, None)
+        self.fetch.return_value = {'revision': '1.1', 'routes': None}
+        self.programmer.reset_mock()
+        self.agent.add_router(mock.ANY, {'id': ROUTER_ID})
+        self.fetch.assert_called_with(mock.ANY, ROUTER_ID, '1.1')
+        # programmed again from the routes the agent has
+        self.assertEqual(2, self.programmer.replace_route.call_count)
+
+    def test_forgotten_router_fetched_again(self):
+        self.agent.add_router(mock.ANY, {'id': ROUTER_ID})
+        self.agent.delete_router(mock.ANY, {'id': ROUTER_ID})
+        self.agent.add_router(mock.ANY, {'id': ROUTER_ID})
+        self.fetch.assert_called_with(mock.ANY, ROUTER_ID, None)
+
+
+class TestPurgeAndResyncRouters(EcmpL3AgentTestCase):
+
+    def setUp(self):
+        super(TestPurgeAndResyncRouters, self).setUp()
+        self.config(snapshot_interval=0, group='ecmp')
+        self.fetch = self.plugin_rpc.get_route_of_router_if_changed
+        self.fetch.return_value = {'revision': '1.1', 'routes': self.routes}
+        self.agent = self._new_agent()
+        self.agent.add_router(mock.ANY, {'id': ROUTER_ID})
+        self.programmer.reset_mock()
+
+    def test_purge_deletes_programmed_prefixes(self):
+        self.agent.purge_ecmp_routers(mock.ANY, [ROUTER_ID, uuidutils.generate_uuid()])
+        self.assertEqual(['192.168.0.1/32', '192.168.0.2/32'],
+                         [call[0][0] for call in self.programmer.delete_route.call_args_list])
+        self.programmer.flush.assert_called_once_with()
+        self.assertNotIn(ROUTER_ID, self.agent._router_routes)
+        self.assertNotIn(ROUTER_ID, self.agent._route_compilers)
+        self.assertNotIn(ROUTER_ID, self.agent._router_revisions)
+
+    def test_purge_of_namespace_gone(self):
+        self.agent.agent_api.get_router_info.return_value = None
+        self.agent.purge_ecmp_routers(mock.ANY, [ROUTER_ID])
+        self.assertFalse(self.programmer.delete_route.called)
+        self.assertNotIn(ROUTER_ID, self.agent._router_routes)
+
+    def test_resync_reprograms(self):
+        changed = [dict(self.routes[0], revision=2, next_hops=['10.0.0.1'])]
+        self.fetch.return_value = {'revision': '2.1', 'routes': changed}
+        self.agent.resync_ecmp_routers(mock.ANY, [ROUTER_ID])
+        self.fetch.assert_called_with(mock.ANY, ROUTER_ID, '1.1')
+        self.programmer.replace_route.assert_called_once_with('192.168.0.1/32', ('10.0.0.1',))
+        self.programmer.delete_route.assert_called_once_with('192.168.0.2/32')
+
+    def test_resync_skips_routers_not_hosted(self):
+        self.agent.agent_api.get_router_info.return_value = None
+        self.fetch.reset_mock()
+        self.agent.resync_ecmp_routers(mock.ANY, [ROUTER_ID])
+        self.assertFalse(self.fetch.called)
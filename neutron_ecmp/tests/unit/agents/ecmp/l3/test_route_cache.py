@@ -0,0 +1,139 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from oslo_utils import uuidutils
+
+from neutron_ecmp.agents.ecmp.l3 import route_cache
+from neutron_ecmp.tests import base
+
+
+def _route(vip, next_hops, revision=1, route_id=None, **kwargs):
+    if route_id is None:
+        route_id = uuidutils.generate_uuid()
+    route = {'id': route_id, 'revision': revision,
+             'vip': vip, 'next_hops': next_hops,
+             'qr_interfaces': ['qr-1'], 'hash_policy': None}
+    route.update(kwargs)
+    return route
+
+
+class TestAddresses(base.BaseTestCase):
+
+    def test_pack_unpack(self):
+        addresses = ['fd00::1', '10.0.0.2', '10.0.0.1']
+        self.assertEqual(['10.0.0.1', '10.0.0.2', 'fd00::1'],
+                         route_cache.unpack_addresses(route_cache.pack_addresses(addresses)))
+
+
+class TestRouteTable(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestRouteTable, self).setUp()
+        self.cache = route_cache.RouteCache()
+        self.table = self.cache.new_table()
+
+    def _routes(self):
+        return sorted(self.table.get_routes(), key=lambda route: route['id'])
+
+    def test_set_route(self):
+        routes = [_route('192.168.0.1', ['10.0.0.2', '10.0.0.1'], hash_policy='L3'),
+                  _route('192.168.1.0/24', ['10.0.0.1'], revision=None),
+                  _route('fd00:ec00::1', ['fd00:10::1'])]
+        for route in routes:
+            self.table.set_route(route)
+        self.assertEqual(3, len(self.table))
+        routes[0]['next_hops'].sort()
+        self.assertEqual(sorted(routes, key=lambda route: route['id']), self._routes())
+
+    def test_routes_without_id_not_kept(self):
+        self.table.set_route(_route('192.168.0.1', ['10.0.0.1'], route_id=''))
+        self.assertEqual(0, len(self.table))
+
+    def test_replace_route(self):
+        route = _route('192.168.0.1', ['10.0.0.1'])
+        self.table.set_route(route)
+        self.table.set_route(dict(route, next_hops=['10.0.0.2'], revision=2))
+        self.assertEqual(1, len(self.table))
+        self.assertEqual([dict(route, next_hops=['10.0.0.2'], revision=2)], self._routes())
+        self.assertEqual(1, len(self.cache.next_hops))
+
+    def test_delete_keeps_revision(self):
+        route = _route('192.168.0.1', ['10.0.0.1'], revision=3)
+        self.table.set_route(route)
+        self.table.set_route(dict(route, operation='delete', revision=4))
+        self.assertEqual(0, len(self.table))
+        self.assertEqual([], self._routes())
+        self.assertEqual(3, self.table.get_revision(route['id']))
+        self.assertEqual(0, len(self.cache.next_hops))
+        self.assertEqual(0, len(self.cache.interfaces))
+
+    def test_set_revision_before_route(self):
+        route_id = uuidutils.generate_uuid()
+        self.assertIsNone(self.table.get_revision(route_id))
+        self.table.set_revision(route_id, 5)
+        self.assertEqual(5, self.table.get_revision(route_id))
+        self.assertEqual(0, len(self.table))
+        self.table.set_route(_route('192.168.0.1', ['10.0.0.1'], revision=6, route_id=route_id))
+        self.assertEqual(6, self.table.get_revision(route_id))
+        self.assertEqual(1, len(self.table))
+
+    def test_groups_shared_between_tables(self):
+        other = self.cache.new_table()
+        self.table.set_route(_route('192.168.0.1', ['10.0.0.1', '10.0.0.2']))
+        other.set_route(_route('192.168.0.1', ['10.0.0.2', '10.0.0.1']))
+        self.assertEqual(1, len(self.cache.next_hops))
+        self.assertEqual(1, len(self.cache.interfaces))
+        self.table.clear()
+        self.assertEqual(1, len(self.cache.next_hops))
+        other.clear()
+        self.assertEqual(0, len(self.cache.next_hops))
+        self.assertEqual(0, len(self.cache.interfaces))
+
+    def test_load_replaces(self):
+        route = _route('192.168.0.1', ['10.0.0.1'])
+        self.table.set_route(_route('192.168.0.2', ['10.0.0.9']))
+        self.table.load([route, dict(route, next_hops=['10.0.0.2'], revision=2),
+                         _route('192.168.0.3', ['10.0.0.2'], route_id='')])
+        self.assertEqual(1, len(self.table))
+        self.assertEqual([dict(route, next_hops=['10.0.0.2'], revision=2)], self._routes())
+        self.assertEqual(1, len(self.cache.next_hops))
+
+    def test_hash_policy_of_routes(self):
+        self.assertIsNone(self.table.get_hash_policy(4))
+        route = _route('192.168.0.1', ['10.0.0.1'], hash_policy='L4')
+        self.table.set_route(route)
+        self.table.set_route(_route('192.168.0.2', ['10.0.0.1']))
+        self.assertEqual('L4', self.table.get_hash_policy(4))
+        self.assertIsNone(self.table.get_hash_policy(6))
+        self.table.set_route(dict(route, hash_policy='L3-inner'))
+        self.assertEqual('L3-inner', self.table.get_hash_policy(4))
+        self.table.delete_route(route['id'])
+        self.assertIsNone(self.table.get_hash_policy(4))
+
+    def test_hash_policy_of_most_routes(self):
+        self.table.set_route(_route('192.168.0.1', ['10.0.0.1'], hash_policy='L4'))
+        self.table.set_route(_route('192.168.0.2', ['10.0.0.1'], hash_policy='L3'))
+        # the first policy on a tie
+        self.assertEqual('L3', self.table.get_hash_policy(4))
+        self.table.set_route(_route('192.168.0.3', ['10.0.0.1'], hash_policy='L4'))
+        self.assertEqual('L4', self.table.get_hash_policy(4))
+
+    def test_hash_policy_load_and_clear(self):
+        self.table.set_route(_route('192.168.0.1', ['10.0.0.1'], hash_policy='L4'))
+        self.table.load([_route('fd00:ec00::1', ['fd00:10::1'], hash_policy='L3-inner')])
+        self.assertIsNone(self.table.get_hash_policy(4))
+        self.assertEqual('L3-inner', self.table.get_hash_policy(6))
+        self.table.clear()
+        self.assertIsNone(self.table.get_hash_policy(6))
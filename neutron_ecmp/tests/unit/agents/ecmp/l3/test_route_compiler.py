@@ -0,0 +1,137 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import netaddr
+
+from neutron_ecmp.agents.ecmp.l3 import route_compiler
+from neutron_ecmp.tests import base
+
+NEXT_HOPS_1 = ('10.0.0.1', '10.0.0.2')
+NEXT_HOPS_2 = ('10.0.0.3',)
+
+
+class TestGetOverlappingVips(base.BaseTestCase):
+
+    def test_overlapping(self):
+        networks = dict((vip, netaddr.IPNetwork(vip)) for vip in
+                        ('192.168.0.0/24', '192.168.0.10', '192.168.1.1', 'fd00::/64'))
+        self.assertEqual(set(['192.168.0.0/24', '192.168.0.10']),
+                         route_compiler.get_overlapping_vips(networks))
+
+    def test_versions_do_not_overlap(self):
+        networks = dict((vip, netaddr.IPNetwork(vip)) for vip in ('0.0.0.0/0', '::/0'))
+        self.assertEqual(set(), route_compiler.get_overlapping_vips(networks))
+
+
+class TestRouteCompiler(base.BaseTestCase):
+
+    def _compiler(self, routes, aggregate=True):
+        compiler = route_compiler.RouteCompiler(aggregate=aggregate)
+        for vip, next_hops in routes.items():
+            compiler.set_route(vip, next_hops)
+        return compiler
+
+    def test_aggregate(self):
+        compiler = self._compiler({
+            '192.168.0.0': NEXT_HOPS_1, '192.168.0.1': NEXT_HOPS_1,
+            '192.168.0.2': NEXT_HOPS_1, '192.168.0.3': NEXT_HOPS_1,
+            '192.168.0.4': NEXT_HOPS_2})
+        self.assertEqual({'192.168.0.0/30': NEXT_HOPS_1,
+                          '192.168.0.4/32': NEXT_HOPS_2}, compiler.compile())
+        self.assertEqual('192.168.0.0/30', compiler.get_prefix('192.168.0.2'))
+        self.assertIsNone(compiler.get_prefix('192.168.0.5'))
+
+    def test_no_aggregate(self):
+        compiler = self._compiler({'192.168.0.0': NEXT_HOPS_1, '192.168.0.1': NEXT_HOPS_1},
+                                  aggregate=False)
+        self.assertEqual({'192.168.0.0/32': NEXT_HOPS_1,
+                          '192.168.0.1/32': NEXT_HOPS_1}, compiler.compile())
+
+    def test_overlapping_vips_not_merged(self):
+        compiler = self._compiler({
+            '192.168.0.0/31': NEXT_HOPS_1, '192.168.0.1': NEXT_HOPS_2,
+            '192.168.0.2': NEXT_HOPS_1, '192.168.0.3': NEXT_HOPS_1})
+        self.assertEqual({'192.168.0.0/31': NEXT_HOPS_1,
+                          '192.168.0.1/32': NEXT_HOPS_2,
+                          '192.168.0.2/31': NEXT_HOPS_1}, compiler.compile())
+
+    def test_changes_of_one_vip(self):
+        compiler = self._compiler({'192.168.0.0': NEXT_HOPS_1, '192.168.0.1': NEXT_HOPS_1})
+        compiled = compiler.compile()
+        self.assertEqual(({'192.168.0.0/31': NEXT_HOPS_1}, []),
+                         compiler.get_changes(compiled))
+        compiler.set_programmed(compiled)
+        self.assertEqual(({}, []), compiler.get_changes(compiler.compile()))
+
+        compiler.set_route('192.168.0.1', NEXT_HOPS_2)
+        compiled = compiler.compile()
+        self.assertEqual(({'192.168.0.0/32': NEXT_HOPS_1, '192.168.0.1/32': NEXT_HOPS_2},
+                          ['192.168.0.0/31']), compiler.get_changes(compiled))
+        compiler.set_programmed(compiled)
+
+        compiler.set_route('192.168.0.1', None)
+        self.assertEqual(({}, ['192.168.0.1/32']), compiler.get_changes(compiler.compile()))
+
+    def test_notified_vips_replaced(self):
+        compiler = self._compiler({'192.168.0.0': NEXT_HOPS_1, '192.168.0.1': NEXT_HOPS_1})
+        compiled = compiler.compile()
+        compiler.set_programmed(compiled)
+        self.assertEqual(({'192.168.0.0/31': NEXT_HOPS_1}, []),
+                         compiler.get_changes(compiled, ['192.168.0.1']))
+
+    def test_failed_programming_replaced_again(self):
+        compiler = self._compiler({'192.168.0.0': NEXT_HOPS_1})
+        compiler.set_programmed(compiler.compile(), succeeded=False)
+        compiler.set_route('192.168.0.5', NEXT_HOPS_2)
+        self.assertEqual(({'192.168.0.0/32': NEXT_HOPS_1, '192.168.0.5/32': NEXT_HOPS_2}, []),
+                         compiler.get_changes(compiler.compile()))
+
+    def test_assume_programmed(self):
+        compiler = self._compiler({'192.168.0.0': NEXT_HOPS_1, '192.168.0.1': NEXT_HOPS_1,
+                                   '192.168.0.4': NEXT_HOPS_2})
+        compiler.assume_programmed({
+            # programmed before aggregating them
+            '192.168.0.0/32': list(NEXT_HOPS_1),
+            '192.168.0.1/32': list(NEXT_HOPS_1),
+            '192.168.0.4/32': list(NEXT_HOPS_2),
+            # the vip of a deleted route
+            '192.168.0.9/32': list(NEXT_HOPS_2),
+            # not ecmp routes
+            '192.168.0.0/24': ['10.0.0.9'],
+            '172.16.0.0/16': ['10.0.0.9']},
+            ['192.168.0.0', '192.168.0.1', '192.168.0.4', '192.168.0.9'])
+        self.assertEqual(({'192.168.0.0/31': NEXT_HOPS_1},
+                          ['192.168.0.0/32', '192.168.0.1/32', '192.168.0.9/32']),
+                         compiler.get_changes(compiler.compile()))
+
+    def test_foreign_route_not_covered(self):
+        compiler = self._compiler({
+            '192.168.0.0': NEXT_HOPS_1, '192.168.0.1': NEXT_HOPS_1, '192.168.0.2': NEXT_HOPS_1})
+        # a more specific route to some of the vips and another address,
+        # e.g. an extra route
+        compiler.assume_programmed({'192.168.0.2/31': ['10.0.0.9']},
+                                   ['192.168.0.0', '192.168.0.1', '192.168.0.2'])
+        compiler.set_route('192.168.0.3', NEXT_HOPS_1)
+        self.assertEqual({'192.168.0.0/31': NEXT_HOPS_1,
+                          '192.168.0.2/32': NEXT_HOPS_1,
+                          '192.168.0.3/32': NEXT_HOPS_1}, compiler.compile())
+        self.assertEqual('192.168.0.3/32', compiler.get_prefix('192.168.0.3'))
+        self.assertEqual('192.168.0.0/31', compiler.get_prefix('192.168.0.1'))
+
+    def test_less_specific_foreign_route_covered(self):
+        compiler = self._compiler({'192.168.0.0': NEXT_HOPS_1, '192.168.0.1': NEXT_HOPS_1})
+        compiler.assume_programmed({'192.168.0.0/24': ['10.0.0.9']},
+                                   ['192.168.0.0', '192.168.0.1'])
+        self.assertEqual({'192.168.0.0/31': NEXT_HOPS_1}, compiler.compile())
@@ -0,0 +1,62 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from neutron_ecmp.agents.ecmp.l3 import route_programmer
+from neutron_ecmp.tests import base
+
+SYSCTL_OUTPUT = ('net.ipv4.fib_multipath_hash_policy = 0\n'
+                 'net.ipv6.fib_multipath_hash_policy = 0\n')
+
+
+class TestRouteProgrammerHashPolicy(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestRouteProgrammerHashPolicy, self).setUp()
+        mock.patch.object(route_programmer.ip_lib, 'IPWrapper').start()
+        self.programmer = route_programmer.RouteProgrammer('qrouter-1')
+        self.execute = self.programmer.ip_wrapper.netns.execute
+        self.execute.return_value = SYSCTL_OUTPUT
+
+    def _written(self):
+        return [call[0][0][2:] for call in self.execute.call_args_list
+                if call[0][0][:2] == ['sysctl', '-w']]
+
+    def test_set_once(self):
+        self.programmer.set_hash_policy('L4')
+        self.programmer.set_hash_policy('L4')
+        self.programmer.set_hash_policy('L3-inner', ip_version=6)
+        self.assertEqual([['net.ipv4.fib_multipath_hash_policy=1'],
+                          ['net.ipv6.fib_multipath_hash_policy=2']], self._written())
+
+    def test_reset_without_policy(self):
+        self.programmer.set_hash_policy('L4')
+        self.programmer.set_hash_policy(None)
+        self.assertEqual([['net.ipv4.fib_multipath_hash_policy=1'],
+                          ['net.ipv4.fib_multipath_hash_policy=0']], self._written())
+
+    def test_default_policy(self):
+        self.config(default_hash_policy='L4', group='ecmp')
+        self.programmer.set_hash_policy(None)
+        self.programmer.set_hash_policy('L3')
+        self.assertEqual([['net.ipv4.fib_multipath_hash_policy=1'],
+                          ['net.ipv4.fib_multipath_hash_policy=0']], self._written())
+
+    def test_missing_sysctl_not_written(self):
+        self.execute.return_value = 'net.ipv4.fib_multipath_hash_policy = 0\n'
+        self.programmer.set_hash_policy('L4', ip_version=6)
+        self.programmer.set_hash_policy(None, ip_version=6)
+        self.assertEqual([], self._written())
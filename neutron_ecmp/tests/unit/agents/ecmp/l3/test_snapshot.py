@@ -0,0 +1,65 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+
+from oslo_config import cfg
+from oslo_serialization import jsonutils
+
+from neutron_ecmp.agents.ecmp.l3 import snapshot
+from neutron_ecmp.tests import base
+
+ROUTES = {'router-1': [{'id': 'route-1', 'revision': 3, 'vip': '192.168.0.1',
+                        'next_hops': ['10.0.0.1', '10.0.0.2'],
+                        'qr_interfaces': ['qr-1'], 'hash_policy': 'L4'}]}
+
+
+class TestSnapshot(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestSnapshot, self).setUp()
+        self.path = os.path.join(self.get_default_temp_dir().path, 'ecmp', 'routes.json')
+
+    def test_write_and_load(self):
+        snapshot.write_snapshot(self.path, ROUTES)
+        self.assertEqual(ROUTES, snapshot.load_snapshot(self.path))
+        self.assertFalse(os.path.exists('%s.tmp' % self.path))
+
+    def test_write_replaces(self):
+        snapshot.write_snapshot(self.path, ROUTES)
+        snapshot.write_snapshot(self.path, {})
+        self.assertEqual({}, snapshot.load_snapshot(self.path))
+
+    def test_load_missing(self):
+        self.assertEqual({}, snapshot.load_snapshot(self.path))
+
+    def test_load_corrupted(self):
+        snapshot.write_snapshot(self.path, ROUTES)
+        with open(self.path, 'r+') as f:
+            f.truncate(10)
+        self.assertEqual({}, snapshot.load_snapshot(self.path))
+
+    def test_load_other_version(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as f:
+            f.write(jsonutils.dumps({'version': snapshot.SNAPSHOT_VERSION + 1,
+                                     'routers': ROUTES}))
+        self.assertEqual({}, snapshot.load_snapshot(self.path))
+
+    def test_path(self):
+        self.assertEqual(os.path.join(cfg.CONF.state_path, 'ecmp', 'routes.json'),
+                         snapshot.get_snapshot_path(cfg.CONF))
+        self.config(snapshot_path='/var/lib/ecmp.json', group='ecmp')
+        self.assertEqual('/var/lib/ecmp.json', snapshot.get_snapshot_path(cfg.CONF))
@@ -0,0 +1,135 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+from neutron.db.models import l3 as l3_models
+from neutron.tests.unit import testlib_api
+from oslo_utils import uuidutils
+
+from neutron_ecmp.cmd import audit
+from neutron_ecmp.db.ecmp import ecmp_db
+from neutron_ecmp.tests import base
+
+ROUTER_1 = '00000000-0000-0000-0000-000000000001'
+ROUTER_2 = '00000000-0000-0000-0000-000000000002'
+ROUTER_3 = '00000000-0000-0000-0000-000000000003'
+
+
+class TestDiffRouter(base.BaseTestCase):
+
+    def test_in_sync(self):
+        dump = {'routes': {'192.168.0.1/32': ['10.0.0.1', '10.0.0.2']},
+                'programmed': ['192.168.0.1/32']}
+        self.assertEqual(({}, {}, []), audit.diff_router(
+            {'192.168.0.1': ['10.0.0.2', '10.0.0.1']}, dump))
+
+    def test_missing_and_mismatched(self):
+        dump = {'routes': {'192.168.0.1/32': ['10.0.0.1']}}
+        missing, mismatched, stale = audit.diff_router(
+            {'192.168.0.1': ['10.0.0.1', '10.0.0.2'], '192.168.1.1': ['10.0.0.3']}, dump)
+        self.assertEqual({'192.168.1.1/32': ['10.0.0.3']}, missing)
+        self.assertEqual({'192.168.0.1/32': {'expected': ['10.0.0.1', '10.0.0.2'],
+                                             'actual': ['10.0.0.1']}}, mismatched)
+        self.assertEqual([], stale)
+
+    def test_stale(self):
+        dump = {'routes': {'192.168.0.1/32': ['10.0.0.1', '10.0.0.2'],
+                           '192.168.0.2/32': ['10.0.0.1'],
+                           '10.10.0.0/16': ['10.0.0.1']},
+                'programmed': ['192.168.0.2/32', '192.168.0.3/32']}
+        missing, mismatched, stale = audit.diff_router({}, dump)
+        # the extra route of the router is neither multipath nor programmed
+        self.assertEqual(['192.168.0.1/32', '192.168.0.2/32'], stale)
+
+    def test_aggregate_vips_of_agent(self):
+        expected = {'192.168.0.0': ['10.0.0.1'], '192.168.0.1': ['10.0.0.1']}
+        dump = {'routes': {'192.168.0.0/31': ['10.0.0.1']}}
+        self.assertEqual(({}, {}, []), audit.diff_router(expected, dump))
+        dump['aggregate_vips'] = False
+        missing, mismatched, stale = audit.diff_router(expected, dump)
+        self.assertEqual(['192.168.0.0/32', '192.168.0.1/32'], sorted(missing))
+
+    def test_repair_commands(self):
+        commands = audit.get_repair_commands(
+            ROUTER_1, {'192.168.1.1/32': ['10.0.0.3']},
+            {'192.168.0.1/32': {'expected': ['10.0.0.1', '10.0.0.2'], 'actual': ['10.0.0.1']}},
+            ['192.168.0.9/32'])
+        ns = 'qrouter-%s' % ROUTER_1
+        self.assertEqual([
+            'ip netns exec %s ip route delete to 192.168.0.9/32' % ns,
+            'ip netns exec %s ip route replace to 192.168.0.1/32 '
+            'nexthop via 10.0.0.1 nexthop via 10.0.0.2' % ns,
+            'ip netns exec %s ip route replace to 192.168.1.1/32 nexthop via 10.0.0.3' % ns],
+            commands)
+
+
+class TestAuditor(testlib_api.SqlTestCase):
+
+    def setUp(self):
+        super(TestAuditor, self).setUp()
+        self.conf = mock.Mock(hosts=['host-1', 'host-2'], routers=None, page_size=2,
+                              concurrency=2, rpc_timeout=1, repair_plan=True)
+        self.dumps = {}
+        self.agent_rpc = mock.Mock()
+        self.agent_rpc.dump_ecmp_routes.side_effect = self._dump_ecmp_routes
+        self.auditor = audit.Auditor(self.conf, agent_rpc=self.agent_rpc)
+        session = self.auditor.context.session
+        with session.begin(subtransactions=True):
+            for router_id in (ROUTER_1, ROUTER_2, ROUTER_3):
+                session.add(l3_models.Router(
+                    id=router_id, project_id='project', name='router',
+                    admin_state_up=True, status='ACTIVE'))
+            for router_id, vip in ((ROUTER_1, '192.168.0.1'), (ROUTER_3, '192.168.0.1')):
+                session.add(ecmp_db.EcmpRoute(
+                    id=uuidutils.generate_uuid(), project_id='project', vip=vip,
+                    next_hops='10.0.0.1,10.0.0.2', router_id=router_id))
+
+    def _dump_ecmp_routes(self, context, router_ids, host, timeout=None):
+        dump = self.dumps[host]
+        if isinstance(dump, Exception):
+            raise dump
+        return dict((router_id, data) for router_id, data in dump.items()
+                    if router_id in router_ids)
+
+    def test_pages(self):
+        self.assertEqual([[ROUTER_1, ROUTER_2], [ROUTER_3]],
+                         list(self.auditor.iter_router_pages()))
+        self.conf.routers = [ROUTER_3, ROUTER_1]
+        self.assertEqual([[ROUTER_1, ROUTER_3]], list(self.auditor.iter_router_pages()))
+
+    def test_report(self):
+        in_sync = {'routes': {'192.168.0.1/32': ['10.0.0.1', '10.0.0.2']}}
+        self.dumps = {'host-1': {ROUTER_1: in_sync, ROUTER_2: {'routes': {}}},
+                      'host-2': {ROUTER_1: {'routes': {'192.168.0.1/32': ['10.0.0.1']}},
+                                 ROUTER_2: {'error': 'no namespace'}}}
+        report = self.auditor.run()
+        summary = report['summary']
+        self.assertEqual(3, summary['routers'])
+        self.assertEqual(4, summary['audited'])
+        self.assertEqual(1, summary['mismatched'])
+        self.assertEqual(1, summary['errors'])
+        # no agent hosts ROUTER_3
+        self.assertEqual(1, summary['not_hosted'])
+        self.assertEqual(2, summary['routers_with_differences'])
+        self.assertEqual(['host-2'], list(report['repair_plan']))
+        self.assertEqual(4, self.agent_rpc.dump_ecmp_routes.call_count)
+
+    def test_unreachable_host_not_asked_again(self):
+        self.dumps = {'host-1': {}, 'host-2': Exception('timeout')}
+        report = self.auditor.run()
+        self.assertEqual(['host-2'], report['summary']['unreachable_hosts'])
+        hosts = [call[0][2] for call in self.agent_rpc.dump_ecmp_routes.call_args_list]
+        self.assertEqual(['host-1', 'host-1', 'host-2'], sorted(hosts))
+        self.assertEqual(2, report['summary']['not_hosted'])
@@ -0,0 +1,137 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+import netaddr
+from neutron.db.models import l3 as l3_models
+from neutron.tests.unit import testlib_api
+from oslo_serialization import jsonutils
+from oslo_utils import uuidutils
+import six
+
+from neutron_ecmp.cmd import transfer
+from neutron_ecmp.db.ecmp import ecmp_db
+from neutron_ecmp.services.ecmp import ecmp_plugin
+
+ROUTER_1 = uuidutils.generate_uuid()
+ROUTER_2 = uuidutils.generate_uuid()
+PORT_ID = uuidutils.generate_uuid()
+ROUTER_SUBNET = {4: [{'cidr': netaddr.IPNetwork('10.0.0.0/24'), 'subnet_id': 'subnet-id',
+                      'port_id': PORT_ID}], 6: []}
+
+
+def _line(vip, next_hops, router_id=ROUTER_1, **kwargs):
+    route = {'id': uuidutils.generate_uuid(), 'project_id': 'project',
+             'router_id': router_id, 'vip': vip, 'next_hops': next_hops}
+    route.update(kwargs)
+    return jsonutils.dumps(route)
+
+
+class TestTransfer(testlib_api.SqlTestCase):
+
+    def setUp(self):
+        super(TestTransfer, self).setUp()
+        with mock.patch.object(ecmp_plugin.EcmpPlugin, '__init__', return_value=None):
+            self.plugin = ecmp_plugin.EcmpPlugin()
+        self.plugin.driver = mock.Mock()
+        self.plugin.driver.resync_routers.return_value = set()
+        mock.patch.object(self.plugin, '_get_router_gw_port_with_cidr',
+                          return_value=ROUTER_SUBNET).start()
+        self.conf = mock.Mock()
+        self.conf.command = mock.Mock(routers=None, page_size=2, chunk_size=2)
+        self.importer = transfer.Importer(self.conf, self.plugin)
+        self.session = self.importer.context.session
+        with self.session.begin(subtransactions=True):
+            for router_id in (ROUTER_1, ROUTER_2):
+                self.session.add(l3_models.Router(
+                    id=router_id, project_id='project', name='router',
+                    admin_state_up=True, status='ACTIVE'))
+
+    def _routes(self):
+        self.session.expire_all()
+        return dict((ecmpr['vip'], ecmp_db.split_next_hops(ecmpr['next_hops']))
+                    for ecmpr in self.session.query(ecmp_db.EcmpRoute))
+
+    def _import(self, *lines):
+        return self.importer.run(six.StringIO(''.join(line + '\n' for line in lines)))
+
+    def test_load_chunk(self):
+        self.importer.load_chunk([(1, _line('192.168.0.1', ['10.0.0.5'])),
+                                  (2, _line('192.168.0.1', ['10.0.0.6'])),
+                                  (3, _line('192.168.0.2', ['10.0.0.5'],
+                                            router_id=uuidutils.generate_uuid())),
+                                  (4, '{"vip": "192.168.0.3"}'),
+                                  (5, _line('192.168.0.9/24', ['10.0.0.5']))])
+        self.assertEqual({'192.168.0.1': ['10.0.0.5']}, self._routes())
+        self.assertEqual({'written': 1, 'existing': 1, 'missing_router': 1},
+                         dict(self.importer.summary))
+        self.assertEqual([4, 5], [invalid['line'] for invalid in self.importer.invalid])
+        # nothing is notified before the routes are validated
+        self.assertEqual(0, self.session.query(ecmp_db.EcmpNotification).count())
+
+    def test_router_map(self):
+        self.importer.router_map = {'exported-router': ROUTER_2}
+        self.importer.load_chunk([(1, _line('192.168.0.1', ['10.0.0.5'],
+                                            router_id='exported-router'))])
+        self.assertEqual([ROUTER_2], list(self.importer.route_ids_of_router))
+
+    def test_finish_deletes_invalid_routes(self):
+        report = self._import(_line('192.168.0.1', ['10.0.0.5'], hash_policy='L4'),
+                              _line('192.168.0.2', ['10.1.0.5']),
+                              _line('192.168.0.3', ['10.0.0.6'], hash_policy='L3'),
+                              _line('192.168.0.4', ['10.0.0.5', '10.0.0.6']))
+        self.assertEqual({'192.168.0.1': ['10.0.0.5'],
+                          '192.168.0.4': ['10.0.0.5', '10.0.0.6']}, self._routes())
+        self.assertEqual(['192.168.0.2', '192.168.0.3'],
+                         sorted(invalid['vip'] for invalid in report['invalid']))
+        self.assertEqual(2, report['summary']['imported'])
+        refcounts = self.session.query(ecmp_db.EcmpNextHopRefcount)
+        self.assertEqual({'10.0.0.5': 2, '10.0.0.6': 1},
+                         dict((row.next_hop, row.refcount) for row in refcounts))
+
+    def test_routers_resynced_once(self):
+        report = self._import(_line('192.168.0.1', ['10.0.0.5']),
+                              _line('192.168.0.2', ['10.0.0.5']),
+                              _line('192.168.0.1', ['10.0.0.5'], router_id=ROUTER_2))
+        self.plugin.driver.resync_routers.assert_called_once_with(
+            mock.ANY, sorted([ROUTER_1, ROUTER_2]))
+        self.assertEqual(2, report['summary']['resynced_routers'])
+        self.assertEqual(0, self.session.query(ecmp_db.EcmpNotification).count())
+
+    def test_failed_router_not_resynced(self):
+        with mock.patch.object(self.plugin, 'finish_ecmp_route_import',
+                               side_effect=[RuntimeError('boom'), []]):
+            report = self._import(_line('192.168.0.1', ['10.0.0.5']),
+                                  _line('192.168.0.1', ['10.0.0.5'], router_id=ROUTER_2))
+        failed = sorted([ROUTER_1, ROUTER_2])[0]
+        self.assertEqual([failed], report['summary']['failed_routers'])
+        self.plugin.driver.resync_routers.assert_called_once_with(
+            mock.ANY, sorted([ROUTER_1, ROUTER_2])[1:])
+
+    def test_export_import(self):
+        self._import(_line('192.168.0.1', ['10.0.0.5'], hash_policy='L4'),
+                     _line('192.168.0.2', ['10.0.0.5', '10.0.0.6']),
+                     _line('192.168.0.3', ['10.0.0.6']))
+        stream = six.StringIO()
+        self.assertEqual(3, transfer.Exporter(self.conf).run(stream))
+        route_ids = [jsonutils.loads(line)['id'] for line in stream.getvalue().splitlines()]
+        self.assertEqual(sorted(route_ids), route_ids)
+        with self.session.begin(subtransactions=True):
+            self.session.query(ecmp_db.EcmpRoute).delete()
+        self.importer = transfer.Importer(self.conf, self.plugin)
+        self.importer.run(six.StringIO(stream.getvalue()))
+        self.assertEqual({'192.168.0.1': ['10.0.0.5'],
+                          '192.168.0.2': ['10.0.0.5', '10.0.0.6'],
+                          '192.168.0.3': ['10.0.0.6']}, self._routes())
@@ -0,0 +1,65 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from neutron_ecmp.common import ecmp_cache
+from neutron_ecmp.tests import base
+
+
+class TestGenerationCache(base.BaseTestCase):
+
+    def test_get_at_generation(self):
+        cache = ecmp_cache.GenerationCache(10)
+        cache.set('router-1', 3, 'value')
+        self.assertEqual('value', cache.get('router-1', 3))
+        self.assertEqual(1, cache.hits)
+
+    def test_other_generation_misses(self):
+        cache = ecmp_cache.GenerationCache(10)
+        cache.set('router-1', 3, 'value')
+        self.assertIsNone(cache.get('router-1', 4))
+        self.assertIsNone(cache.get('router-2', 3))
+        self.assertEqual(2, cache.misses)
+        # a stale entry is dropped on its miss
+        self.assertEqual(0, len(cache))
+
+    def test_least_recently_used_evicted(self):
+        cache = ecmp_cache.GenerationCache(2)
+        cache.set('router-1', 1, 'value-1')
+        cache.set('router-2', 1, 'value-2')
+        cache.get('router-1', 1)
+        cache.set('router-3', 1, 'value-3')
+        self.assertEqual(2, len(cache))
+        self.assertIsNone(cache.get('router-2', 1))
+        self.assertEqual('value-1', cache.get('router-1', 1))
+        self.assertEqual('value-3', cache.get('router-3', 1))
+
+    def test_set_replaces(self):
+        cache = ecmp_cache.GenerationCache(2)
+        cache.set('router-1', 1, 'value-1')
+        cache.set('router-1', 2, 'value-2')
+        self.assertEqual(1, len(cache))
+        self.assertEqual('value-2', cache.get('router-1', 2))
+
+    def test_size_zero_disables(self):
+        cache = ecmp_cache.GenerationCache(0)
+        cache.set('router-1', 1, 'value')
+        self.assertEqual(0, len(cache))
+        self.assertIsNone(cache.get('router-1', 1))
+
+    def test_clear(self):
+        cache = ecmp_cache.GenerationCache(10)
+        cache.set('router-1', 1, 'value')
+        cache.clear()
+        self.assertIsNone(cache.get('router-1', 1))
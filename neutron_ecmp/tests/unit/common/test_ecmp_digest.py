@@ -0,0 +1,49 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from neutron_ecmp.common import ecmp_digest
+from neutron_ecmp.tests import base
+
+
+def _route(route_id, revision=1, next_hops=('10.0.0.1', '10.0.0.2'), **kwargs):
+    route = {'id': route_id, 'revision': revision, 'next_hops': list(next_hops)}
+    route.update(kwargs)
+    return route
+
+
+class TestRoutesDigest(base.BaseTestCase):
+
+    def _digest(self, *routes):
+        return ecmp_digest.get_routes_digest(routes)
+
+    def test_order_ignored(self):
+        self.assertEqual(
+            self._digest(_route('route-1'), _route('route-2', next_hops=['10.0.0.2', '10.0.0.1'])),
+            self._digest(_route('route-2'), _route('route-1')))
+
+    def test_other_keys_ignored(self):
+        self.assertEqual(self._digest(_route('route-1')),
+                         self._digest(_route('route-1', vip='192.168.0.1', hash_policy='L4')))
+
+    def test_changes(self):
+        digest = self._digest(_route('route-1'))
+        self.assertNotEqual(digest, self._digest(_route('route-1', revision=2)))
+        self.assertNotEqual(digest, self._digest(_route('route-1', next_hops=['10.0.0.1'])))
+        self.assertNotEqual(digest, self._digest(_route('route-1'), _route('route-2')))
+        self.assertNotEqual(digest, self._digest())
+
+    def test_no_revision(self):
+        self.assertEqual(self._digest(_route('route-1', revision=None)),
+                         self._digest(_route('route-1', revision=-1)))
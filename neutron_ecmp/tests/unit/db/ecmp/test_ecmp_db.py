@@ -0,0 +1,219 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+from neutron.db.models import l3 as l3_models
+from neutron.tests.unit import testlib_api
+from neutron_lib.callbacks import events
+from neutron_lib.callbacks import resources
+from neutron_lib import constants as n_const
+from neutron_lib import context as n_context
+from oslo_utils import uuidutils
+
+from neutron_ecmp.api.definitions import ecmp as ecmp_ext
+from neutron_ecmp.db.ecmp import ecmp_db
+from neutron_ecmp.tests import base
+
+ROUTER_ID = uuidutils.generate_uuid()
+
+
+def _port(router_id, ip_address='10.0.0.1', device_owner=n_const.DEVICE_OWNER_DVR_INTERFACE):
+    return {'id': 'port-id', 'device_id': router_id, 'device_owner': device_owner,
+            'fixed_ips': [{'subnet_id': 'subnet-id', 'ip_address': ip_address}]}
+
+
+class TestEcmpRouterPortCallback(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestEcmpRouterPortCallback, self).setUp()
+        self.plugin = mock.Mock()
+        mock.patch('neutron_lib.plugins.directory.get_plugin',
+                   return_value=self.plugin).start()
+        self.context = mock.Mock()
+
+    def _bumped(self):
+        bump = self.plugin.bump_router_interface_generations
+        if not bump.called:
+            return None
+        context, router_ids = bump.call_args[0]
+        self.assertIs(self.context, context)
+        return set(router_ids)
+
+    def test_kwargs_create(self):
+        ecmp_db.ecmp_router_port_callback(
+            resources.PORT, events.PRECOMMIT_CREATE, mock.ANY,
+            context=self.context, port=_port('router-1'))
+        self.assertEqual(set(['router-1']), self._bumped())
+
+    def test_kwargs_not_router_port(self):
+        ecmp_db.ecmp_router_port_callback(
+            resources.PORT, events.PRECOMMIT_CREATE, mock.ANY,
+            context=self.context, port=_port('vm-1', device_owner='compute:nova'))
+        self.assertIsNone(self._bumped())
+
+    def test_payload_update_fixed_ips(self):
+        payload = events.DBEventPayload(
+            self.context, states=(_port('router-1'),), resource_id='port-id',
+            desired_state=_port('router-1', ip_address='10.0.0.2'))
+        ecmp_db.ecmp_router_port_callback(
+            resources.PORT, events.PRECOMMIT_UPDATE, mock.ANY, payload=payload)
+        self.assertEqual(set(['router-1']), self._bumped())
+
+    def test_payload_update_moves_port(self):
+        payload = events.DBEventPayload(
+            self.context, states=(_port('router-1'),), resource_id='port-id',
+            desired_state=_port('router-2'))
+        ecmp_db.ecmp_router_port_callback(
+            resources.PORT, events.PRECOMMIT_UPDATE, mock.ANY, payload=payload)
+        self.assertEqual(set(['router-1', 'router-2']), self._bumped())
+
+    def test_payload_update_unchanged(self):
+        port = _port('router-1')
+        updated = dict(port, name='renamed')
+        payload = events.DBEventPayload(
+            self.context, states=(port,), resource_id='port-id',
+            desired_state=updated)
+        ecmp_db.ecmp_router_port_callback(
+            resources.PORT, events.PRECOMMIT_UPDATE, mock.ANY, payload=payload)
+        self.assertIsNone(self._bumped())
+
+
+class TestEcmpRouterDeleteCallbacks(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestEcmpRouterDeleteCallbacks, self).setUp()
+        self.plugin = mock.Mock()
+        mock.patch('neutron_lib.plugins.directory.get_plugin',
+                   return_value=self.plugin).start()
+        self.context = mock.Mock()
+
+    def test_router_delete_purges(self):
+        ecmp_db.ecmp_router_delete_callback(
+            resources.ROUTER, events.AFTER_DELETE, mock.ANY,
+            context=self.context, router_id=ROUTER_ID)
+        self.plugin.purge_ecmp_routers.assert_called_once_with(self.context, [ROUTER_ID])
+
+    def test_router_interface_delete_resyncs(self):
+        ecmp_db.ecmp_router_interface_delete_callback(
+            resources.ROUTER_INTERFACE, events.AFTER_DELETE, mock.ANY,
+            context=self.context, router_id=ROUTER_ID, subnet_id='subnet-id')
+        self.plugin.resync_ecmp_routers_of_interface.assert_called_once_with(
+            self.context, ROUTER_ID)
+
+    def test_subscribed(self):
+        with mock.patch.object(ecmp_db.registry, 'subscribe') as subscribe:
+            ecmp_db.subscribe()
+        subscribe.assert_any_call(ecmp_db.ecmp_router_delete_callback,
+                                  resources.ROUTER, events.AFTER_DELETE)
+        subscribe.assert_any_call(ecmp_db.ecmp_router_interface_delete_callback,
+                                  resources.ROUTER_INTERFACE, events.AFTER_DELETE)
+
+
+class TestEcmpRouteStatus(testlib_api.SqlTestCase):
+
+    def setUp(self):
+        super(TestEcmpRouteStatus, self).setUp()
+        self.plugin = ecmp_db.Ecmp_db_mixin()
+        self.context = n_context.get_admin_context()
+        with self.context.session.begin(subtransactions=True):
+            self.context.session.add(l3_models.Router(
+                id=ROUTER_ID, project_id='project', name='router',
+                admin_state_up=True, status='ACTIVE'))
+        self.route_ids = [self._add_route('192.168.0.%d' % i) for i in (1, 2)]
+
+    def _add_route(self, vip):
+        route_id = uuidutils.generate_uuid()
+        with self.context.session.begin(subtransactions=True):
+            self.context.session.add(ecmp_db.EcmpRoute(
+                id=route_id, project_id='project', vip=vip,
+                next_hops='10.0.0.5', router_id=ROUTER_ID))
+        return route_id
+
+    def _revision(self, route_id):
+        return self.plugin.get_ecmp_route(self.context, route_id)['revision_number']
+
+    def _status(self, route_id):
+        self.context.session.expire_all()
+        return self.plugin.get_ecmp_route(self.context, route_id)['status']
+
+    def _report(self, host, route_id, status=ecmp_ext.STATUS_ACTIVE, revision=None):
+        if revision is None:
+            revision = self._revision(route_id)
+        self.plugin._update_ecmp_route_hosts(self.context, host, [
+            {'id': route_id, 'revision': revision, 'status': status}])
+
+    def test_pending_until_sent(self):
+        self.assertEqual(ecmp_ext.STATUS_PENDING, self._status(self.route_ids[0]))
+
+    def test_active_once_all_hosts_realized(self):
+        route_id = self.route_ids[0]
+        self.plugin._set_ecmp_route_hosts(self.context, {route_id: ['host-1', 'host-2']})
+        self.assertEqual(ecmp_ext.STATUS_PENDING, self._status(route_id))
+        self._report('host-1', route_id)
+        self.assertEqual(ecmp_ext.STATUS_PENDING, self._status(route_id))
+        self._report('host-2', route_id)
+        self.assertEqual(ecmp_ext.STATUS_ACTIVE, self._status(route_id))
+        self.assertEqual({'host-1': self._revision(route_id),
+                          'host-2': self._revision(route_id)},
+                         self.plugin.get_ecmp_route(
+                             self.context, route_id)['realized_revisions'])
+
+    def test_error_when_one_host_failed(self):
+        route_id = self.route_ids[0]
+        self.plugin._set_ecmp_route_hosts(self.context, {route_id: ['host-1', 'host-2']})
+        self._report('host-1', route_id)
+        self._report('host-2', route_id, status=ecmp_ext.STATUS_ERROR)
+        self.assertEqual(ecmp_ext.STATUS_ERROR, self._status(route_id))
+
+    def test_new_host_makes_route_pending(self):
+        route_id = self.route_ids[0]
+        self.plugin._set_ecmp_route_hosts(self.context, {route_id: ['host-1']})
+        self._report('host-1', route_id)
+        self.assertEqual(ecmp_ext.STATUS_ACTIVE, self._status(route_id))
+        self.plugin._set_ecmp_route_hosts(self.context, {route_id: ['host-2']})
+        self.assertEqual(ecmp_ext.STATUS_PENDING, self._status(route_id))
+
+    def test_older_report_ignored(self):
+        route_id = self.route_ids[0]
+        revision = self._revision(route_id)
+        self.plugin._set_ecmp_route_hosts(self.context, {route_id: ['host-1']})
+        self._report('host-1', route_id, revision=revision + 1)
+        self._report('host-1', route_id, status=ecmp_ext.STATUS_ERROR,
+                     revision=revision)
+        self.assertEqual(ecmp_ext.STATUS_ACTIVE, self._status(route_id))
+        self.assertEqual({'host-1': revision + 1}, self.plugin.get_ecmp_route(
+            self.context, route_id)['realized_revisions'])
+
+    def test_report_written_with_one_update(self):
+        self.plugin._set_ecmp_route_hosts(self.context, dict(
+            (route_id, ['host-1']) for route_id in self.route_ids))
+        statuses = [{'id': route_id, 'revision': self._revision(route_id),
+                     'status': ecmp_ext.STATUS_ACTIVE}
+                    for route_id in self.route_ids]
+        with mock.patch.object(self.context.session, 'execute',
+                               wraps=self.context.session.execute) as execute:
+            self.plugin._update_ecmp_route_hosts(self.context, 'host-1', statuses)
+        execute.assert_called_once_with(mock.ANY, mock.ANY)
+        self.assertEqual(2, len(execute.call_args[0][1]))
+        for route_id in self.route_ids:
+            self.assertEqual(ecmp_ext.STATUS_ACTIVE, self._status(route_id))
+
+    def test_report_of_unknown_host_ignored(self):
+        route_id = self.route_ids[0]
+        self.plugin._set_ecmp_route_hosts(self.context, {route_id: ['host-1']})
+        self._report('host-2', route_id)
+        self.assertEqual(ecmp_ext.STATUS_PENDING, self._status(route_id))
+        self.assertEqual({}, self.plugin.get_ecmp_route(
+            self.context, route_id)['realized_revisions'])
@@ -0,0 +1,63 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+from neutron.tests.unit.api.v2 import test_base
+from neutron.tests.unit.extensions import base as test_extensions_base
+from oslo_utils import uuidutils
+from webob import exc
+
+from neutron_ecmp.extensions import ecmp
+from neutron_ecmp.services.ecmp import ecmp_plugin
+
+ECMP_PLUGIN = '%s.EcmpPlugin' % ecmp_plugin.__name__
+
+
+class EcmpExtensionTestCase(test_extensions_base.ExtensionTestCase):
+    fmt = 'json'
+
+    def setUp(self):
+        super(EcmpExtensionTestCase, self).setUp()
+        self.setup_extension(ECMP_PLUGIN, 'ECMP', ecmp.Ecmp, '',
+                             supported_extension_aliases=['ecmp'])
+        self.instance = self.plugin.return_value
+
+    def _route(self, vip):
+        return {'ecmp_route': {'tenant_id': uuidutils.generate_uuid(),
+                               'router_id': uuidutils.generate_uuid(),
+                               'vip': vip,
+                               'next_hops': ['10.0.0.2', '10.0.0.3']}}
+
+    def _post(self, data):
+        return self.api.post(test_base._get_path('ecmp_routes', fmt=self.fmt),
+                             self.serialize(data),
+                             content_type='application/%s' % self.fmt)
+
+    def test_create_ecmp_route_bulk(self):
+        setattr(self.instance, '_%s__native_bulk_support' %
+                self.instance.__class__.__name__, True)
+        routes = [self._route('192.168.0.1'), self._route('192.168.0.2')]
+        self.instance.create_ecmp_route_bulk.return_value = [
+            dict(route['ecmp_route'], id=uuidutils.generate_uuid())
+            for route in routes]
+        res = self._post({'ecmp_routes': routes})
+        self.assertEqual(exc.HTTPCreated.code, res.status_int)
+        self.instance.create_ecmp_route_bulk.assert_called_once_with(
+            mock.ANY, ecmp_routes=mock.ANY)
+        body = self.instance.create_ecmp_route_bulk.call_args[1]['ecmp_routes']
+        self.assertEqual(['192.168.0.1', '192.168.0.2'],
+                         [route['ecmp_route']['vip']
+                          for route in body['ecmp_routes']])
+        self.assertEqual(2, len(self.deserialize(res)['ecmp_routes']))
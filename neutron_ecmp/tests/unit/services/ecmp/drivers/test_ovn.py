@@ -0,0 +1,198 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import contextlib
+
+import mock
+from oslo_utils import uuidutils
+from ovsdbapp.backend.ovs_idl import idlutils
+
+from neutron_ecmp.api.definitions import ecmp as ecmp_ext
+from neutron_ecmp.services.ecmp.drivers import ovn
+from neutron_ecmp.tests import base
+
+ROUTER_ID = 'router-1'
+ROUTER_NAME = ovn.ovn_router_name(ROUTER_ID)
+
+
+class FakeRow(object):
+    def __init__(self, **columns):
+        self.uuid = uuidutils.generate_uuid()
+        self.__dict__.update(columns)
+
+
+class FakeCommand(object):
+    def __init__(self, run):
+        self._run = run
+        self.result = None
+
+    def execute(self):
+        self.result = self._run()
+
+
+class FakeTransaction(object):
+    def __init__(self):
+        self.commands = []
+
+    def add(self, command):
+        self.commands.append(command)
+        return command
+
+
+class FakeNbApi(object):
+    """The two northbound tables of the driver, in memory.
+
+    The commands of a transaction are applied when it ends, like the
+    OVSDB IDL does; one failing aborts them all.
+    """
+
+    def __init__(self):
+        self.routers = {}
+        self.fail = False
+
+    def add_router(self, name):
+        self.routers[name] = FakeRow(name=name, static_routes=[])
+
+    def add_route(self, router_name, ip_prefix, nexthop, ecmp=True, options=None):
+        row = FakeRow(ip_prefix=ip_prefix, nexthop=nexthop, policy='dst-ip',
+                      options=options or {},
+                      external_ids={ovn.ECMP_ROUTE_ID_KEY: 'route-1'} if ecmp else {})
+        self.routers[router_name].static_routes.append(row)
+        return row
+
+    def lookup(self, table, name):
+        try:
+            return self.routers[name]
+        except KeyError:
+            raise idlutils.RowNotFound(table=table, col='name', match=name)
+
+    @contextlib.contextmanager
+    def transaction(self, check_error=False):
+        txn = FakeTransaction()
+        yield txn
+        if self.fail:
+            raise RuntimeError('transaction failed')
+        for command in txn.commands:
+            command.execute()
+
+    def _get_route(self, uuid):
+        for router in self.routers.values():
+            for row in router.static_routes:
+                if row.uuid == uuid:
+                    return row
+
+    def db_create(self, table, **columns):
+        return FakeCommand(lambda: FakeRow(**columns))
+
+    def db_add(self, table, record, column, value):
+        def run():
+            getattr(self.routers[record], column).append(value.result)
+        return FakeCommand(run)
+
+    def db_remove(self, table, record, column, uuid):
+        def run():
+            rows = getattr(self.routers[record], column)
+            rows[:] = [row for row in rows if row.uuid != uuid]
+        return FakeCommand(run)
+
+    def db_set(self, table, uuid, *col_values):
+        def run():
+            row = self._get_route(uuid)
+            for column, value in col_values:
+                setattr(row, column, value)
+        return FakeCommand(run)
+
+
+class TestOvnNbDriver(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestOvnNbDriver, self).setUp()
+        self.plugin = mock.Mock()
+        self.nb_api = FakeNbApi()
+        self.nb_api.add_router(ROUTER_NAME)
+        self.driver = ovn.OvnNbDriver(self.plugin, nb_api=self.nb_api)
+        self.context = mock.Mock()
+
+    def _route(self, next_hops, operation='replace', vip='192.168.0.10', revision=2):
+        return {'id': 'route-1', 'router_id': ROUTER_ID, 'vip': vip,
+                'next_hops': next_hops, 'operation': operation,
+                'revision': revision}
+
+    def _static_routes(self, ecmp=True):
+        return sorted((row.ip_prefix, row.nexthop)
+                      for row in self.nb_api.routers[ROUTER_NAME].static_routes
+                      if (ovn.ECMP_ROUTE_ID_KEY in row.external_ids) == ecmp)
+
+    def test_create(self):
+        failed = self.driver.realize_ecmp_routes(
+            self.context, [self._route(['10.0.0.2', '10.0.0.1'])])
+        self.assertEqual(set(), failed)
+        self.assertEqual([('192.168.0.10/32', '10.0.0.1'),
+                          ('192.168.0.10/32', '10.0.0.2')], self._static_routes())
+        for row in self.nb_api.routers[ROUTER_NAME].static_routes:
+            self.assertEqual({}, row.options)
+            self.assertEqual({ovn.ECMP_ROUTE_ID_KEY: 'route-1'}, row.external_ids)
+        self.plugin._set_ecmp_route_hosts.assert_called_once_with(
+            self.context, {'route-1': set([ovn.OVN_HOST])})
+        self.plugin._update_ecmp_route_hosts.assert_called_once_with(
+            self.context, ovn.OVN_HOST,
+            [{'id': 'route-1', 'revision': 2, 'status': ecmp_ext.STATUS_ACTIVE}])
+
+    def test_update(self):
+        kept = self.nb_api.add_route(ROUTER_NAME, '192.168.0.10/32', '10.0.0.2')
+        self.nb_api.add_route(ROUTER_NAME, '192.168.0.10/32', '10.0.0.1')
+        self.driver.realize_ecmp_routes(
+            self.context, [self._route(['10.0.0.2', '10.0.0.3'])])
+        self.assertEqual([('192.168.0.10/32', '10.0.0.2'),
+                          ('192.168.0.10/32', '10.0.0.3')], self._static_routes())
+        self.assertIn(kept, self.nb_api.routers[ROUTER_NAME].static_routes)
+
+    def test_update_drops_duplicates(self):
+        self.nb_api.add_route(ROUTER_NAME, '192.168.0.10/32', '10.0.0.1')
+        self.nb_api.add_route(ROUTER_NAME, '192.168.0.10/32', '10.0.0.1')
+        self.driver.realize_ecmp_routes(self.context, [self._route(['10.0.0.1'])])
+        self.assertEqual([('192.168.0.10/32', '10.0.0.1')], self._static_routes())
+
+    def test_update_options(self):
+        self.config(ovn_ecmp_symmetric_reply=True, group='ecmp')
+        self.nb_api.add_route(ROUTER_NAME, '192.168.0.10/32', '10.0.0.1')
+        self.driver.realize_ecmp_routes(
+            self.context, [self._route(['10.0.0.1', '10.0.0.2'])])
+        for row in self.nb_api.routers[ROUTER_NAME].static_routes:
+            self.assertEqual({'ecmp_symmetric_reply': 'true'}, row.options)
+
+    def test_delete_leaves_other_routes(self):
+        self.nb_api.add_route(ROUTER_NAME, '192.168.0.10/32', '10.0.0.1')
+        self.nb_api.add_route(ROUTER_NAME, '192.168.0.10/32', '10.0.0.9', ecmp=False)
+        self.nb_api.add_route(ROUTER_NAME, '192.168.0.11/32', '10.0.0.1')
+        failed = self.driver.realize_ecmp_routes(
+            self.context, [self._route(['10.0.0.1'], operation='delete')])
+        self.assertEqual(set(), failed)
+        self.assertEqual([('192.168.0.11/32', '10.0.0.1')], self._static_routes())
+        self.assertEqual([('192.168.0.10/32', '10.0.0.9')], self._static_routes(ecmp=False))
+        self.plugin._update_ecmp_route_hosts.assert_called_once_with(
+            self.context, ovn.OVN_HOST, [])
+
+    def test_no_logical_router(self):
+        route = dict(self._route(['10.0.0.1']), router_id='router-2')
+        self.assertEqual(set(), self.driver.realize_ecmp_routes(self.context, [route]))
+        self.assertEqual([], self._static_routes())
+
+    def test_transaction_failure(self):
+        self.nb_api.fail = True
+        failed = self.driver.realize_ecmp_routes(self.context, [self._route(['10.0.0.1'])])
+        self.assertEqual(set([ROUTER_ID]), failed)
+        self.assertEqual([], self._static_routes())
+        self.assertFalse(self.plugin._update_ecmp_route_hosts.called)
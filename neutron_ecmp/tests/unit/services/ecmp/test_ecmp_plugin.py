@@ -0,0 +1,656 @@
+# Copyright 2019 Inspur Cloud Service Group.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+
+import mock
+import netaddr
+from neutron.db.models import l3 as l3_models
+from neutron.tests.unit import testlib_api
+from neutron_lib.api.definitions import portbindings
+from neutron_lib import constants as n_const
+from neutron_lib import context as n_context
+from oslo_config import cfg
+from oslo_serialization import jsonutils
+from oslo_utils import timeutils
+from oslo_utils import uuidutils
+
+from neutron_ecmp.common import ecmp_cache
+from neutron_ecmp.common import ecmp_digest
+from neutron_ecmp.common import ecmp_exceptions as exception
+from neutron_ecmp.db.ecmp import ecmp_db
+from neutron_ecmp.services.ecmp import ecmp_plugin
+from neutron_ecmp.tests import base
+
+ROUTER_ID = uuidutils.generate_uuid()
+PORT_1 = uuidutils.generate_uuid()
+PORT_2 = uuidutils.generate_uuid()
+
+
+def _router_subnet(*subnets):
+    router_subnet = {4: [], 6: []}
+    for cidr, port_id in subnets:
+        cidr = netaddr.IPNetwork(cidr)
+        router_subnet[cidr.version].append(
+            {'cidr': cidr, 'subnet_id': 'subnet-%s' % port_id, 'port_id': port_id})
+    for subnets in router_subnet.values():
+        subnets.sort(key=lambda rs: rs['cidr'].prefixlen, reverse=True)
+    return router_subnet
+
+
+class TestMergeEcmpNotifications(base.BaseTestCase):
+
+    def test_later_routing_wins(self):
+        merged = ecmp_plugin.merge_ecmp_notifications(
+            {'operation': 'replace', 'next_hops': ['10.0.0.1']},
+            {'operation': 'delete', 'next_hops': ['10.0.0.2']})
+        self.assertEqual('delete', merged['operation'])
+        self.assertEqual(['10.0.0.2'], merged['next_hops'])
+
+    def test_proxy_changes_applied_in_order(self):
+        merged = ecmp_plugin.merge_ecmp_notifications(
+            {'set_arp_proxy_qrs': ['qr-1', 'qr-2'], 'unset_arp_proxy_qrs': ['qr-3']},
+            {'set_arp_proxy_qrs': ['qr-3'], 'unset_arp_proxy_qrs': ['qr-2']})
+        self.assertEqual(['qr-1', 'qr-3'], merged['set_arp_proxy_qrs'])
+        self.assertEqual(['qr-2'], merged['unset_arp_proxy_qrs'])
+
+    def test_proxy_changes_of_previous_kept(self):
+        merged = ecmp_plugin.merge_ecmp_notifications(
+            {'set_arp_proxy_qrs': ['qr-1'], 'unset_arp_proxy_qrs': ['qr-2']}, {})
+        self.assertEqual(['qr-1'], merged['set_arp_proxy_qrs'])
+        self.assertEqual(['qr-2'], merged['unset_arp_proxy_qrs'])
+
+
+class TestQrPortRefcounts(testlib_api.SqlTestCase):
+
+    def setUp(self):
+        super(TestQrPortRefcounts, self).setUp()
+        with mock.patch.object(ecmp_plugin.EcmpPlugin, '__init__', return_value=None):
+            self.plugin = ecmp_plugin.EcmpPlugin()
+        self.context = n_context.get_admin_context()
+        with self.context.session.begin(subtransactions=True):
+            self.context.session.add(l3_models.Router(
+                id=ROUTER_ID, project_id='project', name='router',
+                admin_state_up=True, status='ACTIVE'))
+        self.router_subnet = _router_subnet(('10.0.0.0/24', PORT_1), ('10.1.0.0/24', PORT_2))
+
+    def _add_route(self, vip, next_hops):
+        with self.context.session.begin(subtransactions=True):
+            self.context.session.add(ecmp_db.EcmpRoute(
+                id=uuidutils.generate_uuid(), project_id='project', vip=vip,
+                next_hops=','.join(next_hops), router_id=ROUTER_ID))
+
+    def _apply(self, added, removed, router_subnet=None):
+        with self.context.session.begin(subtransactions=True):
+            return self.plugin._apply_next_hop_changes(
+                self.context, ROUTER_ID, added, removed,
+                router_subnet or self.router_subnet)
+
+    def _get_next_hop_refcounts(self):
+        query = self.context.session.query(ecmp_db.EcmpNextHopRefcount)
+        return dict((row.next_hop, (row.port_id, row.refcount)) for row in query)
+
+    def _get_port_refcounts(self):
+        query = self.context.session.query(ecmp_db.EcmpQrPortRefcount)
+        return dict((row.port_id, row.refcount) for row in query)
+
+    def _qr(self, port_id):
+        return self.plugin._get_router_qr_name(port_id)
+
+    def test_rebuild_counts_routes_once(self):
+        self._add_route('192.168.0.1', ['10.0.0.5', '10.0.0.5', '10.1.0.5'])
+        self._add_route('192.168.0.2', ['10.0.0.5'])
+        self.assertEqual([], self._apply(['10.0.0.6'], []))
+        self.assertEqual({'10.0.0.5': (PORT_1, 2), '10.0.0.6': (PORT_1, 1),
+                          '10.1.0.5': (PORT_2, 1)}, self._get_next_hop_refcounts())
+        self.assertEqual({PORT_1: 2, PORT_2: 1}, self._get_port_refcounts())
+
+    def test_duplicate_next_hops_counted_once(self):
+        self._apply(['10.0.0.5', '10.0.0.5'], [])
+        self.assertEqual([self._qr(PORT_1)], self._apply([], ['10.0.0.5', '10.0.0.5']))
+        self.assertEqual({}, self._get_next_hop_refcounts())
+        self.assertEqual({}, self._get_port_refcounts())
+
+    def test_port_unused_with_its_last_next_hop(self):
+        self._apply(['10.0.0.5', '10.0.0.6', '10.1.0.5'], [])
+        self._apply(['10.0.0.5'], [])
+        self.assertEqual([], self._apply([], ['10.0.0.5', '10.0.0.6']))
+        self.assertEqual([self._qr(PORT_1)], self._apply([], ['10.0.0.5']))
+        self.assertEqual({PORT_2: 1}, self._get_port_refcounts())
+
+    def test_removed_from_the_port_it_was_charged_to(self):
+        self._apply(['10.0.0.5'], [])
+        # the next hop is now in the subnet of another interface
+        router_subnet = _router_subnet(('10.0.0.0/16', PORT_2))
+        self.assertEqual([self._qr(PORT_1)],
+                         self._apply([], ['10.0.0.5'], router_subnet))
+        self.assertEqual({}, self._get_port_refcounts())
+
+    def test_no_rebuild_once_built(self):
+        with mock.patch.object(self.plugin, '_get_next_hop_refcounts',
+                               wraps=self.plugin._get_next_hop_refcounts) as rebuild:
+            self._apply(['10.0.0.5'], [])
+            self._apply([], ['10.0.0.5'])
+            self._apply(['10.0.0.5'], [])
+        self.assertEqual(1, rebuild.call_count)
+        self.assertEqual({PORT_1: 1}, self._get_port_refcounts())
+
+
+class TestEcmpNotificationRetry(testlib_api.SqlTestCase):
+
+    def setUp(self):
+        super(TestEcmpNotificationRetry, self).setUp()
+        with mock.patch.object(ecmp_plugin.EcmpPlugin, '__init__', return_value=None):
+            self.plugin = ecmp_plugin.EcmpPlugin()
+        self.plugin.driver = mock.Mock()
+        self.plugin.driver.realize_ecmp_routes.return_value = set([ROUTER_ID])
+        self.context = n_context.get_admin_context()
+        with self.context.session.begin(subtransactions=True):
+            self.context.session.add(l3_models.Router(
+                id=ROUTER_ID, project_id='project', name='router',
+                admin_state_up=True, status='ACTIVE'))
+        self.plugin._rpc_notify_ecmp_route(self.context, 'replace', '192.168.0.1',
+                                           ['10.0.0.5'], ROUTER_ID)
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+
+    def _get_notifications(self):
+        self.context.session.expire_all()
+        return self.context.session.query(ecmp_db.EcmpNotification).all()
+
+    def _dispatch(self):
+        self.plugin.driver.realize_ecmp_routes.reset_mock()
+        self.plugin._dispatch_ecmp_notifications()
+        return self.plugin.driver.realize_ecmp_routes.called
+
+    def test_failed_notification_kept_with_backoff(self):
+        for attempts, delay in ((1, 1), (2, 2), (3, 4)):
+            self.assertTrue(self._dispatch())
+            notification, = self._get_notifications()
+            self.assertEqual(attempts, notification.attempts)
+            self.assertEqual(timeutils.utcnow() + datetime.timedelta(seconds=delay),
+                             notification.next_attempt_at)
+            # not tried again before it is due
+            self.assertFalse(self._dispatch())
+            timeutils.advance_time_seconds(delay)
+
+    def test_retry_delay_bounded(self):
+        self.config(notification_retry_interval=2, notification_max_retry_interval=60,
+                    group='ecmp')
+        self.assertEqual([2, 4, 8, 16, 32, 60, 60],
+                         [self.plugin._get_notification_retry_delay(attempts)
+                          for attempts in (1, 2, 3, 4, 5, 6, 1000)])
+
+    def test_later_notification_waits_for_the_failed_one(self):
+        self._dispatch()
+        self.plugin._rpc_notify_ecmp_route(self.context, 'replace', '192.168.0.2',
+                                           ['10.0.0.5'], ROUTER_ID)
+        self.assertFalse(self._dispatch())
+        timeutils.advance_time_seconds(1)
+        self.plugin.driver.realize_ecmp_routes.return_value = set()
+        self.assertTrue(self._dispatch())
+        routes = self.plugin.driver.realize_ecmp_routes.call_args[0][1]
+        self.assertEqual(['192.168.0.1', '192.168.0.2'], [route['vip'] for route in routes])
+        self.assertEqual([], self._get_notifications())
+
+    def test_not_dropped_after_max_attempts(self):
+        self.config(notification_max_attempts=1, group='ecmp')
+        for _ in range(3):
+            self._dispatch()
+            timeutils.advance_time_seconds(cfg.CONF.ecmp.notification_max_retry_interval)
+        notification, = self._get_notifications()
+        self.assertEqual(3, notification.attempts)
+
+
+class EcmpPluginSqlTestCase(testlib_api.SqlTestCase):
+    """A plugin with a mocked driver, on a router of two interfaces."""
+
+    def setUp(self):
+        super(EcmpPluginSqlTestCase, self).setUp()
+        with mock.patch.object(ecmp_plugin.EcmpPlugin, '__init__', return_value=None):
+            self.plugin = ecmp_plugin.EcmpPlugin()
+        self.plugin.driver = mock.Mock(dispatch_on_commit=False)
+        self.plugin._route_responses = ecmp_cache.GenerationCache(
+            cfg.CONF.ecmp.route_response_cache_size)
+        self.context = n_context.get_admin_context()
+        with self.context.session.begin(subtransactions=True):
+            self.context.session.add(l3_models.Router(
+                id=ROUTER_ID, project_id='project', name='router',
+                admin_state_up=True, status='ACTIVE'))
+        self.router_subnet = _router_subnet(('10.0.0.0/24', PORT_1), ('10.1.0.0/24', PORT_2))
+        mock.patch.object(self.plugin, '_get_router_gw_port_with_cidr',
+                          return_value=self.router_subnet).start()
+
+    def _add_route(self, vip, next_hops, hash_policy=None, router_id=ROUTER_ID):
+        route_id = uuidutils.generate_uuid()
+        with self.context.session.begin(subtransactions=True):
+            self.context.session.add(ecmp_db.EcmpRoute(
+                id=route_id, project_id='project', vip=vip,
+                next_hops=','.join(next_hops), router_id=router_id,
+                hash_policy=hash_policy))
+        return route_id
+
+    def _get_notifications(self):
+        self.context.session.expire_all()
+        query = self.context.session.query(ecmp_db.EcmpNotification)
+        return [jsonutils.loads(n.payload) for n in query.order_by(ecmp_db.EcmpNotification.id)]
+
+    def _qr(self, port_id):
+        return self.plugin._get_router_qr_name(port_id)
+
+
+class TestUpdateEcmpRoute(EcmpPluginSqlTestCase):
+
+    def _update(self, route_id, next_hops):
+        return self.plugin.update_ecmp_route(
+            self.context, route_id, {'ecmp_route': {'next_hops': next_hops}})
+
+    def test_update_replaces_next_hops(self):
+        route_id = self._add_route('192.168.0.1', ['10.0.0.5', '10.1.0.5'])
+        route = self._update(route_id, ['10.0.0.5', '10.0.0.6'])
+        self.assertEqual(['10.0.0.5', '10.0.0.6'], route['next_hops'])
+        self.assertEqual(['10.0.0.5', '10.0.0.6'],
+                         self.plugin.get_ecmp_route(self.context, route_id)['next_hops'])
+        notification, = self._get_notifications()
+        self.assertEqual('replace', notification['operation'])
+        self.assertEqual(['10.0.0.5', '10.0.0.6'], notification['next_hops'])
+        self.assertEqual([self._qr(PORT_1)], notification['set_arp_proxy_qrs'])
+        self.assertEqual([self._qr(PORT_2)], notification['unset_arp_proxy_qrs'])
+        self.assertEqual([self._qr(PORT_1)], notification['qr_interfaces'])
+
+    def test_update_loads_route_once(self):
+        route_id = self._add_route('192.168.0.1', ['10.0.0.5'])
+        self._add_route('192.168.0.2', ['10.1.0.5'])
+        with mock.patch.object(self.plugin, '_lock_ecmproute',
+                               wraps=self.plugin._lock_ecmproute) as lock, \
+                mock.patch.object(self.plugin, '_get_ecmproute') as get, \
+                mock.patch.object(self.plugin, '_get_all_next_hop_ips_of_router') as get_all:
+            self._update(route_id, ['10.0.0.6'])
+        lock.assert_called_once_with(self.context, route_id)
+        self.assertFalse(get.called)
+        self.assertFalse(get_all.called)
+
+    def test_update_without_next_hops_unchanged(self):
+        route_id = self._add_route('192.168.0.1', ['10.0.0.5'])
+        self.assertEqual(['10.0.0.5'], self._update(route_id, [])['next_hops'])
+        self.assertEqual([], self._get_notifications())
+
+    def test_update_invalid_next_hop(self):
+        route_id = self._add_route('192.168.0.1', ['10.0.0.5'])
+        self.assertRaises(exception.EcmpInvalidRoutes,
+                          self._update, route_id, ['10.2.0.5'])
+        self.assertEqual(['10.0.0.5'],
+                         self.plugin.get_ecmp_route(self.context, route_id)['next_hops'])
+        self.assertEqual([], self._get_notifications())
+
+    def test_update_pool_route_fails(self):
+        route_id = self._add_route('192.168.0.1', ['10.0.0.5'])
+        with self.context.session.begin(subtransactions=True):
+            self.context.session.add(ecmp_db.EcmpRoutePool(
+                route_id=route_id, selector_type='tag', selector_value='web'))
+        self.assertRaises(exception.EcmpPoolNextHops,
+                          self._update, route_id, ['10.0.0.6'])
+
+    def test_update_not_found(self):
+        self.assertRaises(exception.EcmprouteNotFound,
+                          self._update, uuidutils.generate_uuid(), ['10.0.0.6'])
+
+
+def _member(ip_address, tags=('web',), port_id=None):
+    return {'id': port_id or uuidutils.generate_uuid(), 'device_owner': 'compute:nova',
+            'tags': list(tags), 'allowed_address_pairs': [],
+            'fixed_ips': [{'subnet_id': 'subnet-id', 'ip_address': ip_address}]}
+
+
+class TestEcmpPools(EcmpPluginSqlTestCase):
+
+    def setUp(self):
+        super(TestEcmpPools, self).setUp()
+        self.core_plugin = mock.Mock()
+        self.core_plugin.get_ports.return_value = [_member('10.0.0.5'), _member('10.1.0.5')]
+        mock.patch('neutron_lib.plugins.directory.get_plugin',
+                   return_value=self.core_plugin).start()
+
+    def _create(self, vip='192.168.0.1', **attrs):
+        ecmp_route = {'tenant_id': 'project', 'router_id': ROUTER_ID, 'vip': vip,
+                      'port_selector': {'tag': 'web'}}
+        ecmp_route.update(attrs)
+        return self.plugin.create_ecmp_route(self.context, {'ecmp_route': ecmp_route})
+
+    def _next_hops(self, route_id):
+        self.context.session.expire_all()
+        return self.plugin.get_ecmp_route(self.context, route_id)['next_hops']
+
+    def test_create_selects_members(self):
+        route = self._create()
+        self.assertEqual(['10.0.0.5', '10.1.0.5'], route['next_hops'])
+        self.assertEqual({'tag': 'web'}, route['port_selector'])
+        filters = self.core_plugin.get_ports.call_args[0][1]
+        self.assertEqual(['web'], filters['tags'])
+
+    def test_create_with_next_hops_and_selector_fails(self):
+        self.assertRaises(exception.EcmpPoolNextHops, self._create,
+                          next_hops=['10.0.0.5'])
+
+    def test_create_with_invalid_selector_fails(self):
+        self.assertRaises(exception.EcmpInvalidPortSelector, self._create,
+                          port_selector={'name': 'web'})
+
+    def test_member_created(self):
+        route_id = self._create()['id']
+        self.plugin.update_ecmp_pools(self.context, _member('10.0.0.6'))
+        self.assertEqual(['10.0.0.5', '10.0.0.6', '10.1.0.5'], self._next_hops(route_id))
+        notification = self._get_notifications()[-1]
+        self.assertEqual(['10.0.0.5', '10.0.0.6', '10.1.0.5'], notification['next_hops'])
+
+    def test_member_untagged(self):
+        route_id = self._create()['id']
+        port = _member('10.0.0.5')
+        self.plugin.update_ecmp_pools(self.context, dict(port, tags=[]),
+                                      original_port=port)
+        self.assertEqual(['10.1.0.5'], self._next_hops(route_id))
+
+    def test_member_deleted(self):
+        route_id = self._create()['id']
+        self.plugin.update_ecmp_pools(self.context, _member('10.1.0.5'), deleted=True)
+        self.assertEqual(['10.0.0.5'], self._next_hops(route_id))
+        notification = self._get_notifications()[-1]
+        self.assertEqual([self._qr(PORT_2)], notification['unset_arp_proxy_qrs'])
+
+    def test_member_outside_router_subnets_ignored(self):
+        route_id = self._create()['id']
+        notifications = len(self._get_notifications())
+        self.plugin.update_ecmp_pools(self.context, _member('10.2.0.5'))
+        self.assertEqual(['10.0.0.5', '10.1.0.5'], self._next_hops(route_id))
+        self.assertEqual(notifications, len(self._get_notifications()))
+
+    def test_router_interface_ignored(self):
+        route_id = self._create()['id']
+        self.plugin.update_ecmp_pools(self.context, _member('10.0.0.1', port_id=PORT_1))
+        self.assertEqual(['10.0.0.5', '10.1.0.5'], self._next_hops(route_id))
+
+    def test_port_of_other_selector_ignored(self):
+        route_id = self._create()['id']
+        with mock.patch.object(self.plugin, '_lock_ecmproute') as lock:
+            self.plugin.update_ecmp_pools(self.context, _member('10.0.0.6', tags=['db']))
+        self.assertFalse(lock.called)
+        self.assertEqual(['10.0.0.5', '10.1.0.5'], self._next_hops(route_id))
+
+
+class TestNextHopWithdrawal(EcmpPluginSqlTestCase):
+
+    def setUp(self):
+        super(TestNextHopWithdrawal, self).setUp()
+        self.route_id = self._add_route('192.168.0.1', ['10.0.0.5', '10.0.0.6'])
+        self.ports = dict((ip, self._port(ip)) for ip in ('10.0.0.5', '10.0.0.6', '10.0.0.7'))
+        self.agents = [{'host': 'host-1', 'alive': True}]
+        self.core_plugin = mock.Mock()
+        self.core_plugin.get_ports.side_effect = self._get_ports
+        self.core_plugin.get_agents.side_effect = lambda context, filters: self.agents
+        mock.patch('neutron_lib.plugins.directory.get_plugin',
+                   return_value=self.core_plugin).start()
+        self.plugin._dead_agent_hosts = set()
+
+    @staticmethod
+    def _port(ip_address, status=n_const.PORT_STATUS_ACTIVE):
+        return {'id': 'port-%s' % ip_address, 'status': status,
+                portbindings.HOST_ID: 'host-1',
+                'fixed_ips': [{'subnet_id': 'subnet-1', 'ip_address': ip_address}]}
+
+    def _get_ports(self, context, filters):
+        if portbindings.HOST_ID in filters:
+            return list(self.ports.values())
+        return [{'id': PORT_1, 'device_id': ROUTER_ID,
+                 'fixed_ips': [{'subnet_id': 'subnet-1', 'ip_address': '10.0.0.1'}]}]
+
+    def _set_status(self, ip_address, status):
+        port = self.ports[ip_address]
+        self.ports[ip_address] = dict(port, status=status)
+        self.plugin.update_port_health(self.context, self.ports[ip_address],
+                                       original_port=port)
+
+    def _route(self):
+        self.context.session.expire_all()
+        return self.plugin.get_ecmp_route(self.context, self.route_id)
+
+    def test_port_down_withdraws_next_hop(self):
+        self._set_status('10.0.0.5', n_const.PORT_STATUS_DOWN)
+        route = self._route()
+        self.assertEqual(['10.0.0.5', '10.0.0.6'], route['next_hops'])
+        self.assertEqual(['10.0.0.6'], route['effective_next_hops'])
+        notification, = self._get_notifications()
+        self.assertEqual(['10.0.0.6'], notification['next_hops'])
+        self.assertIsNone(notification['set_arp_proxy_qrs'])
+        self.plugin.driver.update_ecmp_routes_precommit.assert_called_once_with(
+            mock.ANY, mock.ANY, mock.ANY)
+        original, = self.plugin.driver.update_ecmp_routes_precommit.call_args[0][2]
+        self.assertEqual(['10.0.0.5', '10.0.0.6'], original['effective_next_hops'])
+
+    def test_port_up_restores_next_hop(self):
+        self._set_status('10.0.0.5', n_const.PORT_STATUS_DOWN)
+        self._set_status('10.0.0.5', n_const.PORT_STATUS_ACTIVE)
+        self.assertEqual(['10.0.0.5', '10.0.0.6'], self._route()['effective_next_hops'])
+        self.assertEqual(['10.0.0.5', '10.0.0.6'], self._get_notifications()[-1]['next_hops'])
+
+    def test_all_next_hops_down_keeps_them(self):
+        self._set_status('10.0.0.5', n_const.PORT_STATUS_DOWN)
+        self._set_status('10.0.0.6', n_const.PORT_STATUS_DOWN)
+        self.assertEqual(['10.0.0.5', '10.0.0.6'], self._route()['effective_next_hops'])
+
+    def test_port_not_next_hop_ignored(self):
+        self._set_status('10.0.0.7', n_const.PORT_STATUS_DOWN)
+        self.assertEqual([], self._get_notifications())
+        self.assertFalse(self.plugin.driver.update_ecmp_routes_precommit.called)
+
+    def test_dead_agent_withdraws_its_next_hops(self):
+        self.ports.pop('10.0.0.6')
+        self.agents = [{'host': 'host-1', 'alive': False}]
+        self.plugin._check_next_hop_agents()
+        self.assertEqual(['10.0.0.6'], self._route()['effective_next_hops'])
+        # checked again while dead, nothing changes
+        notifications = len(self._get_notifications())
+        self.plugin._check_next_hop_agents()
+        self.assertEqual(notifications, len(self._get_notifications()))
+
+    def test_revived_agent_restores_its_next_hops(self):
+        self.ports.pop('10.0.0.6')
+        self.agents = [{'host': 'host-1', 'alive': False}]
+        self.plugin._check_next_hop_agents()
+        self.agents = [{'host': 'host-1', 'alive': True}]
+        self.plugin._check_next_hop_agents()
+        self.assertEqual(['10.0.0.5', '10.0.0.6'], self._route()['effective_next_hops'])
+
+    def test_withdrawn_until_every_reason_is_gone(self):
+        self.ports.pop('10.0.0.6')
+        self._set_status('10.0.0.5', n_const.PORT_STATUS_DOWN)
+        self.agents = [{'host': 'host-1', 'alive': False}]
+        self.plugin._check_next_hop_agents()
+        self._set_status('10.0.0.5', n_const.PORT_STATUS_ACTIVE)
+        self.assertEqual(['10.0.0.6'], self._route()['effective_next_hops'])
+        self.agents = [{'host': 'host-1', 'alive': True}]
+        self.plugin._check_next_hop_agents()
+        self.assertEqual(['10.0.0.5', '10.0.0.6'], self._route()['effective_next_hops'])
+
+    def test_next_hop_removed_from_routes_forgotten(self):
+        self._set_status('10.0.0.5', n_const.PORT_STATUS_DOWN)
+        update = {'ecmp_route': {'next_hops': ['10.0.0.6']}}
+        self.plugin.update_ecmp_route(self.context, self.route_id, update)
+        update = {'ecmp_route': {'next_hops': ['10.0.0.5', '10.0.0.6']}}
+        self.plugin.update_ecmp_route(self.context, self.route_id, update)
+        self.assertEqual(['10.0.0.5', '10.0.0.6'], self._route()['effective_next_hops'])
+
+
+class TestHashPolicy(EcmpPluginSqlTestCase):
+
+    def _create(self, vip, hash_policy=None, router_id=ROUTER_ID):
+        return self.plugin.create_ecmp_route(self.context, {'ecmp_route': {
+            'tenant_id': 'project', 'router_id': router_id, 'vip': vip,
+            'next_hops': ['10.0.0.5'], 'hash_policy': hash_policy}})
+
+    def test_routes_of_router_share_policy(self):
+        self._create('192.168.0.1', 'L4')
+        self._create('192.168.0.2', 'L4')
+        self._create('192.168.0.3')
+        self.assertRaises(exception.EcmpHashPolicyConflict,
+                          self._create, '192.168.0.4', 'L3-inner')
+        self.assertEqual(['L4', 'L4', None],
+                         [n['hash_policy'] for n in self._get_notifications()])
+
+    def test_policy_of_other_router_ignored(self):
+        router_id = uuidutils.generate_uuid()
+        with self.context.session.begin(subtransactions=True):
+            self.context.session.add(l3_models.Router(
+                id=router_id, project_id='project', name='router-2',
+                admin_state_up=True, status='ACTIVE'))
+        self._add_route('192.168.0.1', ['10.0.0.5'], hash_policy='L3-inner',
+                        router_id=router_id)
+        self.assertEqual('L4', self._create('192.168.0.1', 'L4')['hash_policy'])
+
+    def test_route_of_router_carries_its_policy(self):
+        self._add_route('192.168.0.1', ['10.0.0.5'], hash_policy='L4')
+        self._add_route('192.168.0.2', ['10.0.0.5'])
+        routes = self.plugin.get_route_of_router(self.context, ROUTER_ID, 'host-1')
+        self.assertEqual({'192.168.0.1': 'L4', '192.168.0.2': None},
+                         dict((route['vip'], route['hash_policy']) for route in routes))
+
+
+class TestChangedRoutesOfRouters(EcmpPluginSqlTestCase):
+
+    def setUp(self):
+        super(TestChangedRoutesOfRouters, self).setUp()
+        self.route_ids = [self._add_route('192.168.0.1', ['10.0.0.5', '10.0.0.6']),
+                          self._add_route('192.168.0.2', ['10.1.0.5'])]
+
+    def _digest(self, route_ids=None):
+        routes = []
+        for route in self.plugin.get_ecmp_routes(self.context):
+            if route_ids is None or route['id'] in route_ids:
+                routes.append({'id': route['id'], 'revision': route['revision_number'],
+                               'next_hops': route['next_hops']})
+        return ecmp_digest.get_routes_digest(routes)
+
+    def _get_changed(self, digests):
+        return self.plugin.get_changed_routes_of_routers(self.context, 'host-1', digests)
+
+    def test_unchanged_router(self):
+        self.assertEqual({}, self._get_changed({ROUTER_ID: self._digest()}))
+
+    def test_changed_router_returns_its_routes(self):
+        changed = self._get_changed({ROUTER_ID: self._digest(self.route_ids[:1])})
+        self.assertEqual(['192.168.0.1', '192.168.0.2'],
+                         sorted(route['vip'] for route in changed[ROUTER_ID]))
+
+    def test_deleted_router(self):
+        router_id = uuidutils.generate_uuid()
+        self.assertEqual({router_id: []}, self._get_changed(
+            {router_id: self._digest(self.route_ids)}))
+        self.assertEqual({}, self._get_changed(
+            {router_id: ecmp_digest.get_routes_digest([])}))
+
+    def test_withdrawn_next_hop_changes_digest(self):
+        digest = self._digest()
+        with self.context.session.begin(subtransactions=True):
+            self.context.session.add(ecmp_db.EcmpWithdrawnNextHop(
+                router_id=ROUTER_ID, ip_address='10.0.0.5', reason='port_down',
+                port_id='port-id'))
+        changed = self._get_changed({ROUTER_ID: digest})
+        route, = [route for route in changed[ROUTER_ID] if route['vip'] == '192.168.0.1']
+        self.assertEqual(['10.0.0.6'], route['next_hops'])
+
+
+class TestRouteOfRouterIfChanged(EcmpPluginSqlTestCase):
+
+    def setUp(self):
+        super(TestRouteOfRouterIfChanged, self).setUp()
+        self.route_id = self._add_route('192.168.0.1', ['10.0.0.5', '10.1.0.5'])
+
+    def _get(self, revision=None):
+        return self.plugin.get_route_of_router_if_changed(
+            self.context, ROUTER_ID, 'host-1', revision=revision)
+
+    def _bump(self, routes=True, interfaces=False):
+        with self.context.session.begin(subtransactions=True):
+            self.plugin._bump_router_generations(
+                self.context, [ROUTER_ID], routes=routes, interfaces=interfaces)
+
+    def test_router_without_revision(self):
+        response = self._get()
+        self.assertIsNone(response['revision'])
+        self.assertEqual(['192.168.0.1'], [route['vip'] for route in response['routes']])
+        self.assertEqual(sorted([self._qr(PORT_1), self._qr(PORT_2)]),
+                         sorted(response['routes'][0]['qr_interfaces']))
+        # always sent again
+        self.assertIsNotNone(self._get(response['revision'])['routes'])
+
+    def test_not_modified(self):
+        self._bump()
+        response = self._get()
+        self.assertEqual('1.0', response['revision'])
+        self.assertEqual({'revision': '1.0', 'routes': None}, self._get('1.0'))
+        self.assertIsNotNone(self._get('0.1')['routes'])
+
+    def test_response_cached_per_generation(self):
+        self._bump()
+        with mock.patch.object(self.plugin, '_get_ecmproute_by_router_id',
+                               wraps=self.plugin._get_ecmproute_by_router_id) as read:
+            first = self._get()['routes']
+            self.assertIs(first, self._get()['routes'])
+            self.assertEqual(1, read.call_count)
+            self._bump(routes=False, interfaces=True)
+            self.assertEqual('1.1', self._get()['revision'])
+            self.assertEqual(2, read.call_count)
+
+    def test_route_change_modifies_revision(self):
+        self._bump()
+        revision = self._get()['revision']
+        self.plugin.update_ecmp_route(self.context, self.route_id,
+                                      {'ecmp_route': {'next_hops': ['10.0.0.6']}})
+        response = self._get(revision)
+        self.assertEqual('2.0', response['revision'])
+        self.assertEqual(['10.0.0.6'], response['routes'][0]['next_hops'])
+
+
+class TestPurgeAndResyncRouters(EcmpPluginSqlTestCase):
+
+    def setUp(self):
+        super(TestPurgeAndResyncRouters, self).setUp()
+        self.other_router_id = uuidutils.generate_uuid()
+        with self.context.session.begin(subtransactions=True):
+            self.context.session.add(l3_models.Router(
+                id=self.other_router_id, project_id='project', name='router-2',
+                admin_state_up=True, status='ACTIVE'))
+        self.plugin.driver.resync_routers.return_value = set()
+
+    def test_purge_discards_pending_notifications(self):
+        for router_id in (ROUTER_ID, self.other_router_id):
+            self.plugin._rpc_notify_ecmp_route(self.context, 'replace', '192.168.0.1',
+                                               ['10.0.0.5'], router_id)
+        self.plugin.purge_ecmp_routers(self.context, [ROUTER_ID])
+        self.assertEqual([self.other_router_id],
+                         [n['router_id'] for n in self._get_notifications()])
+        self.plugin.driver.purge_routers.assert_called_once_with(self.context, [ROUTER_ID])
+
+    def test_purge_failure_logged(self):
+        self.plugin.driver.purge_routers.side_effect = RuntimeError('boom')
+        self.plugin.purge_ecmp_routers(self.context, [ROUTER_ID])
+
+    def test_interface_delete_resyncs_router_with_routes(self):
+        self._add_route('192.168.0.1', ['10.0.0.5'])
+        self.plugin.resync_ecmp_routers_of_interface(self.context, ROUTER_ID)
+        self.plugin.driver.resync_routers.assert_called_once_with(self.context, [ROUTER_ID])
+
+    def test_interface_delete_ignores_router_without_routes(self):
+        self.plugin.resync_ecmp_routers_of_interface(self.context, self.other_router_id)
+        self.assertFalse(self.plugin.driver.resync_routers.called)